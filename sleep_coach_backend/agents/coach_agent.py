@@ -1,42 +1,49 @@
-import os
 import json
-from dotenv import load_dotenv
-from typing import List, Dict, Any
+from collections import Counter
+from typing import List, Dict, Any, AsyncIterator, Optional
 
 from models.sleep_entry import SleepEntry
+from settings import Settings, get_settings
 from ollama_client import OllamaClient
+from ollama_scheduler import OllamaOverloadedError
+from json_stream import JsonArrayStreamParser
+from metrics import LLM_PARSE_FAILURES
+from tracing import debug_log
 
-# Load .env from the project root
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
-if not os.path.exists(dotenv_path):
-    dotenv_path_alt = os.path.join(os.path.dirname(__file__), '..', '.env')
-    if os.path.exists(dotenv_path_alt):
-        dotenv_path = dotenv_path_alt
-    else:
-        dotenv_path_cwd = os.path.join(os.path.dirname(__file__), '.env')
-        if os.path.exists(dotenv_path_cwd):
-            dotenv_path = dotenv_path_cwd
-        else:
-            dotenv_path_parent_of_agents = os.path.join(os.path.dirname(__file__), '..', '.env')
-            if os.path.exists(dotenv_path_parent_of_agents):
-                dotenv_path = dotenv_path_parent_of_agents
-            else:
-                print(f"Warning: .env file not found at primary path: {os.path.join(os.path.dirname(__file__), '..', '..', '.env')} or fallbacks.")
-load_dotenv(dotenv_path=dotenv_path if os.path.exists(dotenv_path) else None, override=True)
+# Structured output schema for streamed tips: a bare JSON array of strings
+TIPS_ARRAY_SCHEMA: Dict[str, Any] = {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 3}
+
+# Static instructions, sent as the system prompt ahead of the user's data so Ollama can reuse
+# their evaluated tokens across requests (see OllamaClient.generate)
+TIPS_RESPONSE_FORMAT = """Return your response strictly as a JSON array of 3 strings. For example: ["Tip 1 about issue X", "Tip 2 about issue Y", "Tip 3 general advice"].
+Do not wrap the array in any other JSON object. The output should be the array itself."""
+COACHING_SYSTEM_PROMPT = f"""You are a helpful and concise sleep coach.
+The user shares their sleep data for one night, the issues identified by their sleep analysis and sometimes a summary of their longer-term sleep history.
+Suggest exactly 3 actionable and personalized tips to help them improve their sleep quality, focusing on the identified issues if any.
+{TIPS_RESPONSE_FORMAT}"""
+PERIOD_COACHING_SYSTEM_PROMPT = f"""You are a helpful and concise sleep coach.
+The user shares their sleep over a period of nights: averages, the nightly data (date: total/REM/deep/core minutes) and the issues identified across the period.
+Suggest exactly 3 actionable and personalized tips to help them improve their sleep quality over the coming nights, focusing on the most frequent issues if any.
+{TIPS_RESPONSE_FORMAT}"""
 
 class CoachAgent:
-    def __init__(self, ollama_client: OllamaClient):
+    def __init__(self, ollama_client: OllamaClient, priority: str = "interactive", settings: Optional[Settings] = None):
+        settings = settings or get_settings()
         self.ollama_client = ollama_client
-        self.model_name = os.getenv("OLLAMA_COACH_MODEL_NAME", "llama3")  # Default to llama3 as per original spec
-        if ':' not in self.model_name:
-            self.model_name += ':latest'
-        print(f"CoachAgent initialized with model: {self.model_name}")
+        self.priority = priority # Scheduler priority class for this agent's LLM calls
+        self.model_name = settings.coach_model # Defaults to llama3 as per original spec
+        self.budget = settings.coach_budget
+        self.early_stop = settings.early_stop
+        # Nights listed individually in a period coaching prompt, older nights only count towards the averages
+        self.period_max_nights = settings.coach_period_max_nights
+        debug_log(f"CoachAgent initialized with model: {self.model_name}")
 
-    async def _construct_coaching_prompt(self, sleep_entry: SleepEntry, issues: List[str]) -> str:
+    async def _construct_coaching_prompt(self, sleep_entry: SleepEntry, issues: List[str], history_summary: Optional[str] = None) -> str:
         issues_str = ", ".join(issues) if issues else "No specific issues identified, but general sleep quality can always be improved."
+        # Optional longer-term context from analytics/columnar.py (COACH_HISTORY_DAYS)
+        history_str = f"\nMy longer-term sleep history:\n{history_summary}\n" if history_summary else ""
         
-        prompt = f"""SYSTEM: You are a helpful and concise sleep coach.
-USER: My recent sleep data is as follows:
+        prompt = f"""My recent sleep data is as follows:
 - Date: {sleep_entry.date.isoformat()}
 - Bedtime: {sleep_entry.bedtime.isoformat()}
 - Waketime: {sleep_entry.waketime.isoformat()}
@@ -44,85 +51,217 @@ USER: My recent sleep data is as follows:
 - REM Sleep: {sleep_entry.rem_minutes} minutes
 - Deep Sleep: {sleep_entry.deep_minutes} minutes
 - Core Sleep: {sleep_entry.core_minutes} minutes
-
-Identified issues from my sleep analysis: {issues_str}
-
-Suggest exactly 3 actionable and personalized tips to help me improve my sleep quality, focusing on the identified issues if any. 
-Return your response strictly as a JSON array of 3 strings. For example: ["Tip 1 about issue X", "Tip 2 about issue Y", "Tip 3 general advice"].
-Do not wrap the array in any other JSON object. The output should be the array itself.
-"""
+{history_str}
+Identified issues from my sleep analysis: {issues_str}"""
         return prompt
 
-    async def generate_coaching_tips(self, sleep_entry: SleepEntry, issues: List[str]) -> List[str]:
-        prompt = await self._construct_coaching_prompt(sleep_entry, issues)
+    async def generate_coaching_tips(self, sleep_entry: SleepEntry, issues: List[str], history_summary: Optional[str] = None) -> List[str]:
+        prompt = await self._construct_coaching_prompt(sleep_entry, issues, history_summary)
         
-        print(f"CoachAgent: Generating coaching tips with model {self.model_name}.")
-        print(f"Prompt being sent:\n{prompt}")
+        debug_log(f"CoachAgent: Generating coaching tips with model {self.model_name}.")
+        debug_log(f"Prompt being sent:\n{COACHING_SYSTEM_PROMPT}\n\n{prompt}")
 
         try:
             response_data = await self.ollama_client.generate(
                 model_name=self.model_name,
                 prompt=prompt,
+                system=COACHING_SYSTEM_PROMPT,
                 stream=False,
-                output_format="json"  # Request JSON output
+                output_format="json",  # Request JSON output
+                priority=self.priority,
+                budget=self.budget,
+                early_stop=self.early_stop,
             )
             
             llm_output_str = response_data.get("response")
             if not llm_output_str:
                 print("Error: Coach LLM response did not contain a 'response' field.")
+                LLM_PARSE_FAILURES.inc(agent="coach", branch="empty_response")
                 return ["Error: Coach LLM did not provide a response string."]
 
-            print(f"Coach LLM raw output string for tips: {llm_output_str}")
+            debug_log(f"Coach LLM raw output string for tips: {llm_output_str}")
             
-            try:
-                # Attempt to parse the string as JSON. It might be a JSON object or directly a JSON array string.
-                parsed_llm_json: Any = json.loads(llm_output_str)
-                tips_list: List[str] = []
-
-                if isinstance(parsed_llm_json, list):
-                    if all(isinstance(item, str) for item in parsed_llm_json):
-                        tips_list = parsed_llm_json
-                    else:
-                        print(f"Warning: Coach LLM returned a list, but not all items are strings: {parsed_llm_json}")
-                        tips_list = [str(item) for item in parsed_llm_json] # Fallback
-                elif isinstance(parsed_llm_json, dict):
-                    print(f"Info: Coach LLM returned a JSON object. Attempting to extract tips list. Object: {parsed_llm_json}")
-                    # New logic: if the dict values are the tips themselves
-                    potential_tips_from_values = list(parsed_llm_json.values())
-                    if all(isinstance(value, str) for value in potential_tips_from_values):
-                        tips_list = potential_tips_from_values
-                        print(f"Extracted tips from JSON object values: {tips_list}")
-                    else:
-                        # Try to find a list of strings within the dict, similar to SleepAnalyzerAgent
-                        found_key = None
-                        for key_attempt in ["tips", "suggestions", "response"]:
-                            if key_attempt in parsed_llm_json and isinstance(parsed_llm_json[key_attempt], list) and all(isinstance(i,str) for i in parsed_llm_json[key_attempt]):
-                                found_key = key_attempt
-                                break
-                        if found_key:
-                            tips_list = parsed_llm_json[found_key]
-                        else:
-                            print("Warning: Coach LLM returned a JSON object, but no known tips key with a list of strings found, and values were not all strings.")
-                else:
-                    print(f"Error: Coach LLM output was neither a list nor a dict after JSON parsing. Output: {parsed_llm_json}")
-                    return ["Error: Coach LLM output was not a recognized JSON structure."]
-                
-                # Ensure we return exactly 3 tips if possible, or pad/truncate if LLM misbehaves
-                if len(tips_list) > 3:
-                    tips_list = tips_list[:3]
-                # elif len(tips_list) < 3 and len(tips_list) > 0: # Don't pad if LLM gave specific (but fewer) valid tips
-                #    tips_list.extend(["Consider general sleep hygiene."] * (3 - len(tips_list)))
-                elif not tips_list: # LLM failed to provide valid tips
-                    tips_list = ["Could not generate specific tips at this time. Please review your sleep habits."]
-
-                print(f"Generated tips: {tips_list}")
-                return tips_list
-
-            except json.JSONDecodeError as e:
-                print(f"Error: Failed to parse Coach LLM's response string as JSON. Error: {e}. LLM String: {llm_output_str}")
-                return [f"Error: Could not parse Coach LLM JSON output - {llm_output_str}"]
+            return self._parse_tips_output(llm_output_str)
 
+        except OllamaOverloadedError:
+            raise # Admission control rejections are surfaced to the caller (503 + Retry-After)
         except Exception as e:
             error_message = f"Coaching tip generation failed: {str(e)}"
             print(error_message)
-            return [error_message] 
\ No newline at end of file
+            return [error_message]
+
+    async def _construct_period_coaching_prompt(self, sleep_entries: List[SleepEntry], issues_per_entry: List[List[str]]) -> str:
+        count = len(sleep_entries)
+        ordered = sorted(zip(sleep_entries, issues_per_entry), key=lambda pair: pair[0].date)
+        averages = {
+            field: round(sum(getattr(entry, field) for entry in sleep_entries) / count)
+            for field in ("duration_minutes", "rem_minutes", "deep_minutes", "core_minutes")
+        }
+        # Only the most recent nights are listed one by one to keep the prompt short for long syncs
+        nightly_lines = "\n".join(
+            f"- {entry.date.isoformat()}: {entry.duration_minutes}/{entry.rem_minutes}/{entry.deep_minutes}/{entry.core_minutes}"
+            for entry, _ in ordered[-self.period_max_nights:]
+        )
+        issue_counts = Counter(issue for _, issues in ordered for issue in issues)
+        issues_str = ", ".join(f"{issue} ({nights} of {count} nights)" for issue, nights in issue_counts.most_common()) \
+            or "No specific issues identified, but general sleep quality can always be improved."
+
+        prompt = f"""My sleep over {count} nights ({ordered[0][0].date.isoformat()} to {ordered[-1][0].date.isoformat()}) was as follows:
+- Average Total Duration: {averages['duration_minutes']} minutes
+- Average REM Sleep: {averages['rem_minutes']} minutes
+- Average Deep Sleep: {averages['deep_minutes']} minutes
+- Average Core Sleep: {averages['core_minutes']} minutes
+
+Nightly data (date: total/REM/deep/core minutes):
+{nightly_lines}
+
+Identified issues across the period: {issues_str}"""
+        return prompt
+
+    async def generate_period_coaching_tips(self, sleep_entries: List[SleepEntry], issues_per_entry: List[List[str]]) -> List[str]:
+        """
+        One coaching generation for a whole period (e.g. a batch synced after being offline)
+        instead of one per night. issues_per_entry is aligned with sleep_entries.
+        """
+        prompt = await self._construct_period_coaching_prompt(sleep_entries, issues_per_entry)
+
+        debug_log(f"CoachAgent: Generating period coaching tips for {len(sleep_entries)} nights with model {self.model_name}.")
+        debug_log(f"Prompt being sent:\n{PERIOD_COACHING_SYSTEM_PROMPT}\n\n{prompt}")
+
+        try:
+            response_data = await self.ollama_client.generate(
+                model_name=self.model_name,
+                prompt=prompt,
+                system=PERIOD_COACHING_SYSTEM_PROMPT,
+                stream=False,
+                output_format="json",
+                priority=self.priority,
+                budget=self.budget,
+                early_stop=self.early_stop,
+            )
+            llm_output_str = response_data.get("response")
+            if not llm_output_str:
+                print("Error: Coach LLM response did not contain a 'response' field.")
+                LLM_PARSE_FAILURES.inc(agent="coach", branch="empty_response")
+                return ["Error: Coach LLM did not provide a response string."]
+
+            debug_log(f"Coach LLM raw output string for period tips: {llm_output_str}")
+            return self._parse_tips_output(llm_output_str)
+
+        except OllamaOverloadedError:
+            raise
+        except Exception as e:
+            error_message = f"Coaching tip generation failed: {str(e)}"
+            print(error_message)
+            return [error_message]
+
+    def _parse_tips_output(self, llm_output_str: str) -> List[str]:
+        """Parses the coach LLM's raw output into at most 3 tip strings (or an error string)."""
+        try:
+            # Attempt to parse the string as JSON. It might be a JSON object or directly a JSON array string.
+            parsed_llm_json: Any = json.loads(llm_output_str)
+            tips_list: List[str] = []
+
+            if isinstance(parsed_llm_json, list):
+                if all(isinstance(item, str) for item in parsed_llm_json):
+                    tips_list = parsed_llm_json
+                else:
+                    print(f"Warning: Coach LLM returned a list, but not all items are strings: {parsed_llm_json}")
+                    LLM_PARSE_FAILURES.inc(agent="coach", branch="non_string_items")
+                    tips_list = [str(item) for item in parsed_llm_json] # Fallback
+            elif isinstance(parsed_llm_json, dict):
+                print(f"Info: Coach LLM returned a JSON object. Attempting to extract tips list. Object: {parsed_llm_json}")
+                # New logic: if the dict values are the tips themselves
+                potential_tips_from_values = list(parsed_llm_json.values())
+                if all(isinstance(value, str) for value in potential_tips_from_values):
+                    tips_list = potential_tips_from_values
+                    debug_log(f"Extracted tips from JSON object values: {tips_list}")
+                    LLM_PARSE_FAILURES.inc(agent="coach", branch="object_values")
+                else:
+                    # Try to find a list of strings within the dict, similar to SleepAnalyzerAgent
+                    found_key = None
+                    for key_attempt in ["tips", "suggestions", "response"]:
+                        if key_attempt in parsed_llm_json and isinstance(parsed_llm_json[key_attempt], list) and all(isinstance(i,str) for i in parsed_llm_json[key_attempt]):
+                            found_key = key_attempt
+                            break
+                    if found_key:
+                        tips_list = parsed_llm_json[found_key]
+                        LLM_PARSE_FAILURES.inc(agent="coach", branch="object_key")
+                    else:
+                        print("Warning: Coach LLM returned a JSON object, but no known tips key with a list of strings found, and values were not all strings.")
+                        LLM_PARSE_FAILURES.inc(agent="coach", branch="object_unrecognized")
+            else:
+                print(f"Error: Coach LLM output was neither a list nor a dict after JSON parsing. Output: {parsed_llm_json}")
+                LLM_PARSE_FAILURES.inc(agent="coach", branch="unrecognized_structure")
+                return ["Error: Coach LLM output was not a recognized JSON structure."]
+
+            # Ensure we return exactly 3 tips if possible, or pad/truncate if LLM misbehaves
+            if len(tips_list) > 3:
+                tips_list = tips_list[:3]
+            # elif len(tips_list) < 3 and len(tips_list) > 0: # Don't pad if LLM gave specific (but fewer) valid tips
+            #    tips_list.extend(["Consider general sleep hygiene."] * (3 - len(tips_list)))
+            elif not tips_list: # LLM failed to provide valid tips
+                LLM_PARSE_FAILURES.inc(agent="coach", branch="no_tips")
+                tips_list = ["Could not generate specific tips at this time. Please review your sleep habits."]
+
+            debug_log(f"Generated tips: {tips_list}")
+            return tips_list
+
+        except json.JSONDecodeError as e:
+            print(f"Error: Failed to parse Coach LLM's response string as JSON. Error: {e}. LLM String: {llm_output_str}")
+            LLM_PARSE_FAILURES.inc(agent="coach", branch="invalid_json")
+            return [f"Error: Could not parse Coach LLM JSON output - {llm_output_str}"]
+
+    async def stream_coaching_tips(self, sleep_entry: SleepEntry, issues: List[str], history_summary: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Streams coaching tips one by one, each yielded as soon as it has been decoded from the
+        LLM's token stream. The model is constrained to a JSON array of strings so tips can be
+        picked out of the array incrementally. If nothing could be decoded incrementally, the
+        full output goes through the regular parsing once the stream ends.
+        Raises Ollama/network errors to the caller instead of returning error strings.
+        """
+        prompt = await self._construct_coaching_prompt(sleep_entry, issues, history_summary)
+
+        debug_log(f"CoachAgent: Streaming coaching tips with model {self.model_name}.")
+        debug_log(f"Prompt being sent:\n{COACHING_SYSTEM_PROMPT}\n\n{prompt}")
+
+        parser = JsonArrayStreamParser()
+        output_parts: List[str] = []
+        tips_sent = 0
+        stream = self.ollama_client.stream_generate(
+            model_name=self.model_name,
+            prompt=prompt,
+            system=COACHING_SYSTEM_PROMPT,
+            output_format=TIPS_ARRAY_SCHEMA,
+            options=self.budget.apply(),
+            priority=self.priority,
+        )
+        parser_failed = False
+        try:
+            async for chunk in stream:
+                text = chunk.get("response", "")
+                output_parts.append(text)
+                if parser_failed:
+                    continue # Only collecting the output for the full parsing below
+                try:
+                    elements = parser.feed(text)
+                except ValueError as e:
+                    print(f"Warning: Coach LLM stream is not a plain JSON array, falling back to full parsing: {e}")
+                    LLM_PARSE_FAILURES.inc(agent="coach", branch="stream_not_array")
+                    # The parser can't recover: keep the tips already sent, or parse the whole output once
+                    parser_failed = True
+                    if tips_sent:
+                        break
+                    continue
+                for element in elements:
+                    if tips_sent < 3:
+                        tips_sent += 1
+                        yield str(element)
+                if tips_sent >= 3 or parser.finished:
+                    break # Everything we need has been decoded, stop the generation early
+        finally:
+            await stream.aclose()
+
+        if tips_sent == 0:
+            for tip in self._parse_tips_output("".join(output_parts)):
+                yield tip
@@ -0,0 +1,137 @@
+import json
+from typing import List, Dict, Any, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from models.sleep_entry import SleepEntry
+from settings import Settings, get_settings
+from ollama_client import OllamaClient
+from ollama_scheduler import OllamaOverloadedError
+from agents.rule_engine import RuleEngine
+from agents.sleep_analyzer import ANALYZER_BACKENDS
+from metrics import LLM_PARSE_FAILURES
+from tracing import debug_log
+
+# Ollama structured output: the model is constrained to emit exactly this shape
+INSIGHT_RESPONSE_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "issues": {"type": "array", "items": {"type": "string"}},
+        "tips": {"type": "array", "items": {"type": "string"}, "minItems": 3, "maxItems": 3},
+    },
+    "required": ["issues", "tips"],
+}
+
+class InsightResponse(BaseModel):
+    issues: List[str]
+    tips: List[str]
+
+class SleepInsightAgent:
+    """
+    Combined analysis + coaching in a single generation (PIPELINE_MODE=combined).
+    Replaces the analyzer -> coach round trips with one call whose output is constrained by
+    INSIGHT_RESPONSE_SCHEMA, so the response can be validated directly instead of going
+    through the per-agent fallback parsing.
+    """
+
+    def __init__(self, ollama_client: OllamaClient, rule_engine: RuleEngine, backend: Optional[str] = None, priority: str = "interactive", settings: Optional[Settings] = None):
+        settings = settings or get_settings()
+        self.ollama_client = ollama_client
+        self.rule_engine = rule_engine
+        self.priority = priority # Scheduler priority class for this agent's LLM calls
+        self.model_name = settings.insight_model
+        self.backend = (backend or settings.analyzer_backend).lower()
+        if self.backend not in ANALYZER_BACKENDS:
+            raise ValueError(f"Unsupported ANALYZER_BACKEND '{self.backend}'. Expected one of {ANALYZER_BACKENDS}.")
+        self.budget = settings.insight_budget
+        self.early_stop = settings.early_stop
+        # The instructions only depend on the backend and the rules: built once and sent as the
+        # system prompt, so Ollama reuses their evaluated tokens across requests
+        if self.backend == "llm":
+            issues_instruction = f"""First identify sleep quality issues using these thresholds:
+{self.rule_engine.describe()}
+Put the exact issue descriptions whose conditions are met in "issues" (an empty array if none)."""
+        elif self.backend == "rules":
+            issues_instruction = """The issues identified by their sleep analysis are given with the data.
+Leave "issues" as an empty array, the analysis is already done."""
+        else:
+            issues_instruction = """The issues a rule engine has already found are given with the data.
+Put any other noteworthy issues the rules do not cover in "issues" (an empty array if none). Do not repeat the issues already found."""
+        self.system_prompt = f"""You are a helpful and concise sleep coach. The user shares their sleep data for one night.
+{issues_instruction}
+Then put exactly 3 actionable and personalized tips to improve their sleep quality in "tips", focusing on all identified issues if any.
+Respond with a JSON object of the form {{"issues": [...], "tips": ["Tip 1", "Tip 2", "Tip 3"]}}."""
+        debug_log(f"SleepInsightAgent initialized with backend: {self.backend}, model: {self.model_name}")
+
+    async def _construct_insight_prompt(self, sleep_entry: SleepEntry, rule_issues: Optional[List[str]]) -> str:
+        """The per-night part of the prompt; the instructions are in self.system_prompt."""
+        if rule_issues is None:
+            issues_line = ""
+        elif self.backend == "rules":
+            rule_issues_str = ", ".join(rule_issues) if rule_issues else "No specific issues identified, but general sleep quality can always be improved."
+            issues_line = f"\n\nIdentified issues from my sleep analysis: {rule_issues_str}"
+        else:
+            rule_issues_str = ", ".join(rule_issues) if rule_issues else "none"
+            issues_line = f"\n\nIssues already found by the rule engine: {rule_issues_str}"
+
+        prompt = f"""My recent sleep data is as follows:
+- Date: {sleep_entry.date.isoformat()}
+- Bedtime: {sleep_entry.bedtime.isoformat()}
+- Waketime: {sleep_entry.waketime.isoformat()}
+- Total Duration: {sleep_entry.duration_minutes} minutes
+- REM Sleep: {sleep_entry.rem_minutes} minutes
+- Deep Sleep: {sleep_entry.deep_minutes} minutes
+- Core Sleep: {sleep_entry.core_minutes} minutes{issues_line}"""
+        return prompt
+
+    async def analyze_and_coach(self, sleep_entry: SleepEntry) -> Tuple[List[str], List[str]]:
+        """
+        Returns (analysis_issues, coaching_suggestions) from one LLM generation.
+        Threshold issues come from the rule engine unless ANALYZER_BACKEND=llm.
+        """
+        rule_issues = None if self.backend == "llm" else self.rule_engine.evaluate(sleep_entry)
+        prompt = await self._construct_insight_prompt(sleep_entry, rule_issues)
+
+        debug_log(f"SleepInsightAgent: Generating analysis and tips for {sleep_entry.date} with model {self.model_name}.")
+        debug_log(f"Prompt being sent:\n{self.system_prompt}\n\n{prompt}")
+
+        try:
+            response_data = await self.ollama_client.generate(
+                model_name=self.model_name,
+                prompt=prompt,
+                system=self.system_prompt,
+                stream=False,
+                output_format=INSIGHT_RESPONSE_SCHEMA,
+                priority=self.priority,
+                budget=self.budget,
+                early_stop=self.early_stop,
+            )
+            llm_output_str = response_data.get("response")
+            if not llm_output_str:
+                print("Error: Insight LLM response did not contain a 'response' field.")
+                LLM_PARSE_FAILURES.inc(agent="insight", branch="empty_response")
+                return rule_issues or [], ["Error: Insight LLM did not provide a response string."]
+
+            debug_log(f"Insight LLM raw output string: {llm_output_str}")
+            try:
+                insight = InsightResponse.model_validate(json.loads(llm_output_str))
+            except (json.JSONDecodeError, ValidationError) as e:
+                print(f"Error: Insight LLM output did not match the response schema. Error: {e}. LLM String: {llm_output_str}")
+                LLM_PARSE_FAILURES.inc(agent="insight", branch="schema_mismatch")
+                return rule_issues or [], [f"Error: Could not parse Insight LLM JSON output - {llm_output_str}"]
+
+        except OllamaOverloadedError:
+            raise # Admission control rejections are surfaced to the caller (503 + Retry-After)
+        except Exception as e:
+            error_message = f"Combined analysis and coaching failed: {str(e)}"
+            print(error_message)
+            return rule_issues or [], [error_message]
+
+        if not insight.tips:
+            LLM_PARSE_FAILURES.inc(agent="insight", branch="no_tips")
+        tips = insight.tips[:3] or ["Could not generate specific tips at this time. Please review your sleep habits."]
+        if rule_issues is None:
+            return insight.issues, tips
+        if self.backend == "rules":
+            return rule_issues, tips
+        return rule_issues + [issue for issue in insight.issues if issue not in rule_issues], tips
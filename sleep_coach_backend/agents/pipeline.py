@@ -0,0 +1,154 @@
+import json
+import hashlib
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models.sleep_entry import SleepEntry
+from settings import Settings
+from ollama_client import OllamaClient
+from agents.sleep_collector import SleepCollectorAgent
+from agents.sleep_analyzer import SleepAnalyzerAgent, LLM_ERROR_PREFIXES
+from agents.coach_agent import CoachAgent
+from agents.insight_agent import SleepInsightAgent
+from agents.rule_engine import RuleEngine
+from analytics.columnar import build_history_summary
+from db.results import load_stored_result, save_result
+from tracing import stage, debug_log, annotate
+
+# Outputs starting with these are failures, they are returned but never stored for reuse
+PIPELINE_ERROR_PREFIXES = LLM_ERROR_PREFIXES + (
+    "Coaching tip generation failed:",
+    "Combined analysis and coaching failed:",
+    "Could not generate specific tips",
+)
+
+@dataclass(frozen=True)
+class PipelineAgents:
+    """
+    The agents of one scheduler priority class. They only hold configuration, so they are
+    created once at startup (main.py's lifespan, the job worker pool) and shared by every request.
+    """
+    settings: Settings
+    rule_engine: RuleEngine
+    collector: SleepCollectorAgent
+    analyzer: SleepAnalyzerAgent
+    coach: CoachAgent
+    insight: SleepInsightAgent
+
+    @classmethod
+    def create(cls, ollama_client: OllamaClient, rule_engine: RuleEngine, settings: Settings, priority: str = "interactive") -> "PipelineAgents":
+        return cls(
+            settings=settings,
+            rule_engine=rule_engine,
+            collector=SleepCollectorAgent(),
+            analyzer=SleepAnalyzerAgent(ollama_client=ollama_client, rule_engine=rule_engine, priority=priority, settings=settings),
+            coach=CoachAgent(ollama_client=ollama_client, priority=priority, settings=settings),
+            insight=SleepInsightAgent(ollama_client=ollama_client, rule_engine=rule_engine, priority=priority, settings=settings),
+        )
+
+async def load_coach_history(sleep_entry: SleepEntry, history_days: int) -> Optional[str]:
+    """
+    Summary of the nights leading up to this entry for the coach prompt, when
+    COACH_HISTORY_DAYS > 0. Failures only cost the extra context, never the tips.
+    """
+    if history_days <= 0:
+        return None
+    try:
+        with stage("history_summary"):
+            return await build_history_summary(sleep_entry.user_id, sleep_entry.date, history_days)
+    except Exception as e:
+        print(f"Could not build the sleep history summary: {e}")
+        return None
+
+def pipeline_models(agents: PipelineAgents) -> List[str]:
+    """The Ollama models the configured pipeline calls, i.e. the ones worth keeping loaded."""
+    if agents.settings.pipeline_mode == "combined":
+        return [agents.insight.model_name]
+    if agents.analyzer.backend == "rules":
+        return [agents.coach.model_name]
+    return list(dict.fromkeys([agents.analyzer.model_name, agents.coach.model_name]))
+
+def pipeline_fingerprint(sleep_entry: SleepEntry, rule_engine: RuleEngine, pipeline_mode: str, analyzer_backend: str, history_summary: Optional[str]) -> str:
+    """
+    Hash of everything besides the models that determines a pipeline result. The coach's
+    history summary goes in as text, so new or edited neighbouring nights change it.
+    """
+    material = json.dumps({
+        "entry": sleep_entry.model_dump(mode="json"),
+        "pipeline_mode": pipeline_mode,
+        "analyzer_backend": analyzer_backend,
+        "rules": rule_engine.describe(),
+        "history_summary": history_summary,
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def _is_failure(analysis_issues: List[str], coaching_suggestions: List[str]) -> bool:
+    return any(item.startswith(PIPELINE_ERROR_PREFIXES) for item in analysis_issues + coaching_suggestions)
+
+async def run_analysis_pipeline(
+    sleep_entry: SleepEntry,
+    agents: PipelineAgents,
+    pipeline_mode: Optional[str] = None,
+    sleep_entry_id: Optional[int] = None,
+) -> Tuple[List[str], List[str]]:
+    """
+    Runs the analyzer and coach agents for an already stored sleep entry.
+    Shared by the synchronous /submit-sleep endpoint (interactive agents) and the async
+    job workers (batch priority agents).
+    Returns (analysis_issues, coaching_suggestions). Agent failures are reported as
+    error strings inside the lists, matching the agents' own behaviour, except for
+    OllamaOverloadedError which is raised so callers can back off.
+
+    PIPELINE_MODE selects how the LLM is used:
+    - "separate" (default): analyzer, then coach (up to two serial generations)
+    - "combined": one schema-constrained generation returns both issues and tips
+
+    With sleep_entry_id the result is stored in analysis_results, and a later run for the
+    same entry with an unchanged fingerprint (entry, settings, coach history) and the same
+    model builds (Ollama digests) returns it without calling Ollama.
+    """
+    pipeline_mode = (pipeline_mode or agents.settings.pipeline_mode).lower()
+    annotate(pipeline_mode=pipeline_mode)
+    if pipeline_mode == "combined":
+        analyzer_backend = agents.insight.backend
+        analyzer_model = agents.insight.model_name if analyzer_backend != "rules" else None
+        coach_model = agents.insight.model_name
+    else:
+        analyzer_backend = agents.analyzer.backend
+        analyzer_model = agents.analyzer.model_name if analyzer_backend != "rules" else None
+        coach_model = agents.coach.model_name
+    # Only the separate coach uses the history; it is loaded up front because it is part of the fingerprint
+    history_summary = None
+    if pipeline_mode != "combined":
+        history_summary = await load_coach_history(sleep_entry, agents.settings.coach_history_days)
+
+    fingerprint = pipeline_fingerprint(sleep_entry, agents.rule_engine, pipeline_mode, analyzer_backend, history_summary)
+    analyzer_model_digest = coach_model_digest = None
+    if sleep_entry_id is not None:
+        ollama_client = agents.coach.ollama_client
+        analyzer_model_digest = await ollama_client.model_digest(analyzer_model) if analyzer_model else None
+        coach_model_digest = await ollama_client.model_digest(coach_model)
+        stored = await load_stored_result(sleep_entry_id, fingerprint, analyzer_model, coach_model, analyzer_model_digest, coach_model_digest)
+        if stored is not None:
+            annotate(reused_result=True)
+            debug_log(f"Reusing the stored analysis for sleep entry {sleep_entry_id}, input and models are unchanged.")
+            return stored
+
+    if pipeline_mode == "combined":
+        with stage("insight"):
+            analysis_issues, coaching_suggestions = await agents.insight.analyze_and_coach(sleep_entry)
+    else:
+        with stage("analyzer"):
+            analysis_issues = await agents.analyzer.analyze_sleep_data(sleep_entry)
+        with stage("coach"):
+            coaching_suggestions = await agents.coach.generate_coaching_tips(sleep_entry, analysis_issues, history_summary)
+
+    if sleep_entry_id is not None and not _is_failure(analysis_issues, coaching_suggestions):
+        try:
+            await save_result(sleep_entry_id, fingerprint, analyzer_model, coach_model, analyzer_model_digest, coach_model_digest, analysis_issues, coaching_suggestions)
+        except SQLAlchemyError as e:
+            # The result is still returned, it just won't be reused
+            print(f"Could not store the analysis result for sleep entry {sleep_entry_id}: {e}")
+    return analysis_issues, coaching_suggestions
@@ -0,0 +1,131 @@
+import os
+import json
+import operator
+from dataclasses import dataclass
+from itertools import repeat
+from typing import List, Dict, Any, Optional, Sequence, Callable
+
+from models.sleep_entry import SleepEntry
+from settings import get_settings
+
+# Default rules file shipped with the backend. Can be overridden with ANALYSIS_RULES_PATH.
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'analysis_rules.json')
+
+# Used when no rules file can be found, mirrors data/analysis_rules.json
+DEFAULT_RULES: List[Dict[str, Any]] = [
+    {"issue": "Short total sleep", "field": "duration_minutes", "op": "<", "threshold": 420},
+    {"issue": "Low REM sleep", "field": "rem_minutes", "op": "<", "threshold": 90},
+    {"issue": "Low Deep sleep", "field": "deep_minutes", "op": "<", "threshold": 60},
+]
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# Only numeric SleepEntry fields can be compared against a threshold
+_NUMERIC_FIELDS = {
+    name for name, field in SleepEntry.model_fields.items() if field.annotation in (int, float)
+}
+
+
+@dataclass(frozen=True)
+class SleepRule:
+    issue: str
+    field: str
+    op: str
+    threshold: float
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SleepRule":
+        try:
+            rule = cls(
+                issue=str(data["issue"]),
+                field=str(data["field"]),
+                op=str(data["op"]),
+                threshold=data["threshold"],
+            )
+        except KeyError as e:
+            raise ValueError(f"Analysis rule {data} is missing key {e}.") from e
+        if rule.field not in _NUMERIC_FIELDS:
+            raise ValueError(f"Analysis rule '{rule.issue}' references unknown numeric field '{rule.field}'.")
+        if rule.op not in _OPERATORS:
+            raise ValueError(f"Analysis rule '{rule.issue}' uses unsupported operator '{rule.op}'.")
+        if not isinstance(rule.threshold, (int, float)):
+            raise ValueError(f"Analysis rule '{rule.issue}' threshold must be a number.")
+        return rule
+
+
+class RuleEngine:
+    """
+    Deterministic sleep analysis based on declarative threshold rules.
+    Rules are compiled once into (issue, field, comparator, threshold) tuples so evaluation
+    is a handful of attribute lookups and comparisons per entry.
+    """
+
+    def __init__(self, rules: Sequence[SleepRule]):
+        self.rules = list(rules)
+        self._compiled = [
+            (rule.issue, rule.field, _OPERATORS[rule.op], rule.threshold) for rule in self.rules
+        ]
+        # Part of LLM prompts and of every pipeline fingerprint, so it is rendered once as well
+        self._description = "\n".join(
+            f'- Issue "{rule.issue}": if {rule.field} {rule.op} {rule.threshold}.' for rule in self.rules
+        )
+
+    @classmethod
+    def from_dicts(cls, rules: Sequence[Dict[str, Any]]) -> "RuleEngine":
+        return cls([SleepRule.from_dict(rule) for rule in rules])
+
+    @classmethod
+    def from_config(cls, path: Optional[str] = None) -> "RuleEngine":
+        """
+        Loads rules from a JSON file (a list of {"issue", "field", "op", "threshold"} objects).
+        Falls back to the built-in defaults if the file does not exist.
+        """
+        rules_path = path or get_settings().analysis_rules_path or DEFAULT_RULES_PATH
+        if not os.path.exists(rules_path):
+            print(f"Warning: analysis rules file not found at {rules_path}, using built-in defaults.")
+            return cls.from_dicts(DEFAULT_RULES)
+        with open(rules_path, "r", encoding="utf-8") as rules_file:
+            raw_rules = json.load(rules_file)
+        if not isinstance(raw_rules, list):
+            raise ValueError(f"Analysis rules file {rules_path} must contain a JSON array of rules.")
+        return cls.from_dicts(raw_rules)
+
+    def evaluate(self, sleep_entry: SleepEntry) -> List[str]:
+        """Returns the issues triggered by a single sleep entry, in rule order."""
+        return [
+            issue for issue, field, compare, threshold in self._compiled
+            if compare(getattr(sleep_entry, field), threshold)
+        ]
+
+    def evaluate_many(self, sleep_entries: Sequence[SleepEntry]) -> List[List[str]]:
+        """
+        Evaluates all rules over many entries at once.
+        Each rule is applied to a whole column of values, then the per-rule flags are
+        zipped back into one issue list per entry (same order as the input).
+        """
+        if not sleep_entries:
+            return []
+        columns: Dict[str, List[Any]] = {}
+        rule_flags = []
+        for issue, field, compare, threshold in self._compiled:
+            if field not in columns:
+                columns[field] = [getattr(entry, field) for entry in sleep_entries]
+            rule_flags.append((issue, list(map(compare, columns[field], repeat(threshold)))))
+
+        results: List[List[str]] = [[] for _ in sleep_entries]
+        for issue, flags in rule_flags:
+            for index, flagged in enumerate(flags):
+                if flagged:
+                    results[index].append(issue)
+        return results
+
+    def describe(self) -> str:
+        """Human readable rule list, used when the rules need to be shown to an LLM."""
+        return self._description
@@ -1,70 +1,106 @@
-import os
 import json
-from dotenv import load_dotenv
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 from models.sleep_entry import SleepEntry
+from settings import Settings, get_settings
 from ollama_client import OllamaClient
+from ollama_scheduler import OllamaOverloadedError
+from agents.rule_engine import RuleEngine
+from metrics import LLM_PARSE_FAILURES
+from tracing import debug_log
 
-# Path for load_dotenv in agents is ../../.env for project root .env
-dotenv_path = os.path.join(os.path.dirname(__file__), '..', '..', '.env')
-if not os.path.exists(dotenv_path):
-    # Fallback for cases where .env might be in the same directory as main.py (project root)
-    # or if agents are structured differently.
-    # This assumes main.py is in sleep_coach_backend/
-    dotenv_path_alt = os.path.join(os.path.dirname(__file__), '..', '.env')
-    if os.path.exists(dotenv_path_alt):
-        dotenv_path = dotenv_path_alt
-    else:
-        # If still not found, try the current directory of this file (agents/)
-        # though this is less likely for typical project structures.
-        dotenv_path_cwd = os.path.join(os.path.dirname(__file__), '.env')
-        if os.path.exists(dotenv_path_cwd):
-            dotenv_path = dotenv_path_cwd
-        else:
-            # Finally, try the parent of the current file's directory (sleep_coach_backend/)
-            dotenv_path_parent_of_agents = os.path.join(os.path.dirname(__file__), '..', '.env')
-            if os.path.exists(dotenv_path_parent_of_agents):
-                dotenv_path = dotenv_path_parent_of_agents
-            else:
-                print(f"Warning: .env file not found at primary path: {os.path.join(os.path.dirname(__file__), '..', '..', '.env')} or fallbacks.")
-                # Allow to proceed, assuming env vars might be set globally
-    load_dotenv(dotenv_path=dotenv_path if os.path.exists(dotenv_path) else None, override=True)
+# Supported analyzer backends:
+# - "rules": deterministic rule engine only, no LLM call (default)
+# - "llm": the LLM applies the thresholds (original behaviour)
+# - "hybrid": rule engine output plus additional fuzzy findings from the LLM
+ANALYZER_BACKENDS = ("rules", "llm", "hybrid")
 
-class SleepAnalyzerAgent:
-    def __init__(self, ollama_client: OllamaClient):
-        self.ollama_client = ollama_client
-        self.model_name = os.getenv("OLLAMA_ANALYZER_MODEL_NAME", "tinyllama")
-        if ':' not in self.model_name:
-            self.model_name += ':latest'
-        print(f"SleepAnalyzerAgent initialized with model: {self.model_name}")
+# Error prefixes returned by the LLM analysis path instead of raising
+LLM_ERROR_PREFIXES = ("Error:", "Sleep analysis by LLM failed:")
 
-    async def _construct_analysis_prompt(self, sleep_entry: SleepEntry) -> str:
-        prompt = f"""You are a sleep data checker. Your task is to identify specific sleep quality issues from the provided data based on common thresholds and output ONLY a JSON array of strings listing those issues.
-
-Sleep Data:
-- Total Duration: {sleep_entry.duration_minutes} minutes
-- REM Sleep: {sleep_entry.rem_minutes} minutes
-- Deep Sleep: {sleep_entry.deep_minutes} minutes
+# Prompts are a static system prefix plus the night's data: with the instructions first and
+# identical across requests, Ollama reuses their evaluated tokens instead of re-reading them
+ANALYSIS_SYSTEM_PROMPT = """You are a sleep data checker. Your task is to identify specific sleep quality issues from the sleep data you are given based on common thresholds and output ONLY a JSON array of strings listing those issues.
 
 Thresholds:
 - Issue "Short total sleep": if Total Duration is less than 420 minutes.
 - Issue "Low REM sleep": if REM Sleep is less than 90 minutes.
 - Issue "Low Deep sleep": if Deep Sleep is less than 60 minutes.
 
-Based *only* on these rules and data, provide your response *strictly* as a JSON array of strings containing the exact issue descriptions if their conditions are met.
+Based *only* on these rules and the data, provide your response *strictly* as a JSON array of strings containing the exact issue descriptions if their conditions are met.
 For example, if total duration is 300 and REM is 70, output: ["Short total sleep", "Low REM sleep"]
 If only deep sleep is 50, output: ["Low Deep sleep"]
 If all values are above thresholds, output an empty array: []
-Do not add any other text, explanation, or JSON keys. Your entire response must be only the JSON array of issue strings.
+Do not add any other text, explanation, or JSON keys. Your entire response must be only the JSON array of issue strings."""
+
+class SleepAnalyzerAgent:
+    def __init__(self, ollama_client: OllamaClient, rule_engine: Optional[RuleEngine] = None, backend: Optional[str] = None, priority: str = "interactive", settings: Optional[Settings] = None):
+        settings = settings or get_settings()
+        self.ollama_client = ollama_client
+        self.priority = priority # Scheduler priority class for this agent's LLM calls
+        self.model_name = settings.analyzer_model
+        self.backend = (backend or settings.analyzer_backend).lower()
+        if self.backend not in ANALYZER_BACKENDS:
+            raise ValueError(f"Unsupported ANALYZER_BACKEND '{self.backend}'. Expected one of {ANALYZER_BACKENDS}.")
+        self.rule_engine = rule_engine or RuleEngine.from_config(settings.analysis_rules_path)
+        self.budget = settings.analyzer_budget
+        self.early_stop = settings.early_stop
+        # The hybrid instructions only depend on the rules, build them once
+        self.findings_system_prompt = f"""You are a sleep data checker. A rule engine has already checked the sleep data you are given against these thresholds:
+{self.rule_engine.describe()}
+
+Look for any other noteworthy sleep quality issues that the thresholds do not cover (for example late bedtime, unusual stage proportions, or a mismatch between the stage minutes and the total duration).
+Do not repeat the issues already found by the rule engine. Keep each issue short (a few words).
+Provide your response *strictly* as a JSON array of strings. If there is nothing else to report, output an empty array: []"""
+        debug_log(f"SleepAnalyzerAgent initialized with backend: {self.backend}, model: {self.model_name}")
+
+    async def analyze_sleep_data(self, sleep_entry: SleepEntry) -> List[str]:
+        """
+        Analyzes sleep data with the configured backend.
+        The rule engine is always the source of truth for threshold issues; the LLM is only
+        called for the "llm" and "hybrid" backends.
+        """
+        if self.backend == "llm":
+            return await self.analyze_sleep_data_with_llm(sleep_entry)
+
+        rule_issues = self.rule_engine.evaluate(sleep_entry)
+        if self.backend == "rules":
+            return rule_issues
 
-Data to analyze:
-Total Duration: {sleep_entry.duration_minutes}
-REM Sleep: {sleep_entry.rem_minutes}
-Deep Sleep: {sleep_entry.deep_minutes}
+        llm_findings = await self.find_additional_issues_with_llm(sleep_entry, rule_issues)
+        if llm_findings and llm_findings[0].startswith(LLM_ERROR_PREFIXES):
+            # Fuzzy findings are best effort, the rule output is still valid on its own
+            print(f"Warning: Additional LLM findings unavailable, using rule output only: {llm_findings[0]}")
+            return rule_issues
+        return rule_issues + [finding for finding in llm_findings if finding not in rule_issues]
 
-Output JSON array:""" 
-        return prompt
+    def analyze_many(self, sleep_entries: List[SleepEntry]) -> List[List[str]]:
+        """Rule-based analysis of many entries in one vectorized pass."""
+        return self.rule_engine.evaluate_many(sleep_entries)
+
+    async def _construct_analysis_prompt(self, sleep_entry: SleepEntry) -> str:
+        """The per-night part of the ANALYZER_BACKEND=llm prompt; the instructions are in ANALYSIS_SYSTEM_PROMPT."""
+        return f"""Sleep Data:
+- Total Duration: {sleep_entry.duration_minutes} minutes
+- REM Sleep: {sleep_entry.rem_minutes} minutes
+- Deep Sleep: {sleep_entry.deep_minutes} minutes
+
+Output JSON array:"""
+
+    async def _construct_additional_findings_prompt(self, sleep_entry: SleepEntry, rule_issues: List[str]) -> str:
+        """The per-night part of the hybrid prompt; the instructions are in self.findings_system_prompt."""
+        rule_issues_str = ", ".join(rule_issues) if rule_issues else "none"
+        return f"""Sleep Data:
+- Bedtime: {sleep_entry.bedtime.isoformat()}
+- Waketime: {sleep_entry.waketime.isoformat()}
+- Total Duration: {sleep_entry.duration_minutes} minutes
+- REM Sleep: {sleep_entry.rem_minutes} minutes
+- Deep Sleep: {sleep_entry.deep_minutes} minutes
+- Core Sleep: {sleep_entry.core_minutes} minutes
+
+Issues already found by the rule engine: {rule_issues_str}
+
+Output JSON array:"""
 
     async def analyze_sleep_data_with_llm(self, sleep_entry: SleepEntry) -> List[str]:
         """
@@ -74,79 +110,109 @@ Output JSON array:"""
         """
         prompt = await self._construct_analysis_prompt(sleep_entry)
         
-        print(f"SleepAnalyzerAgent: Analyzing sleep data for {sleep_entry.date} with model {self.model_name}.")
-        print(f"Prompt being sent to Analyzer LLM:\n{prompt}")
+        debug_log(f"SleepAnalyzerAgent: Analyzing sleep data for {sleep_entry.date} with model {self.model_name}.")
+        return await self._request_issues_from_llm(ANALYSIS_SYSTEM_PROMPT, prompt)
+
+    async def find_additional_issues_with_llm(self, sleep_entry: SleepEntry, rule_issues: List[str]) -> List[str]:
+        """
+        Asks the LLM for fuzzy findings that the threshold rules cannot express.
+        Returns only the additional issues (may be empty).
+        """
+        prompt = await self._construct_additional_findings_prompt(sleep_entry, rule_issues)
+
+        debug_log(f"SleepAnalyzerAgent: Looking for additional findings for {sleep_entry.date} with model {self.model_name}.")
+        return await self._request_issues_from_llm(self.findings_system_prompt, prompt)
+
+    async def _request_issues_from_llm(self, system: str, prompt: str) -> List[str]:
+        """Sends an analysis prompt to the LLM and parses the returned JSON into a list of issue strings."""
+        debug_log(f"Prompt being sent to Analyzer LLM:\n{system}\n\n{prompt}")
 
         try:
             response_data = await self.ollama_client.generate(
                 model_name=self.model_name,
                 prompt=prompt,
+                system=system,
                 stream=False,
-                output_format="json"
+                output_format="json",
+                priority=self.priority,
+                budget=self.budget,
+                early_stop=self.early_stop,
             )
             
             llm_output_str = response_data.get("response")
             if not llm_output_str:
                 print("Error: Analyzer LLM response did not contain a 'response' field.")
+                LLM_PARSE_FAILURES.inc(agent="analyzer", branch="empty_response")
                 return ["Error: Analyzer LLM did not provide a response string."]
 
-            print(f"Analyzer LLM raw output string for issues: {llm_output_str}")
+            debug_log(f"Analyzer LLM raw output string for issues: {llm_output_str}")
             
-            try:
-                parsed_llm_json: Any = json.loads(llm_output_str)
-                issues_list: List[str] = []
-
-                if isinstance(parsed_llm_json, list):
-                    if all(isinstance(item, str) for item in parsed_llm_json):
-                        issues_list = parsed_llm_json
-                    else:
-                        print(f"Warning: Analyzer LLM returned a list, but not all items are strings: {parsed_llm_json}")
-                        issues_list = [str(item) for item in parsed_llm_json]
-                elif isinstance(parsed_llm_json, dict):
-                    print(f"Info: Analyzer LLM returned a JSON object. Will attempt to extract. Object: {parsed_llm_json}")
-                    # New logic: If the dict keys seem to be the issues themselves
-                    potential_issues_from_keys = list(parsed_llm_json.keys())
-                    if all(isinstance(key, str) for key in potential_issues_from_keys):
-                        # Check if these keys match the expected issue format (simple heuristic)
-                        # This is a simple check; more sophisticated validation could be added.
-                        # For now, we assume if keys are strings, they are the issues.
-                        issues_list = potential_issues_from_keys
-                        print(f"Extracted issues from JSON object keys: {issues_list}")
-                        if issues_list: # If we got issues from keys, prioritize this
-                            return issues_list
-
-                    # If LLM still wraps, try to find a list within common keys (less ideal for this new prompt)
-                    found_key = None
-                    for key in ["issues", "slees", "analysis", "results"]:
-                        if key in parsed_llm_json:
-                            found_key = key
-                            break
-                        elif key.lower() in (k.lower() for k in parsed_llm_json.keys()):
-                            actual_key = next((k for k in parsed_llm_json.keys() if k.lower() == key.lower()), None)
-                            if actual_key:
-                                found_key = actual_key
-                                break
-                    if found_key:
-                        potential_issues = parsed_llm_json[found_key]
-                        if isinstance(potential_issues, list):
-                            if potential_issues and isinstance(potential_issues[0], list) and all(isinstance(i,str) for i in potential_issues[0]):
-                                issues_list = potential_issues[0]
-                            elif all(isinstance(item, str) for item in potential_issues):
-                                issues_list = potential_issues
-                            else:
-                                issues_list = [str(item) for item in potential_issues if isinstance(potential_issues, list)]
-                else:
-                    print(f"Error: Analyzer LLM output was not a recognized JSON list/dict. Output: {parsed_llm_json}")
-                    return ["Error: Analyzer LLM output was not a recognized JSON structure."]
-
-                print(f"Extracted issues by Analyzer LLM: {issues_list}")
-                return issues_list
-
-            except json.JSONDecodeError as e:
-                print(f"Error: Failed to parse Analyzer LLM's response string as JSON. Error: {e}. LLM String: {llm_output_str}")
-                return [f"Error: Could not parse Analyzer LLM JSON output - {llm_output_str}"]
+            return self._parse_issues_output(llm_output_str)
 
+        except OllamaOverloadedError:
+            raise # Admission control rejections are surfaced to the caller (503 + Retry-After)
         except Exception as e:
             error_message = f"Sleep analysis by LLM failed: {str(e)}"
             print(error_message)
-            return [error_message] 
\ No newline at end of file
+            return [error_message]
+
+    def _parse_issues_output(self, llm_output_str: str) -> List[str]:
+        """Parses the analyzer LLM's raw output into a list of issue strings (or an error string)."""
+        try:
+            parsed_llm_json: Any = json.loads(llm_output_str)
+            issues_list: List[str] = []
+
+            if isinstance(parsed_llm_json, list):
+                if all(isinstance(item, str) for item in parsed_llm_json):
+                    issues_list = parsed_llm_json
+                else:
+                    print(f"Warning: Analyzer LLM returned a list, but not all items are strings: {parsed_llm_json}")
+                    LLM_PARSE_FAILURES.inc(agent="analyzer", branch="non_string_items")
+                    issues_list = [str(item) for item in parsed_llm_json]
+            elif isinstance(parsed_llm_json, dict):
+                print(f"Info: Analyzer LLM returned a JSON object. Will attempt to extract. Object: {parsed_llm_json}")
+                # New logic: If the dict keys seem to be the issues themselves
+                potential_issues_from_keys = list(parsed_llm_json.keys())
+                if all(isinstance(key, str) for key in potential_issues_from_keys):
+                    # Check if these keys match the expected issue format (simple heuristic)
+                    # This is a simple check; more sophisticated validation could be added.
+                    # For now, we assume if keys are strings, they are the issues.
+                    issues_list = potential_issues_from_keys
+                    debug_log(f"Extracted issues from JSON object keys: {issues_list}")
+                    if issues_list: # If we got issues from keys, prioritize this
+                        LLM_PARSE_FAILURES.inc(agent="analyzer", branch="object_keys")
+                        return issues_list
+
+                # If LLM still wraps, try to find a list within common keys (less ideal for this new prompt)
+                found_key = None
+                for key in ["issues", "slees", "analysis", "results"]:
+                    if key in parsed_llm_json:
+                        found_key = key
+                        break
+                    elif key.lower() in (k.lower() for k in parsed_llm_json.keys()):
+                        actual_key = next((k for k in parsed_llm_json.keys() if k.lower() == key.lower()), None)
+                        if actual_key:
+                            found_key = actual_key
+                            break
+                if found_key:
+                    LLM_PARSE_FAILURES.inc(agent="analyzer", branch="object_key")
+                    potential_issues = parsed_llm_json[found_key]
+                    if isinstance(potential_issues, list):
+                        if potential_issues and isinstance(potential_issues[0], list) and all(isinstance(i,str) for i in potential_issues[0]):
+                            issues_list = potential_issues[0]
+                        elif all(isinstance(item, str) for item in potential_issues):
+                            issues_list = potential_issues
+                        else:
+                            issues_list = [str(item) for item in potential_issues if isinstance(potential_issues, list)]
+            else:
+                print(f"Error: Analyzer LLM output was not a recognized JSON list/dict. Output: {parsed_llm_json}")
+                LLM_PARSE_FAILURES.inc(agent="analyzer", branch="unrecognized_structure")
+                return ["Error: Analyzer LLM output was not a recognized JSON structure."]
+
+            debug_log(f"Extracted issues by Analyzer LLM: {issues_list}")
+            return issues_list
+
+        except json.JSONDecodeError as e:
+            print(f"Error: Failed to parse Analyzer LLM's response string as JSON. Error: {e}. LLM String: {llm_output_str}")
+            LLM_PARSE_FAILURES.inc(agent="analyzer", branch="invalid_json")
+            return [f"Error: Could not parse Analyzer LLM JSON output - {llm_output_str}"]
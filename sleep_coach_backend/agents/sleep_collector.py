@@ -1,30 +1,136 @@
-from sqlalchemy.ext.asyncio import AsyncSession
+import uuid
+from datetime import date
+from typing import Dict, List, Sequence, Tuple
+from sqlalchemy import bindparam, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from models.sleep_entry import SleepEntry
-from models.db_models import SleepOrm # Import the SQLAlchemy model
+from models.db_models import SleepOrm, JobOrm # Import the SQLAlchemy models
+from db.database import AsyncSessionLocal, dialect_insert
+from db.rollups import apply_rollups
+from db.history import bump_history_versions
+from tracing import stage, debug_log
+
+ENTRY_FIELDS = tuple(SleepEntry.model_fields)
+KEY_FIELDS = ("user_id", "date")
+# Rewrites one existing night; the date in the WHERE clause lets PostgreSQL prune to its partition
+UPDATE_ENTRY = (
+    update(SleepOrm.__table__)
+    .where(SleepOrm.id == bindparam("entry_id"), SleepOrm.date == bindparam("night"))
+    .values({field: bindparam(field) for field in ENTRY_FIELDS if field not in KEY_FIELDS})
+)
+# Outcome of storing a night, see SleepCollectorAgent._upsert_entries
+ENTRY_INSERTED = "inserted"
+ENTRY_UPDATED = "updated"
+ENTRY_UNCHANGED = "unchanged"
+
+def entry_key(sleep_entry: SleepEntry) -> Tuple[str, date]:
+    """A night is identified by its owner and date (uq_sleep_entries_user_date)."""
+    return sleep_entry.user_id, sleep_entry.date
 
 class SleepCollectorAgent:
-    def __init__(self, db_session: AsyncSession):
-        self.db_session = db_session
-
-    async def store_sleep_data(self, sleep_entry_pydantic: SleepEntry) -> SleepOrm:
-        """Converts Pydantic SleepEntry to SleepOrm and adds to session for commit."""
-        # Create a SleepOrm instance from the Pydantic model data
-        # The Pydantic model fields directly map to SleepOrm constructor arguments
-        sleep_orm_instance = SleepOrm(
-            date=sleep_entry_pydantic.date,
-            bedtime=sleep_entry_pydantic.bedtime,
-            waketime=sleep_entry_pydantic.waketime,
-            duration_minutes=sleep_entry_pydantic.duration_minutes,
-            rem_minutes=sleep_entry_pydantic.rem_minutes,
-            deep_minutes=sleep_entry_pydantic.deep_minutes,
-            core_minutes=sleep_entry_pydantic.core_minutes
+    def __init__(self, session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal):
+        self.session_factory = session_factory
+
+    async def store_sleep_data(self, sleep_entry_pydantic: SleepEntry) -> Tuple[int, str]:
+        """
+        Stores the entry in its own short transaction and returns (entry id, outcome).
+        There is one row per night: resubmitting a night updates the existing row.
+        The session (and its pooled connection) is committed and released before this returns,
+        so callers can run slow work such as LLM calls without holding database resources.
+        Raises SQLAlchemyError if the commit fails, before any follow-up work has started.
+        """
+        with stage("db_store"):
+            async with self.session_factory() as session:
+                async with session.begin():
+                    outcomes = await self._upsert_entries(session, [sleep_entry_pydantic])
+                # Leaving session.begin() commits (or rolls back on error); the connection is
+                # returned to the pool when the session closes.
+        entry_id, outcome = outcomes[entry_key(sleep_entry_pydantic)]
+
+        debug_log(f"Sleep entry for user {sleep_entry_pydantic.user_id} and date {sleep_entry_pydantic.date} {outcome} with id {entry_id}.")
+        return entry_id, outcome
+
+    async def store_sleep_data_with_job(self, sleep_entry_pydantic: SleepEntry) -> Tuple[int, JobOrm]:
+        """
+        Stores the sleep entry and a pending analysis job for it in the same transaction,
+        so a job never exists without its entry (and vice versa). Used by the async submit mode.
+        Returns (entry id, job).
+        """
+        with stage("db_store"):
+            async with self.session_factory() as session:
+                async with session.begin():
+                    outcomes = await self._upsert_entries(session, [sleep_entry_pydantic])
+                    entry_id, _ = outcomes[entry_key(sleep_entry_pydantic)]
+                    job_orm_instance = JobOrm(
+                        id=uuid.uuid4().hex,
+                        sleep_entry_id=entry_id,
+                        status="pending",
+                        attempts=0,
+                    )
+                    session.add(job_orm_instance)
+
+        debug_log(f"Sleep entry for date {sleep_entry_pydantic.date} stored with job {job_orm_instance.id}.")
+        return entry_id, job_orm_instance
+
+    async def store_many(self, sleep_entries: List[SleepEntry]) -> List[int]:
+        """
+        Stores many entries in one short transaction with a bulk upsert (executemany /
+        batched multi-row VALUES on asyncpg) instead of one ORM add per row.
+        Returns the entry ids in the same order as the input.
+        """
+        if not sleep_entries:
+            return []
+        with stage("db_store", entries=len(sleep_entries)):
+            async with self.session_factory() as session:
+                async with session.begin():
+                    outcomes = await self._upsert_entries(session, sleep_entries)
+        debug_log(f"Bulk stored {len(outcomes)} sleep entries.")
+        return [outcomes[entry_key(sleep_entry)][0] for sleep_entry in sleep_entries]
+
+    async def _upsert_entries(self, session: AsyncSession, sleep_entries: Sequence[SleepEntry]) -> Dict[Tuple[str, date], Tuple[int, str]]:
+        """
+        Upserts entries by (user_id, date) inside the caller's transaction and keeps the stats rollups
+        in step. New nights go in with one INSERT ... ON CONFLICT (user_id, date) DO NOTHING RETURNING; nights that
+        already exist are locked and only rewritten when a field actually changed, so an identical
+        resubmission leaves the row, its updated_at and the user's history version untouched.
+        Returns {(user_id, date): (entry id, inserted/updated/unchanged)}.
+        """
+        latest = {entry_key(sleep_entry): sleep_entry for sleep_entry in sleep_entries} # The last submission of a night wins
+        inserted = await session.execute(
+            dialect_insert(session)(SleepOrm)
+            .on_conflict_do_nothing(index_elements=[SleepOrm.user_id, SleepOrm.date])
+            .returning(SleepOrm.id, SleepOrm.user_id, SleepOrm.date),
+            [sleep_entry.model_dump() for sleep_entry in latest.values()],
         )
-        
-        self.db_session.add(sleep_orm_instance)
-        # The commit will be handled by the get_db dependency after the endpoint function finishes
-        # We can flush to get the ID if needed, but let's keep it simple for now.
-        # await self.db_session.flush() 
-        # await self.db_session.refresh(sleep_orm_instance) 
-        
-        print(f"SleepOrm instance for date {sleep_orm_instance.date} added to session.") # Temporary
-        return sleep_orm_instance # Return the ORM instance, it might be useful 
\ No newline at end of file
+        outcomes = {(row.user_id, row.date): (row.id, ENTRY_INSERTED) for row in inserted}
+        added = [latest[night] for night in outcomes]
+        removed = []
+
+        existing_nights = [night for night in latest if night not in outcomes]
+        if existing_nights:
+            existing_rows = await session.execute(
+                select(SleepOrm.id, *(getattr(SleepOrm, field) for field in ENTRY_FIELDS))
+                .where(tuple_(SleepOrm.user_id, SleepOrm.date).in_(existing_nights))
+                .with_for_update()
+            )
+            changes = []
+            for row in existing_rows:
+                night = (row.user_id, row.date)
+                sleep_entry = latest[night]
+                if all(getattr(row, field) == getattr(sleep_entry, field) for field in ENTRY_FIELDS):
+                    outcomes[night] = (row.id, ENTRY_UNCHANGED)
+                    continue
+                outcomes[night] = (row.id, ENTRY_UPDATED)
+                changes.append({
+                    "entry_id": row.id,
+                    "night": row.date,
+                    **sleep_entry.model_dump(exclude=set(KEY_FIELDS)),
+                })
+                removed.append(row)
+                added.append(sleep_entry)
+            if changes:
+                await session.execute(UPDATE_ENTRY, changes) # executemany
+
+        await apply_rollups(session, added, removed) # Stats rollups move with the entries
+        await bump_history_versions(session, (sleep_entry.user_id for sleep_entry in added)) # New GET /sleep ETags
+        return outcomes
@@ -0,0 +1,42 @@
+"""create_analysis_jobs_table
+
+Revision ID: 3f1c9a2b7d10
+Revises: 07d76af3ce67
+Create Date: 2025-06-02 10:12:31.418207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a2b7d10'
+down_revision: Union[str, None] = '07d76af3ce67'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('analysis_jobs',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('sleep_entry_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('analysis', sa.JSON(), nullable=True),
+    sa.Column('suggestions', sa.JSON(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['sleep_entry_id'], ['sleep_entries.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_analysis_jobs_status'), 'analysis_jobs', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_analysis_jobs_status'), table_name='analysis_jobs')
+    op.drop_table('analysis_jobs')
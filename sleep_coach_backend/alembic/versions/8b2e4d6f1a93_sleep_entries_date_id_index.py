@@ -0,0 +1,30 @@
+"""sleep_entries_date_id_index
+
+Revision ID: 8b2e4d6f1a93
+Revises: 3f1c9a2b7d10
+Create Date: 2025-06-05 09:41:07.552130
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4d6f1a93'
+down_revision: Union[str, None] = '3f1c9a2b7d10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ix_sleep_entries_id only duplicated the primary key index
+    op.drop_index(op.f('ix_sleep_entries_id'), table_name='sleep_entries')
+    op.create_index('ix_sleep_entries_date_id', 'sleep_entries', ['date', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sleep_entries_date_id', table_name='sleep_entries')
+    op.create_index(op.f('ix_sleep_entries_id'), 'sleep_entries', ['id'], unique=False)
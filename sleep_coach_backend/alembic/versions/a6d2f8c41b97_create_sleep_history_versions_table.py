@@ -0,0 +1,37 @@
+"""create_sleep_history_versions_table
+
+Revision ID: a6d2f8c41b97
+Revises: f3a81c6d2e57
+Create Date: 2025-06-18 10:12:35.208417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d2f8c41b97'
+down_revision: Union[str, None] = 'f3a81c6d2e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sleep_history_versions',
+    sa.Column('user_id', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    # Users start at version 1, so ETags issued from the old max(updated_at) version stop matching
+    op.execute(
+        "INSERT INTO sleep_history_versions (user_id, version) "
+        "SELECT DISTINCT user_id, 1 FROM sleep_entries"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sleep_history_versions')
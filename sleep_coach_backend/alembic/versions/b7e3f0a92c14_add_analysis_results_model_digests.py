@@ -0,0 +1,30 @@
+"""add_analysis_results_model_digests
+
+Revision ID: b7e3f0a92c14
+Revises: d81c3e5a7f26
+Create Date: 2025-06-21 10:12:37.402815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e3f0a92c14'
+down_revision: Union[str, None] = 'd81c3e5a7f26'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('analysis_results', sa.Column('analyzer_model_digest', sa.String(length=255), nullable=True))
+    op.add_column('analysis_results', sa.Column('coach_model_digest', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('analysis_results', 'coach_model_digest')
+    op.drop_column('analysis_results', 'analyzer_model_digest')
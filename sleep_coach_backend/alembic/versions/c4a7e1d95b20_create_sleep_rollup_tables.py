@@ -0,0 +1,44 @@
+"""create_sleep_rollup_tables
+
+Revision ID: c4a7e1d95b20
+Revises: 8b2e4d6f1a93
+Create Date: 2025-06-08 14:22:51.093614
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a7e1d95b20'
+down_revision: Union[str, None] = '8b2e4d6f1a93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ROLLUP_TABLES = ('sleep_rollups_daily', 'sleep_rollups_weekly', 'sleep_rollups_monthly')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for table_name in ROLLUP_TABLES:
+        op.create_table(table_name,
+        sa.Column('bucket_start', sa.Date(), nullable=False),
+        sa.Column('nights', sa.Integer(), nullable=False),
+        sa.Column('duration_minutes_sum', sa.Integer(), nullable=False),
+        sa.Column('rem_minutes_sum', sa.Integer(), nullable=False),
+        sa.Column('deep_minutes_sum', sa.Integer(), nullable=False),
+        sa.Column('core_minutes_sum', sa.Integer(), nullable=False),
+        sa.Column('sleep_debt_minutes_sum', sa.Integer(), nullable=False),
+        sa.Column('bedtime_minutes_sum', sa.BigInteger(), nullable=False),
+        sa.Column('bedtime_minutes_sq_sum', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('bucket_start')
+        )
+    # Existing entries are folded in afterwards with: python -m db.rollups rebuild
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table_name in reversed(ROLLUP_TABLES):
+        op.drop_table(table_name)
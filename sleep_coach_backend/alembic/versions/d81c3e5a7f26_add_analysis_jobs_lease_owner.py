@@ -0,0 +1,28 @@
+"""add_analysis_jobs_lease_owner
+
+Revision ID: d81c3e5a7f26
+Revises: a6d2f8c41b97
+Create Date: 2025-06-20 16:03:48.715092
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81c3e5a7f26'
+down_revision: Union[str, None] = 'a6d2f8c41b97'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('analysis_jobs', sa.Column('lease_owner', sa.String(length=32), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('analysis_jobs', 'lease_owner')
@@ -0,0 +1,55 @@
+"""persist_analysis_results
+
+Revision ID: e59d3b8c0f41
+Revises: c4a7e1d95b20
+Create Date: 2025-06-11 11:05:38.271904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e59d3b8c0f41'
+down_revision: Union[str, None] = 'c4a7e1d95b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Keep the most recent submission of each night before making date unique
+    # (their analysis jobs go with them through ON DELETE CASCADE)
+    op.execute(
+        "DELETE FROM sleep_entries WHERE id NOT IN "
+        "(SELECT MAX(id) FROM sleep_entries GROUP BY date)"
+    )
+    op.create_unique_constraint('uq_sleep_entries_date', 'sleep_entries', ['date'])
+    op.add_column('sleep_entries', sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+    op.add_column('sleep_entries', sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False))
+    op.create_index(op.f('ix_sleep_entries_updated_at'), 'sleep_entries', ['updated_at'], unique=False)
+
+    op.create_table('analysis_results',
+    sa.Column('sleep_entry_id', sa.Integer(), nullable=False),
+    sa.Column('fingerprint', sa.String(length=64), nullable=False),
+    sa.Column('analyzer_model', sa.String(length=128), nullable=True),
+    sa.Column('coach_model', sa.String(length=128), nullable=False),
+    sa.Column('analysis', sa.JSON(), nullable=False),
+    sa.Column('suggestions', sa.JSON(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['sleep_entry_id'], ['sleep_entries.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('sleep_entry_id')
+    )
+    # Removed duplicates are still counted in the stats rollups: run python -m db.rollups rebuild
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('analysis_results')
+    op.drop_index(op.f('ix_sleep_entries_updated_at'), table_name='sleep_entries')
+    op.drop_column('sleep_entries', 'updated_at')
+    op.drop_column('sleep_entries', 'created_at')
+    op.drop_constraint('uq_sleep_entries_date', 'sleep_entries', type_='unique')
@@ -0,0 +1,136 @@
+"""partition_sleep_entries_by_user_month
+
+Revision ID: f3a81c6d2e57
+Revises: e59d3b8c0f41
+Create Date: 2025-06-14 09:47:12.530418
+
+"""
+import os
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a81c6d2e57'
+down_revision: Union[str, None] = 'e59d3b8c0f41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEFAULT_USER_ID = 'default'
+# Monthly partitions created ahead of today; python -m db.partitions ensure keeps extending them
+PARTITION_MONTHS_AHEAD = int(os.getenv('SLEEP_PARTITION_MONTHS_AHEAD', '12'))
+ROLLUP_TABLES = ('sleep_rollups_daily', 'sleep_rollups_weekly', 'sleep_rollups_monthly')
+ENTRY_COLUMNS = 'id, date, bedtime, waketime, duration_minutes, rem_minutes, deep_minutes, core_minutes, created_at, updated_at'
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _entry_columns():
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('sleep_entries_id_seq'::regclass)"), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('bedtime', sa.DateTime(), nullable=False),
+        sa.Column('waketime', sa.DateTime(), nullable=False),
+        sa.Column('duration_minutes', sa.Integer(), nullable=False),
+        sa.Column('rem_minutes', sa.Integer(), nullable=False),
+        sa.Column('deep_minutes', sa.Integer(), nullable=False),
+        sa.Column('core_minutes', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    ]
+
+
+def _detach_sleep_entries(old_name: str) -> None:
+    """Renames sleep_entries out of the way and frees its sequence, index and constraint names."""
+    op.execute('ALTER SEQUENCE sleep_entries_id_seq OWNED BY NONE')
+    op.rename_table('sleep_entries', old_name)
+    op.execute(f'ALTER TABLE {old_name} RENAME CONSTRAINT sleep_entries_pkey TO {old_name}_pkey')
+    op.drop_index('ix_sleep_entries_updated_at', table_name=old_name)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Foreign keys can only reference a unique constraint, and on a partitioned table every
+    # unique constraint has to include the partition key: (id) alone can't be referenced anymore
+    op.drop_constraint('analysis_jobs_sleep_entry_id_fkey', 'analysis_jobs', type_='foreignkey')
+    op.drop_constraint('analysis_results_sleep_entry_id_fkey', 'analysis_results', type_='foreignkey')
+
+    # An existing table can't be turned into a partitioned one: create it next to the old one and copy
+    _detach_sleep_entries('sleep_entries_unpartitioned')
+    op.drop_index('ix_sleep_entries_date_id', table_name='sleep_entries_unpartitioned')
+    op.drop_constraint('uq_sleep_entries_date', 'sleep_entries_unpartitioned', type_='unique')
+
+    op.create_table('sleep_entries',
+    *_entry_columns(),
+    sa.Column('user_id', sa.String(length=64), nullable=False),
+    sa.PrimaryKeyConstraint('id', 'date', name='sleep_entries_pkey'),
+    sa.UniqueConstraint('user_id', 'date', name='uq_sleep_entries_user_date'),
+    postgresql_partition_by='RANGE (date)'
+    )
+    op.execute('ALTER SEQUENCE sleep_entries_id_seq OWNED BY sleep_entries.id')
+    op.create_index(op.f('ix_sleep_entries_updated_at'), 'sleep_entries', ['updated_at'], unique=False)
+
+    # One partition per month from the oldest night up to PARTITION_MONTHS_AHEAD months from now;
+    # anything outside lands in the default partition until db.partitions ensure moves it
+    current_month = date.today().replace(day=1)
+    oldest = op.get_bind().execute(sa.text('SELECT MIN(date) FROM sleep_entries_unpartitioned')).scalar()
+    month = min(oldest.replace(day=1), current_month) if oldest else current_month
+    while month <= _add_months(current_month, PARTITION_MONTHS_AHEAD):
+        next_month = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE sleep_entries_y{month.year:04d}m{month.month:02d} PARTITION OF sleep_entries "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        )
+        month = next_month
+    op.execute('CREATE TABLE sleep_entries_default PARTITION OF sleep_entries DEFAULT')
+
+    # Every existing night belongs to the default user
+    op.execute(
+        f"INSERT INTO sleep_entries ({ENTRY_COLUMNS}, user_id) "
+        f"SELECT {ENTRY_COLUMNS}, '{DEFAULT_USER_ID}' FROM sleep_entries_unpartitioned"
+    )
+    op.drop_table('sleep_entries_unpartitioned')
+
+    for table_name in ROLLUP_TABLES:
+        op.add_column(table_name, sa.Column('user_id', sa.String(length=64), server_default=DEFAULT_USER_ID, nullable=False))
+        op.alter_column(table_name, 'user_id', server_default=None)
+        op.drop_constraint(f'{table_name}_pkey', table_name, type_='primary')
+        op.create_primary_key(f'{table_name}_pkey', table_name, ['user_id', 'bucket_start'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Only the default user's nights fit the old one-row-per-date schema; other users' data is dropped
+    for table_name in ROLLUP_TABLES:
+        op.execute(f"DELETE FROM {table_name} WHERE user_id <> '{DEFAULT_USER_ID}'")
+        op.drop_constraint(f'{table_name}_pkey', table_name, type_='primary')
+        op.create_primary_key(f'{table_name}_pkey', table_name, ['bucket_start'])
+        op.drop_column(table_name, 'user_id')
+
+    _detach_sleep_entries('sleep_entries_partitioned')
+    op.drop_constraint('uq_sleep_entries_user_date', 'sleep_entries_partitioned', type_='unique')
+
+    op.create_table('sleep_entries',
+    *_entry_columns(),
+    sa.PrimaryKeyConstraint('id', name='sleep_entries_pkey'),
+    sa.UniqueConstraint('date', name='uq_sleep_entries_date')
+    )
+    op.execute('ALTER SEQUENCE sleep_entries_id_seq OWNED BY sleep_entries.id')
+    op.create_index(op.f('ix_sleep_entries_updated_at'), 'sleep_entries', ['updated_at'], unique=False)
+    op.create_index('ix_sleep_entries_date_id', 'sleep_entries', ['date', 'id'], unique=False)
+    op.execute(
+        f"INSERT INTO sleep_entries ({ENTRY_COLUMNS}) "
+        f"SELECT {ENTRY_COLUMNS} FROM sleep_entries_partitioned WHERE user_id = '{DEFAULT_USER_ID}'"
+    )
+    op.drop_table('sleep_entries_partitioned') # Drops its partitions too
+
+    op.execute('DELETE FROM analysis_jobs WHERE sleep_entry_id NOT IN (SELECT id FROM sleep_entries)')
+    op.execute('DELETE FROM analysis_results WHERE sleep_entry_id NOT IN (SELECT id FROM sleep_entries)')
+    op.create_foreign_key('analysis_results_sleep_entry_id_fkey', 'analysis_results', 'sleep_entries', ['sleep_entry_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('analysis_jobs_sleep_entry_id_fkey', 'analysis_jobs', 'sleep_entries', ['sleep_entry_id'], ['id'], ondelete='CASCADE')
@@ -0,0 +1,240 @@
+"""
+Columnar, vectorized analytics over a user's sleep history.
+
+A range of sleep_entries is loaded into one compact NumPy array per field (dates as int32 day
+numbers, minutes as int16), so a year of nights is a few kilobytes and every statistic is a
+handful of array operations instead of a Python loop over ORM objects.
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.database import AsyncSessionLocal
+from db.rollups import SLEEP_TARGET_MINUTES
+from models.db_models import SleepOrm
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+MINUTE_FIELDS = ("duration_minutes", "rem_minutes", "deep_minutes", "core_minutes")
+STAGE_FIELDS = ("rem_minutes", "deep_minutes", "core_minutes")
+FIELD_LABELS = {
+    "duration_minutes": "total sleep",
+    "rem_minutes": "REM sleep",
+    "deep_minutes": "deep sleep",
+    "core_minutes": "core sleep",
+}
+
+def to_day_number(day: date) -> int:
+    return day.toordinal() - EPOCH_ORDINAL
+
+def from_day_number(day_number: int) -> date:
+    return date.fromordinal(int(day_number) + EPOCH_ORDINAL)
+
+def _bedtime_minutes(bedtime: datetime) -> int:
+    # Minutes after noon, so 23:30 and 00:30 are 60 minutes apart rather than 23 hours
+    return (bedtime.hour * 60 + bedtime.minute - 12 * 60) % (24 * 60)
+
+@dataclass
+class SleepColumns:
+    """One array per field, all the same length, ordered by day."""
+    day: np.ndarray               # int32 days since 1970-01-01
+    bedtime_minutes: np.ndarray   # int16 minutes after noon
+    duration_minutes: np.ndarray  # int16
+    rem_minutes: np.ndarray       # int16
+    deep_minutes: np.ndarray      # int16
+    core_minutes: np.ndarray      # int16
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.__dataclass_fields__)
+
+    @classmethod
+    def empty(cls) -> "SleepColumns":
+        return cls(np.empty(0, np.int32), *(np.empty(0, np.int16) for _ in range(5)))
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Any]) -> "SleepColumns":
+        """From objects with the SleepEntry attributes (ORM rows, SleepEntry, result rows)."""
+        if not rows:
+            return cls.empty()
+        return cls(
+            day=np.fromiter((row.date.toordinal() for row in rows), np.int32, len(rows)) - np.int32(EPOCH_ORDINAL),
+            bedtime_minutes=np.fromiter((_bedtime_minutes(row.bedtime) for row in rows), np.int16, len(rows)),
+            **{field: np.fromiter((getattr(row, field) for row in rows), np.int16, len(rows)) for field in MINUTE_FIELDS},
+        )
+
+    @classmethod
+    def concatenate(cls, chunks: List["SleepColumns"]) -> "SleepColumns":
+        if not chunks:
+            return cls.empty()
+        return cls(**{name: np.concatenate([getattr(chunk, name) for chunk in chunks]) for name in cls.__dataclass_fields__})
+
+    def between(self, first_day: int, last_day: int) -> "SleepColumns":
+        """Entries with first_day <= day <= last_day (binary search, the arrays are day-ordered)."""
+        start = int(np.searchsorted(self.day, first_day, side="left"))
+        stop = int(np.searchsorted(self.day, last_day, side="right"))
+        return SleepColumns(**{name: getattr(self, name)[start:stop] for name in self.__dataclass_fields__})
+
+async def load_sleep_columns(
+    session: AsyncSession,
+    user_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    yield_per: int = 10000,
+) -> SleepColumns:
+    """Streams a date range of one user's sleep_entries into columns, one partition at a time."""
+    statement = (
+        select(SleepOrm.date, SleepOrm.bedtime, *(getattr(SleepOrm, field) for field in MINUTE_FIELDS))
+        .where(SleepOrm.user_id == user_id)
+        .order_by(SleepOrm.date)
+    )
+    if start is not None:
+        statement = statement.where(SleepOrm.date >= start)
+    if end is not None:
+        statement = statement.where(SleepOrm.date <= end)
+    result = await session.stream(statement.execution_options(yield_per=yield_per))
+    chunks = [SleepColumns.from_rows(partition) async for partition in result.partitions()]
+    return SleepColumns.concatenate(chunks)
+
+def stage_ratios(columns: SleepColumns) -> Dict[str, np.ndarray]:
+    """Per-night share of total sleep spent in each stage (0 where the duration is 0)."""
+    duration = columns.duration_minutes.astype(np.float64)
+    return {
+        field: np.divide(getattr(columns, field), duration, out=np.zeros_like(duration), where=duration > 0)
+        for field in STAGE_FIELDS
+    }
+
+def period_change(values: np.ndarray, days: np.ndarray, last_day: int, window_days: int) -> Optional[float]:
+    """
+    Relative change (0.2 = +20%) of the mean over the last window_days compared with the
+    window_days before that. None when either window has no nights or the baseline is 0.
+    """
+    recent = (days > last_day - window_days) & (days <= last_day)
+    previous = (days > last_day - 2 * window_days) & (days <= last_day - window_days)
+    if not recent.any() or not previous.any():
+        return None
+    baseline = values[previous].mean()
+    if baseline == 0:
+        return None
+    return float(values[recent].mean() / baseline - 1.0)
+
+def linear_trend(values: np.ndarray, days: np.ndarray) -> Optional[float]:
+    """Least-squares slope in minutes per day, None with fewer than two distinct days."""
+    if len(days) < 2 or days[0] == days[-1]:
+        return None
+    x = days.astype(np.float64) - days[0]
+    y = values.astype(np.float64)
+    x_centered = x - x.mean()
+    return float((x_centered * (y - y.mean())).sum() / (x_centered * x_centered).sum())
+
+def zscores(values: np.ndarray) -> np.ndarray:
+    """Standard scores against the whole range (all zeros if the values don't vary)."""
+    values = values.astype(np.float64)
+    deviation = values.std()
+    if deviation == 0:
+        return np.zeros_like(values)
+    return (values - values.mean()) / deviation
+
+def zscore_anomalies(values: np.ndarray, threshold: float = 2.0) -> np.ndarray:
+    """Indexes of nights whose value is more than `threshold` standard deviations from the mean."""
+    return np.flatnonzero(np.abs(zscores(values)) > threshold)
+
+def streaks(mask: np.ndarray, days: np.ndarray) -> Tuple[int, int]:
+    """
+    (longest, current) runs of consecutive calendar days where mask is True.
+    A missing night or a False night ends a run; "current" is the run ending at the last night.
+    """
+    if not len(mask):
+        return 0, 0
+    mask = mask.astype(bool)
+    continues = np.concatenate(([False], mask[:-1] & (np.diff(days) == 1)))
+    run_ids = np.cumsum(mask & ~continues)
+    lengths = np.bincount(run_ids[mask]) if mask.any() else np.zeros(1, np.int64)
+    current = int(lengths[run_ids[-1]]) if mask[-1] else 0
+    return int(lengths.max()), current
+
+def summarize_history(
+    columns: SleepColumns,
+    target_minutes: int = SLEEP_TARGET_MINUTES,
+    window_days: int = 14,
+    anomaly_threshold: float = 2.0,
+) -> Dict[str, Any]:
+    """Trends, anomalies of the latest night, target streaks and stage ratios for a history range."""
+    if not len(columns):
+        return {"nights": 0}
+    last_day = int(columns.day[-1])
+    ratios = stage_ratios(columns)
+    longest_streak, current_streak = streaks(columns.duration_minutes >= target_minutes, columns.day)
+    summary: Dict[str, Any] = {
+        "nights": len(columns),
+        "first_date": from_day_number(columns.day[0]).isoformat(),
+        "last_date": from_day_number(last_day).isoformat(),
+        "window_days": window_days,
+        "averages": {field: round(float(getattr(columns, field).mean()), 1) for field in MINUTE_FIELDS},
+        "changes": {},
+        "trend_minutes_per_week": {},
+        "latest_anomalies": {},
+        "target_minutes": target_minutes,
+        "longest_streak": longest_streak,
+        "current_streak": current_streak,
+        "stage_ratios": {field: round(float(ratio.mean()), 3) for field, ratio in ratios.items()},
+    }
+    for field in MINUTE_FIELDS:
+        values = getattr(columns, field)
+        change = period_change(values, columns.day, last_day, window_days)
+        if change is not None:
+            summary["changes"][field] = round(change, 3)
+        slope = linear_trend(values, columns.day)
+        if slope is not None:
+            summary["trend_minutes_per_week"][field] = round(slope * 7, 1)
+        latest_z = float(zscores(values)[-1])
+        if abs(latest_z) > anomaly_threshold:
+            summary["latest_anomalies"][field] = {"value": int(values[-1]), "zscore": round(latest_z, 1)}
+    return summary
+
+def format_history_summary(summary: Dict[str, Any], min_change: float = 0.1) -> Optional[str]:
+    """Short plain-text lines for an LLM prompt, only mentioning what stands out."""
+    if summary.get("nights", 0) < 2:
+        return None
+    lines = [
+        f"- {summary['nights']} nights recorded from {summary['first_date']} to {summary['last_date']}, "
+        f"averaging {summary['averages']['duration_minutes']:.0f} minutes of sleep."
+    ]
+    for field, change in summary["changes"].items():
+        if abs(change) >= min_change:
+            direction = "risen" if change > 0 else "dropped"
+            label = FIELD_LABELS[field]
+            lines.append(
+                f"- {label[0].upper()}{label[1:]} has {direction} {abs(change):.0%} over the last {summary['window_days']} days "
+                f"compared with the {summary['window_days']} days before."
+            )
+    for field, anomaly in summary["latest_anomalies"].items():
+        level = "high" if anomaly["zscore"] > 0 else "low"
+        lines.append(f"- The latest night's {FIELD_LABELS[field]} ({anomaly['value']} minutes) is unusually {level} for me.")
+    lines.append(
+        f"- Current streak of nights with at least {summary['target_minutes']} minutes of sleep: "
+        f"{summary['current_streak']} (longest: {summary['longest_streak']})."
+    )
+    ratios = summary["stage_ratios"]
+    lines.append(
+        f"- Average stage split: REM {ratios['rem_minutes']:.0%}, deep {ratios['deep_minutes']:.0%}, "
+        f"core {ratios['core_minutes']:.0%} of total sleep."
+    )
+    return "\n".join(lines)
+
+async def build_history_summary(
+    user_id: str,
+    end_date: date,
+    days: int,
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+) -> Optional[str]:
+    """Prompt-ready summary of the user's `days` nights up to end_date, None if there isn't enough history."""
+    async with session_factory() as session:
+        columns = await load_sleep_columns(session, user_id, start=end_date - timedelta(days=days - 1), end=end_date)
+    return format_history_summary(summarize_history(columns))
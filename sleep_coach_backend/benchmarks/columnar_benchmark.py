@@ -0,0 +1,119 @@
+"""
+Benchmark: history summary computed row by row vs. with the columnar NumPy engine.
+
+Generates a synthetic history of N nights and times
+  1. building the columns from row objects (what load_sleep_columns does per partition),
+  2. summarize_history on the columns,
+  3. the same statistics computed with a plain Python loop over the row objects,
+and reports the memory held by the rows vs. the columns.
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/columnar_benchmark.py --rows 10000 1000000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from analytics.columnar import SleepColumns, summarize_history, _bedtime_minutes
+
+
+def make_rows(count: int, seed: int = 7) -> List[Any]:
+    """Row objects with the SleepEntry attributes, one per consecutive night."""
+    rng = random.Random(seed)
+    first = date(2000, 1, 1) # 1M consecutive nights still end well before date.max
+    rows = []
+    for offset in range(count):
+        night = first + timedelta(days=offset)
+        duration = rng.randint(300, 510)
+        rows.append(SimpleNamespace(
+            date=night,
+            bedtime=datetime(night.year, night.month, night.day, rng.choice((21, 22, 23)), rng.randint(0, 59)),
+            duration_minutes=duration,
+            rem_minutes=rng.randint(40, 120),
+            deep_minutes=rng.randint(20, 100),
+            core_minutes=max(0, duration - 180),
+        ))
+    return rows
+
+
+def summarize_rows(rows: List[Any], target_minutes: int = 420, window_days: int = 14) -> Dict[str, Any]:
+    """The same statistics as summarize_history, written as a straightforward Python loop."""
+    fields = ("duration_minutes", "rem_minutes", "deep_minutes", "core_minutes")
+    last_day = rows[-1].date
+    summary: Dict[str, Any] = {"averages": {}, "changes": {}, "zscores": {}}
+    for field in fields:
+        values = [getattr(row, field) for row in rows]
+        mean = statistics.fmean(values)
+        summary["averages"][field] = mean
+        recent = [getattr(row, field) for row in rows if (last_day - row.date).days < window_days]
+        previous = [getattr(row, field) for row in rows if window_days <= (last_day - row.date).days < 2 * window_days]
+        summary["changes"][field] = statistics.fmean(recent) / statistics.fmean(previous) - 1.0
+        deviation = statistics.pstdev(values)
+        summary["zscores"][field] = (values[-1] - mean) / deviation if deviation else 0.0
+    longest = current = 0
+    previous_day = None
+    for row in rows:
+        if row.duration_minutes >= target_minutes and previous_day is not None and (row.date - previous_day).days == 1 and current:
+            current += 1
+        elif row.duration_minutes >= target_minutes:
+            current = 1
+        else:
+            current = 0
+        longest = max(longest, current)
+        previous_day = row.date
+    summary["streaks"] = (longest, current)
+    summary["ratios"] = {
+        field: statistics.fmean(getattr(row, field) / row.duration_minutes for row in rows)
+        for field in ("rem_minutes", "deep_minutes", "core_minutes")
+    }
+    _ = [_bedtime_minutes(row.bedtime) for row in rows]
+    return summary
+
+
+def timed(function: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def measure_rows_memory(count: int) -> Tuple[List[Any], int]:
+    tracemalloc.start()
+    rows = make_rows(count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'rows MB':>9} {'cols MB':>9} {'to columns s':>13} {'numpy s':>9} {'python s':>9} {'speedup':>8}")
+    for count in args.rows:
+        rows, rows_bytes = measure_rows_memory(count)
+        build_seconds, columns = timed(lambda: SleepColumns.from_rows(rows), args.repeat)
+        numpy_seconds, _ = timed(lambda: summarize_history(columns), args.repeat)
+        python_seconds, _ = timed(lambda: summarize_rows(rows), 1 if count > 100_000 else args.repeat)
+        print(
+            f"{count:>10} {rows_bytes / 1e6:>9.1f} {columns.nbytes / 1e6:>9.2f} {build_seconds:>13.4f} "
+            f"{numpy_seconds:>9.4f} {python_seconds:>9.4f} {python_seconds / numpy_seconds:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares two benchmark result files written by load_test.py or micro_benchmarks.py.
+
+Results are matched by name; every numeric metric present in both runs is printed with its
+relative change. Metrics of the form *_ms / *_us / *_s and error_rate are lower-is-better,
+throughput_rps is higher-is-better; changes beyond --threshold in the wrong direction are
+flagged, and --fail-on-regression turns them into a non-zero exit code (for CI).
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/compare.py bench_results/load_before.json bench_results/load_after.json
+    python benchmarks/compare.py base.json head.json --threshold 10 --fail-on-regression
+"""
+import sys
+import json
+import argparse
+from typing import Any, Dict, List, Optional
+
+HIGHER_IS_BETTER = ("throughput_rps",)
+LOWER_IS_BETTER_SUFFIXES = ("_ms", "_us", "_s", "error_rate")
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as results_file:
+        return json.load(results_file)
+
+
+def direction(metric: str) -> Optional[int]:
+    """+1 when higher is better, -1 when lower is better, None when neither."""
+    if metric in HIGHER_IS_BETTER:
+        return 1
+    if metric.endswith(LOWER_IS_BETTER_SUFFIXES):
+        return -1
+    return None
+
+
+def numeric_metrics(result: Dict[str, Any]) -> Dict[str, float]:
+    """Top-level numbers plus one level of nested numbers (stage_mean_ms.analyzer, ...)."""
+    metrics: Dict[str, float] = {}
+    for key, value in result.items():
+        if isinstance(value, bool):
+            continue
+        if isinstance(value, (int, float)):
+            metrics[key] = value
+        elif isinstance(value, dict) and key.endswith(LOWER_IS_BETTER_SUFFIXES):
+            for nested_key, nested_value in value.items():
+                if isinstance(nested_value, (int, float)) and not isinstance(nested_value, bool):
+                    metrics[f"{key}.{nested_key}"] = nested_value
+    return metrics
+
+
+def compare(base: Dict[str, Any], head: Dict[str, Any], threshold: float) -> List[str]:
+    """Prints the comparison and returns the regressed metrics."""
+    regressions = []
+    base_results = {result["name"]: result for result in base["results"]}
+    print(f"base: {base.get('git_revision')} {base.get('created_at')}")
+    print(f"head: {head.get('git_revision')} {head.get('created_at')}")
+    for head_result in head["results"]:
+        name = head_result["name"]
+        base_result = base_results.get(name)
+        if base_result is None:
+            print(f"\n{name}: only in head")
+            continue
+        print(f"\n{name}")
+        base_metrics = numeric_metrics(base_result)
+        for metric, head_value in numeric_metrics(head_result).items():
+            base_value = base_metrics.get(metric)
+            if base_value is None:
+                continue
+            change = (head_value - base_value) / base_value * 100 if base_value else 0.0
+            better = direction(metric)
+            flag = ""
+            if better is not None and change * better < -threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{name} {metric}")
+            elif better is not None and change * better > threshold:
+                flag = "  improved"
+            print(f"  {metric:<32} {base_value:>12.3f} -> {head_value:>12.3f}  {change:+7.1f}%{flag}")
+    for name in base_results.keys() - {result["name"] for result in head["results"]}:
+        print(f"\n{name}: only in base")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base", help="Results of the baseline run.")
+    parser.add_argument("head", help="Results of the run to compare.")
+    parser.add_argument("--threshold", type=float, default=5.0, help="Percent change that counts as a regression or improvement.")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    base, head = load(args.base), load(args.head)
+    if base.get("suite") != head.get("suite"):
+        print(f"Warning: comparing different suites ({base.get('suite')} vs {head.get('suite')}).")
+    regressions = compare(base, head, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold}%.")
+        if args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Micro-benchmarks of the CPU work around each LLM call: prompt construction and parsing of the raw output.
+
+Prompt construction is timed for every agent prompt (analyzer, additional findings, coach, period
+coach, insight); parsing is timed for the coach and analyzer fallback branches (clean array,
+object values/keys, non-string items, invalid JSON, empty) and the insight schema validation.
+Each benchmark reports the median of --repeat runs of --number calls in microseconds per call.
+Warnings the parsers print on fallback branches are discarded while timing.
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/micro_benchmarks.py --output bench_results/micro.json
+    python benchmarks/micro_benchmarks.py --filter parse --number 20000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from agents.rule_engine import RuleEngine
+from agents.sleep_analyzer import SleepAnalyzerAgent
+from agents.coach_agent import CoachAgent
+from agents.insight_agent import SleepInsightAgent, InsightResponse
+from models.sleep_entry import SleepEntry
+from benchmarks.results import write_results
+
+TIPS = ["Keep a consistent bedtime, even on weekends.", "Stop caffeine at least eight hours before bed.", "Dim screens and lights an hour before sleeping."]
+ISSUES = ["Short total sleep duration", "Low deep sleep"]
+HISTORY_SUMMARY = "Average duration 402 minutes over 60 nights, down 6% over the last 14 nights. Longest streak of 7h nights: 5."
+
+# Raw LLM outputs, one per parsing branch
+COACH_OUTPUTS = {
+    "array": json.dumps(TIPS),
+    "object_values": json.dumps({f"tip{index}": tip for index, tip in enumerate(TIPS, 1)}),
+    "object_key": json.dumps({"tips": TIPS, "count": 3}),
+    "non_string_items": json.dumps(TIPS + [4]),
+    "invalid_json": '["Keep a consistent bedtime", "Stop caffeine',
+}
+ANALYZER_OUTPUTS = {
+    "array": json.dumps(ISSUES),
+    "object_keys": json.dumps({issue: True for issue in ISSUES}),
+    "non_string_items": json.dumps(ISSUES + [1]),
+    "empty_array": "[]",
+    "invalid_json": '["Short total sleep duration", ',
+}
+
+
+def make_entries(count: int) -> List[SleepEntry]:
+    first = date(2025, 5, 1)
+    return [
+        SleepEntry(
+            date=first + timedelta(days=offset),
+            bedtime=datetime(2025, 5, 1, 23, 30) + timedelta(days=offset),
+            waketime=datetime(2025, 5, 2, 6, 30) + timedelta(days=offset),
+            duration_minutes=400 + offset % 40,
+            rem_minutes=80,
+            deep_minutes=50,
+            core_minutes=270 + offset % 40,
+        )
+        for offset in range(count)
+    ]
+
+
+def time_sync(function: Callable[[], Any], number: int, repeat: int) -> List[float]:
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            function()
+        runs.append((time.perf_counter() - started) / number)
+    return runs
+
+
+def time_async(factory: Callable[[], Awaitable[Any]], number: int, repeat: int) -> List[float]:
+    """The prompt builders are coroutine functions; one event loop runs all calls of a repeat."""
+    async def loop() -> float:
+        started = time.perf_counter()
+        for _ in range(number):
+            await factory()
+        return (time.perf_counter() - started) / number
+    return [asyncio.run(loop()) for _ in range(repeat)]
+
+
+def benchmarks() -> List[Tuple[str, str, Callable[[int, int], List[float]]]]:
+    """(name, group, runner) for every benchmark."""
+    rule_engine = RuleEngine.from_config()
+    analyzer = SleepAnalyzerAgent(None, rule_engine=rule_engine, backend="hybrid")
+    coach = CoachAgent(None)
+    insight = SleepInsightAgent(None, rule_engine, backend="rules")
+    entry = make_entries(1)[0]
+    period = make_entries(30)
+    period_issues = rule_engine.evaluate_many(period)
+
+    cases: List[Tuple[str, str, Callable[[int, int], List[float]]]] = [
+        ("prompt.analyzer", "prompt", lambda n, r: time_async(lambda: analyzer._construct_analysis_prompt(entry), n, r)),
+        ("prompt.analyzer_additional", "prompt", lambda n, r: time_async(lambda: analyzer._construct_additional_findings_prompt(entry, ISSUES), n, r)),
+        ("prompt.coach", "prompt", lambda n, r: time_async(lambda: coach._construct_coaching_prompt(entry, ISSUES), n, r)),
+        ("prompt.coach_history", "prompt", lambda n, r: time_async(lambda: coach._construct_coaching_prompt(entry, ISSUES, HISTORY_SUMMARY), n, r)),
+        ("prompt.coach_period_30", "prompt", lambda n, r: time_async(lambda: coach._construct_period_coaching_prompt(period, period_issues), n, r)),
+        ("prompt.insight_rules", "prompt", lambda n, r: time_async(lambda: insight._construct_insight_prompt(entry, ISSUES), n, r)),
+        ("prompt.insight_llm", "prompt", lambda n, r: time_async(lambda: insight._construct_insight_prompt(entry, None), n, r)),
+    ]
+    for branch, output in COACH_OUTPUTS.items():
+        cases.append((f"parse.coach.{branch}", "parse", lambda n, r, output=output: time_sync(lambda: coach._parse_tips_output(output), n, r)))
+    for branch, output in ANALYZER_OUTPUTS.items():
+        cases.append((f"parse.analyzer.{branch}", "parse", lambda n, r, output=output: time_sync(lambda: analyzer._parse_issues_output(output), n, r)))
+    insight_output = json.dumps({"issues": ISSUES, "tips": TIPS})
+    cases.append(("parse.insight.schema", "parse", lambda n, r: time_sync(lambda: InsightResponse.model_validate(json.loads(insight_output)), n, r)))
+    return cases
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=5000, help="Calls per timed run.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per benchmark; the median is reported.")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this text.")
+    parser.add_argument("--output", help="Path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    print(f"{'benchmark':<34} {'median us':>10} {'min us':>10} {'stdev us':>10}")
+    for name, group, runner in benchmarks():
+        if args.filter not in name:
+            continue
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            runs = runner(args.number, args.repeat)
+        median_us = statistics.median(runs) * 1e6
+        min_us = min(runs) * 1e6
+        stdev_us = statistics.stdev(runs) * 1e6 if len(runs) > 1 else 0.0
+        print(f"{name:<34} {median_us:>10.2f} {min_us:>10.2f} {stdev_us:>10.2f}")
+        results.append({"name": name, "group": group, "median_us": round(median_us, 3), "min_us": round(min_us, 3), "stdev_us": round(stdev_us, 3)})
+
+    write_results(args.output, "micro_benchmarks", {"number": args.number, "repeat": args.repeat, "filter": args.filter}, results)
+
+
+if __name__ == "__main__":
+    main()
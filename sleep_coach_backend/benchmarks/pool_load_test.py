@@ -0,0 +1,130 @@
+"""
+Load test: database connections in use while /submit-sleep waits on the LLM.
+
+Runs the FastAPI app in-process against a throwaway SQLite (aiosqlite) database and a fake
+Ollama client whose latency is increased step by step. For every latency step the pool's
+checked-out connection count is sampled while a burst of concurrent submissions is in flight.
+Because the entry is committed before any LLM call, the numbers should stay flat no matter
+how slow the LLM gets (only the short insert burst shows up, not the LLM wait).
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/pool_load_test.py --requests 50 --latencies 0.05 0.2 0.5 1.0
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+import itertools
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# Must be set before the app (and db.database) are imported
+_db_file = os.path.join(tempfile.mkdtemp(prefix="sleep_coach_bench_"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_file}"
+os.environ.setdefault("OLLAMA_API_URL", "http://127.0.0.1:11434/api/generate")
+os.environ.setdefault("ANALYZER_BACKEND", "hybrid")  # Two LLM calls per request, like the original pipeline
+
+import httpx
+
+import main
+from settings import get_settings
+from db.database import Base, async_engine
+from agents.rule_engine import RuleEngine
+from agents.pipeline import PipelineAgents
+
+SAMPLE_PAYLOAD = {
+    "date": "2025-05-25",
+    "bedtime": "2025-05-25T01:00:00",
+    "waketime": "2025-05-25T05:00:00",
+    "duration_minutes": 240,
+    "rem_minutes": 30,
+    "deep_minutes": 20,
+    "core_minutes": 190,
+}
+
+
+class FakeOllamaClient:
+    """Stands in for OllamaClient: sleeps for the configured latency and returns a JSON array."""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    async def generate(self, model_name: str, prompt: str, stream: bool = False, output_format: Optional[str] = None, **kwargs: Any) -> Dict[str, Any]:
+        await asyncio.sleep(self.latency_seconds)
+        return {"model": model_name, "response": json.dumps(["Keep a regular bedtime", "Limit caffeine", "Dim the lights"]), "done": True}
+
+
+# Every request submits a new night, so none is answered from the stored results
+_night_numbers = itertools.count()
+
+
+def _payload_for_next_night() -> Dict[str, Any]:
+    night = date(2025, 5, 25) + timedelta(days=next(_night_numbers))
+    return {**SAMPLE_PAYLOAD, "date": night.isoformat()}
+
+
+async def _sample_pool(samples: List[int], stop: asyncio.Event, interval: float) -> None:
+    while not stop.is_set():
+        samples.append(async_engine.sync_engine.pool.checkedout())
+        await asyncio.sleep(interval)
+
+
+async def run_step(latency: float, concurrency: int) -> Dict[str, Any]:
+    agents = PipelineAgents.create(FakeOllamaClient(latency), RuleEngine.from_config(), get_settings())
+    main.app.dependency_overrides[main.get_agents] = lambda: agents
+    main.app.dependency_overrides[main.get_job_pool] = lambda: None  # Only the sync path is measured
+    samples: List[int] = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_pool(samples, stop, interval=0.005))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        responses = await asyncio.gather(
+            *(client.post("/submit-sleep", json=_payload_for_next_night()) for _ in range(concurrency))
+        )
+        elapsed = loop.time() - started
+
+    stop.set()
+    await sampler
+    failures = [r.status_code for r in responses if r.status_code != 200]
+    return {
+        "llm_latency_s": latency,
+        "requests": concurrency,
+        "failures": len(failures),
+        "elapsed_s": round(elapsed, 3),
+        "max_connections_in_use": max(samples) if samples else 0,
+        "avg_connections_in_use": round(sum(samples) / len(samples), 3) if samples else 0.0,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    results = []
+    for latency in args.latencies:
+        result = await run_step(latency, args.requests)
+        results.append(result)
+        print(json.dumps(result))
+    await async_engine.dispose()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="Concurrent submissions per latency step.")
+    parser.add_argument("--latencies", type=float, nargs="+", default=[0.05, 0.2, 0.5, 1.0], help="Fake LLM latency per call, in seconds.")
+    parser.add_argument("--output", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    peak = max(result["max_connections_in_use"] for result in results)
+    print(f"Peak connections in use across all steps: {peak}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=2)
@@ -0,0 +1,153 @@
+"""
+Benchmark: Ollama prompt evaluation with the agents' static prompt prefixes.
+
+Sends the agents' real prompts for --nights different nights, one request at a time, in three layouts:
+  - "system":     instructions as Ollama's system prompt, the night's data as the prompt (what the
+                  agents send by default),
+  - "inline":     instructions at the start of the prompt, data after them (OLLAMA_SYSTEM_PROMPTS=false),
+  - "data_first": the night's data ahead of the instructions, as the prompts used to be laid out,
+                  so no prefix is shared between requests,
+and reports Ollama's prompt_eval_duration and prompt_eval_count per prompt and layout. The first
+request of each group fills the cache and is reported separately (first_prompt_eval_ms).
+
+By default the requests go to benchmarks/stub_ollama.py, in-process, simulating prompt evaluation
+at --prompt-tokens-per-second with its KV prefix cache. With --ollama-url they go to a real server;
+generation is capped at one token there, so the numbers are prompt evaluation only.
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/prompt_prefix_benchmark.py --output bench_results/prompt_prefix.json
+    python benchmarks/prompt_prefix_benchmark.py --ollama-url http://localhost:11434 --model llama3 --nights 20
+"""
+import os
+import sys
+import json
+import asyncio
+import argparse
+import statistics
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from settings import get_settings
+from agents.rule_engine import RuleEngine
+from agents.sleep_analyzer import SleepAnalyzerAgent, ANALYSIS_SYSTEM_PROMPT
+from agents.coach_agent import CoachAgent, COACHING_SYSTEM_PROMPT
+from agents.insight_agent import SleepInsightAgent
+from models.sleep_entry import SleepEntry
+from benchmarks.results import latency_summary, write_results
+from benchmarks.stub_ollama import StubConfig, build_app
+
+LAYOUTS = ("system", "inline", "data_first")
+
+
+def make_entries(count: int) -> List[SleepEntry]:
+    """Nights with different numbers, so no two prompts share more than the instructions."""
+    first = date(2025, 5, 1)
+    return [
+        SleepEntry(
+            date=first + timedelta(days=offset),
+            bedtime=datetime(2025, 5, 1, 22, 0) + timedelta(days=offset, minutes=17 * offset % 150),
+            waketime=datetime(2025, 5, 2, 6, 0) + timedelta(days=offset, minutes=11 * offset % 90),
+            duration_minutes=330 + 13 * offset % 150,
+            rem_minutes=60 + 7 * offset % 50,
+            deep_minutes=35 + 5 * offset % 40,
+            core_minutes=220 + 11 * offset % 90,
+        )
+        for offset in range(count)
+    ]
+
+
+async def agent_prompts(entries: List[SleepEntry]) -> Dict[str, List[Tuple[str, str]]]:
+    """{prompt name: [(system, prompt) per night]} as the agents build them."""
+    settings = get_settings()
+    rule_engine = RuleEngine.from_config(settings.analysis_rules_path)
+    analyzer = SleepAnalyzerAgent(None, rule_engine=rule_engine, backend="hybrid", settings=settings)
+    coach = CoachAgent(None, settings=settings)
+    insight = SleepInsightAgent(None, rule_engine, backend="rules", settings=settings)
+    prompts: Dict[str, List[Tuple[str, str]]] = {"analyzer": [], "analyzer_findings": [], "coach": [], "insight": []}
+    for entry in entries:
+        issues = rule_engine.evaluate(entry)
+        prompts["analyzer"].append((ANALYSIS_SYSTEM_PROMPT, await analyzer._construct_analysis_prompt(entry)))
+        prompts["analyzer_findings"].append((analyzer.findings_system_prompt, await analyzer._construct_additional_findings_prompt(entry, issues)))
+        prompts["coach"].append((COACHING_SYSTEM_PROMPT, await coach._construct_coaching_prompt(entry, issues)))
+        prompts["insight"].append((insight.system_prompt, await insight._construct_insight_prompt(entry, issues)))
+    return prompts
+
+
+def payload_for(layout: str, model: str, system: str, prompt: str) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {"model": model, "stream": False, "options": {"num_predict": 1, "temperature": 0.0}, "keep_alive": "10m"}
+    if layout == "system":
+        payload.update(system=system, prompt=prompt)
+    elif layout == "inline":
+        payload["prompt"] = f"{system}\n\n{prompt}"
+    else:
+        payload["prompt"] = f"{prompt}\n\n{system}"
+    return payload
+
+
+async def measure(client: httpx.AsyncClient, model: str, prompts: Dict[str, List[Tuple[str, str]]]) -> List[Dict[str, Any]]:
+    await client.post("/api/generate", json={"model": model, "stream": False, "keep_alive": "10m"}) # Load the model
+    results = []
+    for name, requests in prompts.items():
+        for layout in LAYOUTS:
+            durations: List[float] = []
+            counts: List[int] = []
+            for system, prompt in requests:
+                response = await client.post("/api/generate", json=payload_for(layout, model, system, prompt))
+                response.raise_for_status()
+                data = response.json()
+                durations.append(data.get("prompt_eval_duration", 0) / 1e9)
+                counts.append(data.get("prompt_eval_count", 0))
+            summary = latency_summary(durations[1:] or durations)
+            result = {
+                "name": f"{name} {layout}",
+                "first_prompt_eval_ms": round(durations[0] * 1000, 3),
+                **{f"prompt_eval_{metric}": value for metric, value in summary.items()},
+                "prompt_eval_count_mean": round(statistics.mean(counts[1:] or counts), 1),
+                "system_chars": len(requests[0][0]),
+                "prompt_chars_mean": round(statistics.mean(len(prompt) for _, prompt in requests), 1),
+            }
+            print(json.dumps(result))
+            results.append(result)
+    return results
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull): # Agent start-up logging
+        prompts = await agent_prompts(make_entries(args.nights + 1))
+    if args.ollama_url:
+        client = httpx.AsyncClient(base_url=args.ollama_url, timeout=args.request_timeout)
+    else:
+        stub = build_app(StubConfig(latency=0.0, tokens_per_second=0.0, prompt_tokens_per_second=args.prompt_tokens_per_second, cache_slots=1))
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://stub", timeout=args.request_timeout)
+    async with client:
+        return await measure(client, args.model, prompts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nights", type=int, default=10, help="Measured requests per prompt and layout (plus one to fill the cache).")
+    parser.add_argument("--ollama-url", help="Base URL of a real Ollama server, e.g. http://localhost:11434.")
+    parser.add_argument("--model", help="Model for every prompt (default: the coach model from the settings).")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=500.0, help="Stub prompt evaluation speed.")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Path to write the results as JSON.")
+    args = parser.parse_args()
+    args.model = args.model or get_settings().coach_model
+
+    results = asyncio.run(run(args))
+    config: Dict[str, Optional[Any]] = {
+        "nights": args.nights,
+        "model": args.model,
+        "ollama_url": args.ollama_url,
+        "stub_prompt_tokens_per_second": None if args.ollama_url else args.prompt_tokens_per_second,
+    }
+    write_results(args.output, "prompt_prefix", config, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Shared result format of the benchmark scripts, so runs can be diffed with benchmarks/compare.py.
+
+Every script writes one JSON document:
+    {"suite": "...", "created_at": "...", "git_revision": "...", "python": "...",
+     "config": {...}, "results": [{"name": "...", <numeric metrics>}, ...]}
+"""
+import os
+import sys
+import json
+import math
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Linear-interpolated percentile (q in 0..100) of unsorted values, None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    lower, upper = math.floor(rank), math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def latency_summary(seconds: Sequence[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/mean/max in milliseconds."""
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 3) if value is not None else None
+    return {
+        "p50_ms": ms(percentile(seconds, 50)),
+        "p95_ms": ms(percentile(seconds, 95)),
+        "p99_ms": ms(percentile(seconds, 99)),
+        "mean_ms": ms(sum(seconds) / len(seconds)) if seconds else None,
+        "max_ms": ms(max(seconds)) if seconds else None,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: Optional[str], suite: str, config: Dict[str, Any], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    document = {
+        "suite": suite,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+    }
+    if path:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as output_file:
+            json.dump(document, output_file, indent=2)
+        print(f"Results written to {path}")
+    return document
@@ -0,0 +1,189 @@
+"""
+Benchmark: cold-start import time of the app and the per-request cost of its dependencies.
+
+1. Import time: `python -c "import main"` in a fresh interpreter, --imports times, minus the bare
+   interpreter start-up, plus the slowest of main's imports from `python -X importtime`.
+2. Per request: sequential POST /submit-sleep in-process (ASGITransport, lifespan started, throwaway
+   SQLite database, an instant fake Ollama client) with
+     - "shared":      the app-scoped agents injected by get_agents (created once in the lifespan),
+     - "per_request": settings and agents built for every request, as main.py used to do,
+   reporting latency and the memory allocated per request (tracemalloc peak above the baseline).
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/startup_benchmark.py --output bench_results/startup.json
+    python benchmarks/startup_benchmark.py --imports 20 --requests 500
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.results import latency_summary, write_results
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SAMPLE_PAYLOAD = {
+    "bedtime": "2025-05-25T01:00:00",
+    "waketime": "2025-05-25T05:00:00",
+    "duration_minutes": 240,
+    "rem_minutes": 30,
+    "deep_minutes": 20,
+    "core_minutes": 190,
+}
+
+
+def run_python(code: str, env: Dict[str, str], importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    return subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+
+
+def slowest_imports(importtime_output: str, module: str, count: int) -> Dict[str, float]:
+    """The modules imported directly by `module`, by cumulative import time in ms (-X importtime output)."""
+    children: Dict[str, float] = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, package = line[len("import time:"):].split("|")
+        depth = (len(package) - len(package.lstrip()) - 1) // 2
+        if depth == 0 and package.strip() == module:
+            break # A module's imports are listed before the module itself
+        if depth == 0:
+            children = {} # Belonged to another top-level import (site, encodings, ...)
+        elif depth == 1:
+            children[package.strip()] = int(cumulative_us) / 1000
+    top = sorted(children.items(), key=lambda item: item[1], reverse=True)[:count]
+    return {package: round(milliseconds, 3) for package, milliseconds in top}
+
+
+def measure_imports(runs: int, env: Dict[str, str]) -> List[Dict[str, Any]]:
+    def timed(code: str) -> List[float]:
+        seconds = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            run_python(code, env)
+            seconds.append(time.perf_counter() - started)
+        return seconds
+
+    interpreter = timed("pass")
+    app_import = timed("import main")
+    import_only = [total - statistics.median(interpreter) for total in app_import]
+    breakdown = slowest_imports(run_python("import main", env, importtime=True).stderr, "main", count=10)
+    return [
+        {"name": "import main", **latency_summary(import_only), "interpreter_ms": round(statistics.median(interpreter) * 1000, 3)},
+        {"name": "import main breakdown", "cumulative_ms": breakdown},
+    ]
+
+
+class InstantOllamaClient:
+    """Stands in for OllamaClient and answers immediately, so only the app's own work is measured."""
+
+    async def generate(self, model_name: str, prompt: str, stream: bool = False, **kwargs: Any) -> Dict[str, Any]:
+        return {"model": model_name, "response": json.dumps(["Keep a regular bedtime", "Limit caffeine", "Dim the lights"]), "done": True}
+
+
+async def measure_requests(requests: int) -> List[Dict[str, Any]]:
+    import httpx
+    import main
+    from settings import Settings, get_settings
+    from db.database import Base, async_engine
+    from agents.pipeline import PipelineAgents
+
+    async with async_engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+
+    results = []
+    async with main.lifespan(main.app):
+        fake_client = InstantOllamaClient()
+        rule_engine = main.app.state.rule_engine
+        shared_agents = PipelineAgents.create(fake_client, rule_engine, get_settings())
+        modes: Dict[str, Callable[[], Any]] = {
+            "shared": lambda: shared_agents,
+            "per_request": lambda: PipelineAgents.create(fake_client, rule_engine, Settings.from_env()),
+        }
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for mode, dependency in modes.items():
+                main.app.dependency_overrides[main.get_agents] = dependency
+                nights = iter(range(10 * requests))
+
+                async def submit() -> float:
+                    night = date(2000, 1, 1) + timedelta(days=next(nights))
+                    payload = {**SAMPLE_PAYLOAD, "user_id": f"startup-{mode}", "date": night.isoformat()}
+                    started = time.perf_counter()
+                    response = await client.post("/submit-sleep", json=payload)
+                    response.raise_for_status()
+                    return time.perf_counter() - started
+
+                for _ in range(min(20, requests)): # Warm-up: first-call caches, pool connections
+                    await submit()
+                latencies = [await submit() for _ in range(requests)]
+
+                tracemalloc.start()
+                allocated = []
+                for _ in range(min(requests, 200)):
+                    tracemalloc.reset_peak()
+                    baseline = tracemalloc.get_traced_memory()[0]
+                    await submit()
+                    allocated.append(tracemalloc.get_traced_memory()[1] - baseline)
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                dependency()
+                dependency_bytes = tracemalloc.get_traced_memory()[1] - baseline
+                tracemalloc.stop()
+                started = time.perf_counter()
+                for _ in range(100):
+                    dependency()
+                dependency_seconds = (time.perf_counter() - started) / 100
+
+                results.append({
+                    "name": f"request {mode}",
+                    **latency_summary(latencies),
+                    "allocated_kib_p50": round(statistics.median(allocated) / 1024, 3),
+                    "dependency_kib": round(dependency_bytes / 1024, 3),
+                    "dependency_us": round(dependency_seconds * 1e6, 3),
+                })
+        main.app.dependency_overrides.clear()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imports", type=int, default=10, help="Fresh interpreters started per import measurement.")
+    parser.add_argument("--requests", type=int, default=300, help="Measured requests per dependency mode.")
+    parser.add_argument("--output", help="Path to write the results as JSON.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sleep_coach_startup_")
+    # Set before the app is imported, here and in the child interpreters
+    os.environ.update({
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(work_dir, 'bench.db')}",
+        "DATABASE_READ_URL": "",
+        "OLLAMA_API_URL": os.getenv("OLLAMA_API_URL") or "http://127.0.0.1:11434/api/generate", # Never called
+        "OLLAMA_WARMUP_ENABLED": "false",
+        "OLLAMA_CACHE_ENABLED": "false",
+        "TRACE_FILE": os.path.join(work_dir, "traces.jsonl"),
+    })
+
+    results = measure_imports(args.imports, dict(os.environ))
+    print(json.dumps(results[0]))
+    print(json.dumps(results[1]))
+    with open(os.path.join(work_dir, "app.log"), "w") as app_log, redirect_stdout(app_log):
+        request_results = asyncio.run(measure_requests(args.requests))
+    for result in request_results:
+        print(json.dumps(result))
+    results.extend(request_results)
+    write_results(args.output, "startup", {"imports": args.imports, "requests": args.requests}, results)
+
+
+if __name__ == "__main__":
+    main()
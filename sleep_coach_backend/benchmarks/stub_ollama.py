@@ -0,0 +1,206 @@
+"""
+Fake Ollama server for load tests: POST /api/generate (plain and NDJSON streaming) and GET /api/ps
+and /api/tags.
+
+Every generation waits --latency seconds (prompt evaluation / time to first token), then emits its
+tokens at --tokens-per-second. The first request for a model also pays --load-seconds, like a
+cold model. With --prompt-tokens-per-second, prompt evaluation is simulated too (about 4
+characters per token, rendered like a chat template with the system message first): the prompts
+of the last --cache-slots requests per model stay in a simulated KV cache and only the tokens after
+the longest shared prefix are evaluated, which is how Ollama reuses a stable prompt prefix
+(--no-prefix-cache turns that off). Responses carry Ollama's timing fields (eval_count,
+eval_duration, prompt_eval_*, load_duration), so the app's metrics and traces look like they do against a real server.
+Output matches what the agents ask for: a JSON array of strings, or {"issues", "tips"} when a JSON
+schema is requested. Errors can be injected as HTTP status codes or as errors in the middle
+of a stream.
+
+Usage (from sleep_coach_backend/):
+    python benchmarks/stub_ollama.py --port 11500 --latency 0.2 --tokens-per-second 40
+    python benchmarks/stub_ollama.py --error-rate 0.05 --error-status 503 --stream-error-rate 0.01
+    python benchmarks/stub_ollama.py --latency 0.05 --prompt-tokens-per-second 200
+"""
+import os
+import json
+import hashlib
+import random
+import asyncio
+import argparse
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Deque, Dict, List, Set, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TIPS = [
+    "Keep a consistent bedtime, even on weekends.",
+    "Stop caffeine at least eight hours before bed.",
+    "Dim screens and lights an hour before sleeping.",
+]
+
+
+@dataclass
+class StubConfig:
+    latency: float = 0.2              # seconds before the first token
+    tokens_per_second: float = 40.0   # generation speed (0 = instant)
+    load_seconds: float = 0.0         # extra delay on the first request for a model
+    error_rate: float = 0.0           # fraction of generations answered with error_status
+    error_status: int = 503
+    stream_error_rate: float = 0.0    # fraction of streams that fail after the first chunk
+    prompt_tokens_per_second: float = 0.0  # prompt evaluation speed, added to latency (0 = part of latency)
+    prefix_cache: bool = True         # skip the prompt prefix shared with a cached prompt
+    cache_slots: int = 4              # cached prompts per model (Ollama's parallel slots)
+    seed: int = 7
+
+
+def _response_text(payload: Dict[str, Any]) -> str:
+    output_format = payload.get("format")
+    if isinstance(output_format, dict) and "tips" in output_format.get("properties", {}):
+        return json.dumps({"issues": ["Late bedtime"], "tips": TIPS})
+    return json.dumps(TIPS)
+
+
+def _tokens(text: str) -> List[str]:
+    """Roughly one token per word, keeping the separators so the chunks join back to the text."""
+    words = text.split(" ")
+    return [word + (" " if index < len(words) - 1 else "") for index, word in enumerate(words)]
+
+
+def build_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="Stub Ollama")
+    rng = random.Random(config.seed)
+    loaded: Set[str] = set()
+    kv_cache: Dict[str, Deque[str]] = {}
+    counters = {"requests": 0, "errors": 0, "stream_errors": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+
+    async def load(model: str) -> int:
+        """Returns the load duration in ns (0 once the model is resident)."""
+        if model in loaded:
+            return 0
+        await asyncio.sleep(config.load_seconds)
+        loaded.add(model)
+        return int(config.load_seconds * 1e9)
+
+    def evaluate_prompt(model: str, text: str) -> Tuple[int, float]:
+        """(evaluated tokens, seconds) for a rendered prompt; the longest cached prefix is skipped."""
+        total = max(1, len(text) // 4)
+        slots = kv_cache.setdefault(model, deque(maxlen=max(1, config.cache_slots)))
+        cached = 0
+        if config.prefix_cache:
+            cached = max((len(os.path.commonprefix([previous, text])) // 4 for previous in slots), default=0)
+        slots.append(text)
+        evaluated = max(1, total - cached) # The last token is always evaluated
+        counters["prompt_tokens"] += total
+        counters["cached_prompt_tokens"] += total - evaluated
+        if config.prompt_tokens_per_second > 0:
+            return evaluated, evaluated / config.prompt_tokens_per_second
+        return evaluated, 0.0
+
+    def timings(prompt_tokens: int, prompt_seconds: float, tokens: int, load_ns: int) -> Dict[str, Any]:
+        eval_seconds = tokens / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        return {
+            "prompt_eval_count": prompt_tokens,
+            # Without a prompt speed the whole latency counts as prompt evaluation
+            "prompt_eval_duration": int((prompt_seconds or config.latency) * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(eval_seconds * 1e9),
+            "load_duration": load_ns,
+            "total_duration": int((config.latency + prompt_seconds + eval_seconds) * 1e9) + load_ns,
+        }
+
+    @app.post("/api/generate")
+    async def generate(request: Request) -> Any:
+        payload = await request.json()
+        model = payload.get("model", "unknown")
+        counters["requests"] += 1
+        if payload.get("prompt") is None:
+            # A preload (warm-up / keep_alive ping)
+            load_ns = await load(model)
+            return {"model": model, "response": "", "done": True, "done_reason": "load", "load_duration": load_ns}
+        if rng.random() < config.error_rate:
+            counters["errors"] += 1
+            return JSONResponse({"error": "injected failure"}, status_code=config.error_status)
+
+        load_ns = await load(model)
+        # Roughly what a chat template renders: the system message comes first
+        system = f"<|system|>\n{payload['system']}\n" if payload.get("system") else ""
+        rendered = f"{system}<|user|>\n{payload['prompt']}\n<|assistant|>\n"
+        prompt_tokens, prompt_seconds = evaluate_prompt(model, rendered)
+        first_token_delay = config.latency + prompt_seconds
+        tokens = _tokens(_response_text(payload))
+        token_delay = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        fail_stream = rng.random() < config.stream_error_rate
+
+        if not payload.get("stream", True):
+            await asyncio.sleep(first_token_delay + token_delay * len(tokens))
+            return {"model": model, "response": "".join(tokens), "done": True, "done_reason": "stop", **timings(prompt_tokens, prompt_seconds, len(tokens), load_ns)}
+
+        async def chunks() -> AsyncIterator[str]:
+            await asyncio.sleep(first_token_delay)
+            for index, token in enumerate(tokens):
+                if fail_stream and index == 1:
+                    counters["stream_errors"] += 1
+                    yield json.dumps({"error": "injected stream failure"}) + "\n"
+                    return
+                yield json.dumps({"model": model, "response": token, "done": False}) + "\n"
+                if token_delay:
+                    await asyncio.sleep(token_delay)
+            yield json.dumps({"model": model, "response": "", "done": True, "done_reason": "stop", **timings(prompt_tokens, prompt_seconds, len(tokens), load_ns)}) + "\n"
+
+        return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+    @app.get("/api/ps")
+    async def ps() -> Dict[str, Any]:
+        return {"models": [{"name": model, "model": model} for model in sorted(loaded)]}
+
+    @app.get("/api/tags")
+    async def tags() -> Dict[str, Any]:
+        # Every model the stub has served counts as pulled; the digest only depends on the name
+        return {"models": [{"name": model, "model": model, "digest": hashlib.sha256(model.encode("utf-8")).hexdigest()} for model in sorted(loaded)]}
+
+    @app.get("/stub/stats")
+    async def stats() -> Dict[str, Any]:
+        return {"config": asdict(config), **counters, "loaded_models": sorted(loaded)}
+
+    return app
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = StubConfig()
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="Seconds before the first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second, help="Generation speed, 0 for instant.")
+    parser.add_argument("--load-seconds", type=float, default=defaults.load_seconds, help="Cold model load delay per model.")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Fraction of generations that fail.")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status, help="HTTP status of injected failures.")
+    parser.add_argument("--stream-error-rate", type=float, default=defaults.stream_error_rate, help="Fraction of streams that fail midway.")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=defaults.prompt_tokens_per_second,
+                        help="Prompt evaluation speed, added to --latency; 0 counts --latency as prompt evaluation.")
+    parser.add_argument("--no-prefix-cache", dest="prefix_cache", action="store_false", help="Evaluate every prompt in full.")
+    parser.add_argument("--cache-slots", type=int, default=defaults.cache_slots, help="Prompts per model kept in the simulated KV cache.")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        load_seconds=args.load_seconds,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        stream_error_rate=args.stream_error_rate,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        prefix_cache=args.prefix_cache,
+        cache_slots=args.cache_slots,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(build_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
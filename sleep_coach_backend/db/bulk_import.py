@@ -0,0 +1,315 @@
+"""
+Streaming bulk importer for sleep history exports.
+
+    python -m db.bulk_import data/sample_sleep_data.json
+    python -m db.bulk_import export.ndjson.gz --batch-size 20000
+    python -m db.bulk_import history.csv --restart
+    python -m db.bulk_import alice.json --user-id alice
+
+Reads a JSON array, NDJSON or CSV file (optionally gzipped) record by record, so memory stays
+bounded by the batch size. Each batch is validated with Pydantic and loaded in one transaction:
+on PostgreSQL through COPY into a temporary staging table followed by a single
+INSERT ... SELECT that skips (user_id, date) nights already in sleep_entries (or repeated within
+the batch); records without a user_id belong to --user-id;
+on other databases through an executemany INSERT with the same duplicate skipping.
+The stats rollups (db/rollups.py) are updated with the inserted rows in the same transaction.
+
+Progress is checkpointed to a sidecar file (<source>.checkpoint) after every committed batch,
+so an interrupted import resumes where it stopped. A batch that was committed just before a
+crash is imported again on resume, which the duplicate skipping turns into a no-op.
+Run from the sleep_coach_backend directory (like alembic).
+"""
+import os
+import io
+import csv
+import sys
+import gzip
+import json
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import insert, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import AsyncSessionLocal, async_engine
+from db.rollups import apply_rollups
+from db.history import bump_history_versions
+from models.db_models import SleepOrm
+from models.sleep_entry import SleepEntry, DEFAULT_USER_ID
+from json_stream import JsonArrayStreamParser
+
+IMPORT_FORMATS = ("json", "ndjson", "csv")
+COLUMNS = ("user_id", "date", "bedtime", "waketime", "duration_minutes", "rem_minutes", "deep_minutes", "core_minutes")
+READ_CHUNK_SIZE = 1 << 16
+STAGING_TABLE = "sleep_entries_import"
+
+_BATCH_ADAPTER = TypeAdapter(List[SleepEntry])
+
+
+def detect_format(path: str) -> str:
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".json"):
+        return "json"
+    raise ValueError(f"Cannot detect the format of {path}, pass --format ({'/'.join(IMPORT_FORMATS)}).")
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return open(path, "r", encoding="utf-8", newline="")
+
+
+def iter_records(path: str, import_format: str) -> Iterator[Any]:
+    """Yields raw records one at a time without reading the whole file."""
+    with _open_text(path) as source:
+        if import_format == "json":
+            parser = JsonArrayStreamParser()
+            while not parser.finished:
+                chunk = source.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield from parser.feed(chunk)
+            if not parser.finished:
+                raise ValueError(f"{path} ended before the JSON array was closed (unparsed: {(parser.remainder() or '')[:80]!r}).")
+        elif import_format == "ndjson":
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # Empty CSV cells become None so they fail validation instead of parsing as ""
+            for row in csv.DictReader(source):
+                yield {key: (value if value != "" else None) for key, value in row.items()}
+
+
+def validate_batch(records: List[Any]) -> Tuple[List[SleepEntry], List[Tuple[int, str]]]:
+    """
+    Validates a whole batch in one call. Only if that fails are the records validated one by one,
+    so a single bad row costs a slower batch instead of aborting the import.
+    Returns (valid entries, [(position in batch, error)]).
+    """
+    try:
+        return _BATCH_ADAPTER.validate_python(records), []
+    except ValidationError:
+        pass
+    entries: List[SleepEntry] = []
+    errors: List[Tuple[int, str]] = []
+    for position, record in enumerate(records):
+        try:
+            entries.append(SleepEntry.model_validate(record))
+        except ValidationError as e:
+            errors.append((position, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())))
+    return entries, errors
+
+
+class ImportCheckpoint:
+    """Sidecar JSON file recording how many source records have been committed."""
+
+    def __init__(self, source_path: str, checkpoint_path: Optional[str] = None):
+        self.source_path = os.path.abspath(source_path)
+        self.path = checkpoint_path or f"{source_path}.checkpoint"
+        self.source_size = os.path.getsize(source_path)
+        self.records_done = 0
+        self.totals = {"inserted": 0, "duplicates": 0, "invalid": 0}
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("source") != self.source_path or state.get("source_size") != self.source_size:
+            print(f"Ignoring checkpoint {self.path}: it belongs to a different or modified source file.")
+            return False
+        self.records_done = state["records_done"]
+        self.totals.update(state.get("totals", {}))
+        return True
+
+    def save(self) -> None:
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "source": self.source_path,
+                "source_size": self.source_size,
+                "records_done": self.records_done,
+                "totals": self.totals,
+            }, f)
+        os.replace(temporary_path, self.path) # Atomic, a crash never leaves a torn checkpoint
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+async def _load_batch_postgres(session: AsyncSession, entries: List[SleepEntry]) -> int:
+    """COPY into a per-transaction staging table, then one set-based INSERT that skips duplicates."""
+    connection = await session.connection()
+    # Same column types as sleep_entries but no id/sequence; emptied at every commit and reused
+    # for as long as the pooled connection lives
+    await connection.execute(text(
+        f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} ON COMMIT DELETE ROWS "
+        f"AS SELECT {', '.join(COLUMNS)} FROM sleep_entries WITH NO DATA"
+    ))
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        STAGING_TABLE,
+        records=[tuple(getattr(entry, column) for column in COLUMNS) for entry in entries],
+        columns=list(COLUMNS),
+    )
+    column_list = ", ".join(COLUMNS)
+    result = await connection.execute(text(
+        f"INSERT INTO sleep_entries ({column_list}) "
+        f"SELECT DISTINCT ON (staged.user_id, staged.date) {', '.join(f'staged.{column}' for column in COLUMNS)} "
+        f"FROM {STAGING_TABLE} AS staged "
+        f"WHERE NOT EXISTS (SELECT 1 FROM sleep_entries AS existing "
+        f"WHERE existing.user_id = staged.user_id AND existing.date = staged.date) "
+        f"ORDER BY staged.user_id, staged.date "
+        f"ON CONFLICT (user_id, date) DO NOTHING " # A night inserted concurrently by the API
+        f"RETURNING {column_list}"
+    ))
+    inserted_rows = result.all()
+    await apply_rollups(session, inserted_rows)
+    await bump_history_versions(session, (row.user_id for row in inserted_rows))
+    return len(inserted_rows)
+
+
+async def _load_batch_generic(session: AsyncSession, entries: List[SleepEntry]) -> int:
+    """Fallback for databases without COPY: skip known nights, then one executemany INSERT."""
+    nights = list({(entry.user_id, entry.date) for entry in entries})
+    existing_nights = set((await session.execute(
+        select(SleepOrm.user_id, SleepOrm.date).where(tuple_(SleepOrm.user_id, SleepOrm.date).in_(nights))
+    )).tuples())
+    new_entries: List[SleepEntry] = []
+    for entry in entries:
+        night = (entry.user_id, entry.date)
+        if night in existing_nights:
+            continue
+        existing_nights.add(night)
+        new_entries.append(entry)
+    if new_entries:
+        await session.execute(insert(SleepOrm), [entry.model_dump() for entry in new_entries])
+        await apply_rollups(session, new_entries)
+        await bump_history_versions(session, (entry.user_id for entry in new_entries))
+    return len(new_entries)
+
+
+async def import_file(
+    path: str,
+    import_format: Optional[str] = None,
+    batch_size: int = 10000,
+    resume: bool = True,
+    checkpoint_path: Optional[str] = None,
+    progress_interval: float = 5.0,
+    max_error_reports: int = 20,
+    user_id: str = DEFAULT_USER_ID,
+) -> Dict[str, int]:
+    """Imports one file and returns the totals (records, inserted, duplicates, invalid)."""
+    import_format = import_format or detect_format(path)
+    checkpoint = ImportCheckpoint(path, checkpoint_path)
+    if resume and checkpoint.load():
+        print(f"Resuming {path} after {checkpoint.records_done} records (checkpoint {checkpoint.path}).")
+    elif not resume:
+        checkpoint.remove()
+    load_batch = _load_batch_postgres if async_engine.dialect.name == "postgresql" else _load_batch_generic
+
+    started = time.monotonic()
+    last_report = started
+    records_this_run = 0
+    errors_reported = 0
+
+    async def flush(batch: List[Any]) -> None:
+        nonlocal records_this_run, errors_reported, last_report
+        entries, errors = validate_batch([
+            {**record, "user_id": user_id} if isinstance(record, dict) and record.get("user_id") is None else record
+            for record in batch
+        ])
+        inserted = 0
+        if entries:
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    inserted = await load_batch(session, entries)
+        batch_start = checkpoint.records_done
+        for position, error in errors:
+            if errors_reported < max_error_reports:
+                print(f"Invalid record #{batch_start + position}: {error}")
+                errors_reported += 1
+        checkpoint.records_done += len(batch)
+        checkpoint.totals["inserted"] += inserted
+        checkpoint.totals["duplicates"] += len(entries) - inserted
+        checkpoint.totals["invalid"] += len(errors)
+        checkpoint.save()
+        records_this_run += len(batch)
+
+        now = time.monotonic()
+        if now - last_report >= progress_interval:
+            last_report = now
+            rate = records_this_run / (now - started)
+            print(f"{checkpoint.records_done} records, {checkpoint.totals['inserted']} inserted, "
+                  f"{checkpoint.totals['duplicates']} duplicates, {checkpoint.totals['invalid']} invalid ({rate:,.0f} rows/s)")
+
+    batch: List[Any] = []
+    to_skip = checkpoint.records_done
+    for record in iter_records(path, import_format):
+        if to_skip:
+            to_skip -= 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    elapsed = time.monotonic() - started
+    rate = records_this_run / elapsed if elapsed > 0 else 0.0
+    totals = {"records": checkpoint.records_done, **checkpoint.totals}
+    print(f"Imported {path}: {totals['records']} records, {totals['inserted']} inserted, {totals['duplicates']} duplicates skipped, "
+          f"{totals['invalid']} invalid in {elapsed:.1f}s ({rate:,.0f} rows/s).")
+    if errors_reported < checkpoint.totals["invalid"]:
+        print(f"({checkpoint.totals['invalid'] - errors_reported} more invalid records not shown.)")
+    checkpoint.remove() # Finished, a re-run starts from the top (and skips everything as duplicates)
+    return totals
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk import sleep history into sleep_entries.")
+    parser.add_argument("path", help="JSON array, NDJSON or CSV file, optionally .gz")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=10000, help="records validated and committed together")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint and start from the first record")
+    parser.add_argument("--checkpoint", help="checkpoint file, defaults to <path>.checkpoint")
+    parser.add_argument("--user-id", default=DEFAULT_USER_ID, help="owner of records that have no user_id")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    async def run() -> None:
+        try:
+            await import_file(
+                args.path,
+                import_format=args.format,
+                batch_size=args.batch_size,
+                resume=not args.restart,
+                checkpoint_path=args.checkpoint,
+                progress_interval=args.progress_interval,
+                user_id=args.user_id,
+            )
+        finally:
+            await async_engine.dispose()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to resume from the last checkpoint.")
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
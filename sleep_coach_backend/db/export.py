@@ -0,0 +1,83 @@
+import io
+import csv
+import json
+import zlib
+from datetime import date
+from typing import AsyncIterator, Iterable, Optional, Sequence
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.database import AsyncSessionLocal
+from models.db_models import SleepOrm
+from models.sleep_entry import DEFAULT_USER_ID
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+EXPORT_COLUMNS = ("id", "user_id", "date", "bedtime", "waketime", "duration_minutes", "rem_minutes", "deep_minutes", "core_minutes")
+# Rows fetched per round trip from the server-side cursor, and rows encoded per chunk sent
+EXPORT_YIELD_PER = 1000
+
+def _encode_ndjson(rows: Iterable[Sequence]) -> str:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=lambda value: value.isoformat()) + "\n"
+        for row in rows
+    )
+
+def _encode_csv(rows: Iterable[Sequence]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows([value.isoformat() if isinstance(value, date) else value for value in row] for row in rows)
+    return buffer.getvalue()
+
+async def stream_sleep_export(
+    export_format: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    compress: bool = False,
+    user_id: str = DEFAULT_USER_ID,
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+) -> AsyncIterator[bytes]:
+    """
+    Streams one user's sleep entries (ordered by date) as NDJSON or CSV, optionally gzip-compressed.
+    Rows come from a server-side cursor in partitions of EXPORT_YIELD_PER, so memory stays
+    constant regardless of table size. The session is opened inside the generator, i.e. only
+    once the response starts streaming, and is released when the stream ends or the client
+    disconnects.
+    """
+    encode = _encode_ndjson if export_format == "ndjson" else _encode_csv
+    compressor = zlib.compressobj(wbits=31) if compress else None # wbits=31 -> gzip container
+
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor is not None else data
+
+    if export_format == "csv":
+        # The header goes out before the query runs, so the first byte doesn't wait on the DB
+        header = emit(",".join(EXPORT_COLUMNS) + "\n")
+        if compressor is not None:
+            header += compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield header
+
+    statement = (
+        select(*(getattr(SleepOrm, column) for column in EXPORT_COLUMNS))
+        .where(SleepOrm.user_id == user_id)
+        .order_by(SleepOrm.date, SleepOrm.id)
+    )
+    if start is not None:
+        statement = statement.where(SleepOrm.date >= start)
+    if end is not None:
+        statement = statement.where(SleepOrm.date <= end)
+
+    async with session_factory() as session:
+        result = await session.stream(statement.execution_options(yield_per=EXPORT_YIELD_PER))
+        async for partition in result.partitions():
+            chunk = emit(encode(partition))
+            if compressor is not None:
+                # Sync flush so every partition reaches the client now instead of sitting in zlib's window
+                chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if chunk:
+                yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,100 @@
+import json
+import base64
+import hashlib
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db.database import dialect_insert
+from models.db_models import SleepOrm, SleepHistoryVersionOrm
+from models.sleep_entry import DEFAULT_USER_ID, StoredSleepEntry, SleepHistoryPage
+
+class InvalidCursorError(ValueError):
+    pass
+
+def encode_cursor(entry_date: date, entry_id: int) -> str:
+    """Opaque keyset cursor: the (date, id) of the last entry on the page."""
+    raw = json.dumps([entry_date.isoformat(), entry_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        entry_date, entry_id = json.loads(raw)
+        return date.fromisoformat(entry_date), int(entry_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+async def history_version(session: AsyncSession, user_id: str = DEFAULT_USER_ID) -> str:
+    """
+    Identifies the current state of one user's entries without reading any of them: the user's
+    write counter (one primary key lookup). Writes for other users leave it alone.
+    """
+    version = await session.scalar(select(SleepHistoryVersionOrm.version).where(SleepHistoryVersionOrm.user_id == user_id))
+    return str(version or 0)
+
+async def bump_history_versions(session: AsyncSession, user_ids: Iterable[str]) -> None:
+    """
+    Increments the history version of every user in `user_ids` inside the caller's transaction.
+    The upsert holds the user's row lock until commit, so concurrent writers are serialized and
+    each committed write leaves a version no reader has seen before.
+    """
+    user_ids = sorted(set(user_ids)) # A fixed lock order, so two writers can't deadlock
+    if not user_ids:
+        return
+    table = SleepHistoryVersionOrm.__table__
+    statement = dialect_insert(session)(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={"version": table.c.version + 1},
+    )
+    await session.execute(statement, [{"user_id": user_id, "version": 1} for user_id in user_ids])
+
+def make_etag(version: str, params: Dict[str, Any]) -> str:
+    """Weak ETag for one page: the data version plus the query that produced the page."""
+    material = json.dumps({"version": version, **params}, sort_keys=True, default=str)
+    return f'W/"{hashlib.sha256(material.encode("utf-8")).hexdigest()[:32]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # Weak comparison (RFC 9110): the W/ prefix is ignored on both sides
+    return "*" in candidates or etag.removeprefix("W/") in [candidate.removeprefix("W/") for candidate in candidates]
+
+async def fetch_history_page(
+    session: AsyncSession,
+    limit: int,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    user_id: str = DEFAULT_USER_ID,
+) -> SleepHistoryPage:
+    """
+    One page of a user's sleep entries ordered by (date, id) using keyset pagination: the page
+    starts right after the cursor's (date, id), so the cost is the same for page 1 and page 10,000
+    (an index range scan on uq_sleep_entries_user_date, no OFFSET). On PostgreSQL the date bounds
+    also prune the monthly partitions that are scanned.
+    """
+    key = tuple_(SleepOrm.date, SleepOrm.id)
+    statement = select(SleepOrm).where(SleepOrm.user_id == user_id)
+    if order == "desc":
+        statement = statement.order_by(SleepOrm.date.desc(), SleepOrm.id.desc())
+    else:
+        statement = statement.order_by(SleepOrm.date, SleepOrm.id)
+    if cursor is not None:
+        cursor_key = tuple_(*decode_cursor(cursor))
+        statement = statement.where(key < cursor_key if order == "desc" else key > cursor_key)
+    if start is not None:
+        statement = statement.where(SleepOrm.date >= start)
+    if end is not None:
+        statement = statement.where(SleepOrm.date <= end)
+
+    # One extra row tells whether there is a next page without a COUNT
+    rows: List[SleepOrm] = list((await session.execute(statement.limit(limit + 1))).scalars())
+    items = [StoredSleepEntry.model_validate(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1].date, items[-1].id) if len(rows) > limit else None
+    return SleepHistoryPage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,139 @@
+"""
+Monthly range partitions of sleep_entries (PostgreSQL only).
+
+sleep_entries is PARTITION BY RANGE (date) with one partition per calendar month
+(sleep_entries_y2025m06 holds June 2025) and a DEFAULT partition, sleep_entries_default,
+for nights outside them. Queries with a date range or a single night only scan the matching
+months, and an old month can be detached as an ordinary table without rewriting anything.
+
+The migration creates partitions SLEEP_PARTITION_MONTHS_AHEAD months ahead. Run `ensure` from a
+monthly cron to stay ahead; nights that already landed in the default partition are moved into
+their new month:
+
+    python -m db.partitions ensure
+    python -m db.partitions list
+    python -m db.partitions detach --before 2019-01-01
+
+Detached months keep their name and can be archived or dropped. The stats rollups still count
+their nights until the next python -m db.rollups rebuild.
+Run from the sleep_coach_backend directory (like alembic).
+"""
+import re
+import sys
+import asyncio
+import argparse
+from datetime import date
+from typing import List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db.database import async_engine
+from settings import get_settings
+
+PARENT_TABLE = "sleep_entries"
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_MONTHS_AHEAD = get_settings().database.partition_months_ahead
+_PARTITION_NAME = re.compile(rf"^{PARENT_TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+def partition_month(name: str) -> Optional[date]:
+    """The month a partition name stands for, None for the default partition or foreign tables."""
+    match = _PARTITION_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+async def list_partitions(connection: AsyncConnection) -> List[Tuple[str, Optional[date], int]]:
+    """(name, month, estimated rows) of every attached partition, in month order (default last)."""
+    result = await connection.execute(text(
+        "SELECT child.relname, child.reltuples::bigint FROM pg_inherits "
+        "JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = CAST(:parent AS regclass)"
+    ), {"parent": PARENT_TABLE})
+    partitions = [(name, partition_month(name), max(0, estimate)) for name, estimate in result]
+    return sorted(partitions, key=lambda partition: (partition[1] is None, partition[1] or date.min))
+
+async def ensure_partitions(connection: AsyncConnection, first_month: date, last_month: date) -> List[str]:
+    """
+    Creates the missing monthly partitions from first_month to last_month (inclusive) and returns
+    their names. Each month is built as a standalone table, filled with its nights from the default
+    partition, then attached: a plain CREATE ... PARTITION OF would fail once the default partition
+    holds a night of that month.
+    """
+    existing = {name for name, _, _ in await list_partitions(connection)}
+    has_default = DEFAULT_PARTITION in existing
+    created = []
+    next_month = month_start(first_month)
+    while next_month <= last_month:
+        month, next_month = next_month, add_months(next_month, 1)
+        name = partition_name(month)
+        if name in existing:
+            continue
+        bounds = {"start": month, "end": next_month}
+        await connection.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        if has_default:
+            await connection.execute(text(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date >= :start AND date < :end RETURNING *) "
+                f"INSERT INTO {name} SELECT * FROM moved"
+            ), bounds)
+        # Indexes and the primary/unique keys are created on the partition by ATTACH
+        await connection.execute(text(
+            f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start'].isoformat()}') TO ('{bounds['end'].isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+async def detach_partitions(connection: AsyncConnection, before: date) -> List[str]:
+    """Detaches every monthly partition that ends on or before `before` and returns their names."""
+    detached = []
+    for name, month, _ in await list_partitions(connection):
+        if month is not None and add_months(month, 1) <= before:
+            await connection.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}"))
+            detached.append(name)
+    return detached
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of sleep_entries.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ensure_parser = subparsers.add_parser("ensure", help="create missing partitions up to --months-ahead")
+    ensure_parser.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    ensure_parser.add_argument("--from", dest="first_month", type=date.fromisoformat, help="first month to create, defaults to the current month")
+    subparsers.add_parser("list", help="show the attached partitions")
+    detach_parser = subparsers.add_parser("detach", help="detach months that end on or before --before")
+    detach_parser.add_argument("--before", type=date.fromisoformat, required=True)
+    args = parser.parse_args(argv)
+
+    if async_engine.dialect.name != "postgresql":
+        print(f"sleep_entries is only partitioned on PostgreSQL, not on {async_engine.dialect.name}.")
+        return 1
+
+    async def run() -> None:
+        try:
+            async with async_engine.begin() as connection:
+                if args.command == "ensure":
+                    current_month = month_start(date.today())
+                    created = await ensure_partitions(connection, args.first_month or current_month, add_months(current_month, args.months_ahead))
+                    print(f"Created {len(created)} partitions: {', '.join(created)}" if created else "All partitions already exist.")
+                elif args.command == "detach":
+                    detached = await detach_partitions(connection, args.before)
+                    print(f"Detached {len(detached)} partitions: {', '.join(detached)}" if detached else "Nothing to detach.")
+                else:
+                    for name, month, estimate in await list_partitions(connection):
+                        print(f"{name:<28} {month.strftime('%Y-%m') if month else 'default':<8} ~{estimate} rows")
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.database import AsyncSessionLocal, dialect_insert
+from models.db_models import AnalysisResultOrm
+
+async def load_stored_result(
+    sleep_entry_id: int,
+    fingerprint: str,
+    analyzer_model: Optional[str],
+    coach_model: str,
+    analyzer_model_digest: Optional[str],
+    coach_model_digest: Optional[str],
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+) -> Optional[Tuple[List[str], List[str]]]:
+    """
+    (analysis, suggestions) stored for the entry, if they were produced from the same input and
+    the same model builds. A model whose digest is unknown never matches.
+    """
+    if coach_model_digest is None or (analyzer_model is not None and analyzer_model_digest is None):
+        return None
+    async with session_factory() as session:
+        result = await session.get(AnalysisResultOrm, sleep_entry_id)
+    stored = None if result is None else (result.fingerprint, result.analyzer_model, result.analyzer_model_digest, result.coach_model, result.coach_model_digest)
+    if stored != (fingerprint, analyzer_model, analyzer_model_digest, coach_model, coach_model_digest):
+        return None
+    return result.analysis, result.suggestions
+
+async def save_result(
+    sleep_entry_id: int,
+    fingerprint: str,
+    analyzer_model: Optional[str],
+    coach_model: str,
+    analyzer_model_digest: Optional[str],
+    coach_model_digest: Optional[str],
+    analysis: List[str],
+    suggestions: List[str],
+    session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+) -> None:
+    """Stores or replaces the entry's result with one INSERT ... ON CONFLICT (sleep_entry_id) DO UPDATE."""
+    values = {
+        "fingerprint": fingerprint,
+        "analyzer_model": analyzer_model,
+        "coach_model": coach_model,
+        "analyzer_model_digest": analyzer_model_digest,
+        "coach_model_digest": coach_model_digest,
+        "analysis": analysis,
+        "suggestions": suggestions,
+    }
+    async with session_factory() as session:
+        async with session.begin():
+            statement = dialect_insert(session)(AnalysisResultOrm).values(sleep_entry_id=sleep_entry_id, **values)
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=[AnalysisResultOrm.sleep_entry_id],
+                set_={**values, "updated_at": func.now()},
+            ))
@@ -0,0 +1,226 @@
+"""
+Incrementally maintained daily / weekly / monthly rollups of sleep_entries, per user.
+
+Every write path folds its new nights into the three rollup tables in the same transaction
+(apply_rollups), so GET /sleep/stats reads a handful of buckets instead of scanning the
+entries. If the rollups ever drift (manual SQL, a changed SLEEP_TARGET_MINUTES), rebuild them:
+
+    python -m db.rollups rebuild
+
+Run from the sleep_coach_backend directory (like alembic).
+"""
+import sys
+import math
+import asyncio
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Type
+
+from sqlalchemy import delete, func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.database import AsyncSessionLocal, async_engine, dialect_insert
+from models.db_models import SleepOrm, DailySleepRollupOrm, WeeklySleepRollupOrm, MonthlySleepRollupOrm
+from models.sleep_entry import DEFAULT_USER_ID
+from settings import get_settings
+
+# Nightly target used for sleep debt; stored in the rollups, so changing it requires a rebuild
+SLEEP_TARGET_MINUTES = get_settings().sleep_target_minutes
+ROLLUP_TABLES: Dict[str, Type] = {
+    "day": DailySleepRollupOrm,
+    "week": WeeklySleepRollupOrm,
+    "month": MonthlySleepRollupOrm,
+}
+ROLLUP_SUM_COLUMNS = (
+    "nights",
+    "duration_minutes_sum",
+    "rem_minutes_sum",
+    "deep_minutes_sum",
+    "core_minutes_sum",
+    "sleep_debt_minutes_sum",
+    "bedtime_minutes_sum",
+    "bedtime_minutes_sq_sum",
+)
+STATS_WINDOWS_DAYS = (7, 30, 90)
+
+def bucket_start(granularity: str, day: date) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def bedtime_minutes(bedtime: datetime) -> int:
+    """Minutes after noon, so bedtimes either side of midnight (23:30, 00:30) stay close together."""
+    return (bedtime.hour * 60 + bedtime.minute - 12 * 60) % (24 * 60)
+
+def _night_sums(entry: Any) -> Dict[str, int]:
+    minutes_after_noon = bedtime_minutes(entry.bedtime)
+    return {
+        "nights": 1,
+        "duration_minutes_sum": entry.duration_minutes,
+        "rem_minutes_sum": entry.rem_minutes,
+        "deep_minutes_sum": entry.deep_minutes,
+        "core_minutes_sum": entry.core_minutes,
+        "sleep_debt_minutes_sum": max(0, SLEEP_TARGET_MINUTES - entry.duration_minutes),
+        "bedtime_minutes_sum": minutes_after_noon,
+        "bedtime_minutes_sq_sum": minutes_after_noon * minutes_after_noon,
+    }
+
+def aggregate_rollups(entries: Iterable[Any], removed: Iterable[Any] = ()) -> Dict[str, Dict[Tuple[str, date], Dict[str, int]]]:
+    """
+    Sums per granularity and (user_id, bucket start) for any objects with the SleepEntry
+    attributes. Nights in `removed` (e.g. the old values of an updated entry) are subtracted.
+    """
+    buckets: Dict[str, Dict[Tuple[str, date], Dict[str, int]]] = {
+        granularity: defaultdict(lambda: dict.fromkeys(ROLLUP_SUM_COLUMNS, 0)) for granularity in ROLLUP_TABLES
+    }
+    for sign, nights in ((1, entries), (-1, removed)):
+        for entry in nights:
+            sums = _night_sums(entry)
+            for granularity in ROLLUP_TABLES:
+                bucket = buckets[granularity][(entry.user_id, bucket_start(granularity, entry.date))]
+                for column, value in sums.items():
+                    bucket[column] += sign * value
+    return buckets
+
+async def apply_rollups(session: AsyncSession, entries: Sequence[Any], removed: Sequence[Any] = ()) -> None:
+    """
+    Adds new nights to the rollups (and subtracts `removed` ones) inside the caller's
+    transaction. One upsert per table (INSERT ... ON CONFLICT (user_id, bucket_start) DO UPDATE
+    SET x = x + excluded.x), so concurrent writers to the same bucket can't lose each
+    other's increments.
+    """
+    if not entries and not removed:
+        return
+    insert_construct = dialect_insert(session)
+    for granularity, buckets in aggregate_rollups(entries, removed).items():
+        table = ROLLUP_TABLES[granularity].__table__
+        statement = insert_construct(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.bucket_start],
+            set_={column: table.c[column] + statement.excluded[column] for column in ROLLUP_SUM_COLUMNS},
+        )
+        await session.execute(statement, [
+            {"user_id": user_id, "bucket_start": start, **sums} for (user_id, start), sums in sorted(buckets.items())
+        ])
+
+async def rebuild_rollups(session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal, yield_per: int = 10000) -> int:
+    """
+    Recomputes all rollups from sleep_entries in one transaction. Entries are streamed, so
+    memory grows with the number of buckets, not rows. Returns the number of entries read.
+    """
+    entry_count = 0
+    totals = {granularity: defaultdict(lambda: dict.fromkeys(ROLLUP_SUM_COLUMNS, 0)) for granularity in ROLLUP_TABLES}
+    async with session_factory() as session:
+        async with session.begin():
+            if session.bind.dialect.name == "postgresql":
+                # Block writers until the rebuilt rollups are committed so no increment is lost
+                await session.execute(text("LOCK TABLE sleep_entries IN SHARE MODE"))
+            result = await session.stream(
+                select(SleepOrm.user_id, SleepOrm.date, SleepOrm.bedtime, SleepOrm.duration_minutes, SleepOrm.rem_minutes, SleepOrm.deep_minutes, SleepOrm.core_minutes)
+                .execution_options(yield_per=yield_per)
+            )
+            async for partition in result.partitions():
+                entry_count += len(partition)
+                for granularity, buckets in aggregate_rollups(partition).items():
+                    for key, sums in buckets.items():
+                        bucket = totals[granularity][key]
+                        for column, value in sums.items():
+                            bucket[column] += value
+
+            for granularity, model in ROLLUP_TABLES.items():
+                await session.execute(delete(model))
+                rows = [
+                    {"user_id": user_id, "bucket_start": start, **sums}
+                    for (user_id, start), sums in sorted(totals[granularity].items())
+                ]
+                if rows:
+                    await session.execute(insert(model), rows)
+    return entry_count
+
+def _summarize(rows: Iterable[Any]) -> Dict[str, Any]:
+    """Averages, total sleep debt and bedtime consistency for a set of rollup rows."""
+    sums = dict.fromkeys(ROLLUP_SUM_COLUMNS, 0)
+    for row in rows:
+        for column in ROLLUP_SUM_COLUMNS:
+            sums[column] += getattr(row, column)
+    nights = sums["nights"]
+    if not nights:
+        return {"nights": 0}
+    mean_bedtime = sums["bedtime_minutes_sum"] / nights
+    variance = max(0.0, sums["bedtime_minutes_sq_sum"] / nights - mean_bedtime * mean_bedtime)
+    mean_clock_minutes = int(round(mean_bedtime + 12 * 60)) % (24 * 60)
+    return {
+        "nights": nights,
+        "avg_duration_minutes": round(sums["duration_minutes_sum"] / nights, 1),
+        "avg_rem_minutes": round(sums["rem_minutes_sum"] / nights, 1),
+        "avg_deep_minutes": round(sums["deep_minutes_sum"] / nights, 1),
+        "avg_core_minutes": round(sums["core_minutes_sum"] / nights, 1),
+        "sleep_debt_minutes": sums["sleep_debt_minutes_sum"],
+        "avg_bedtime": f"{mean_clock_minutes // 60:02d}:{mean_clock_minutes % 60:02d}",
+        "bedtime_stddev_minutes": round(math.sqrt(variance), 1),
+    }
+
+async def fetch_sleep_stats(
+    session: AsyncSession,
+    as_of: Optional[date] = None,
+    series: str = "week",
+    periods: int = 12,
+    user_id: str = DEFAULT_USER_ID,
+) -> Dict[str, Any]:
+    """
+    Rolling 7/30/90-day windows of one user from the daily rollups plus a trend series of the
+    last `periods` weekly or monthly buckets. Reads at most 90 + periods rollup rows.
+    """
+    daily = ROLLUP_TABLES["day"]
+    if as_of is None:
+        as_of = (await session.execute(select(func.max(daily.bucket_start)).where(daily.user_id == user_id))).scalar()
+    if as_of is None:
+        return {"as_of": None, "target_minutes": SLEEP_TARGET_MINUTES, "windows": {}, "series": {"granularity": series, "buckets": []}}
+
+    longest_window = max(STATS_WINDOWS_DAYS)
+    daily_rows: List[Any] = list((await session.execute(
+        select(daily)
+        .where(daily.user_id == user_id, daily.bucket_start > as_of - timedelta(days=longest_window), daily.bucket_start <= as_of)
+    )).scalars())
+    windows = {
+        f"{days}d": _summarize(row for row in daily_rows if row.bucket_start > as_of - timedelta(days=days))
+        for days in STATS_WINDOWS_DAYS
+    }
+
+    series_model = ROLLUP_TABLES[series]
+    series_rows = list((await session.execute(
+        select(series_model)
+        .where(series_model.user_id == user_id, series_model.bucket_start <= bucket_start(series, as_of))
+        .order_by(series_model.bucket_start.desc())
+        .limit(periods)
+    )).scalars())
+    return {
+        "as_of": as_of.isoformat(),
+        "target_minutes": SLEEP_TARGET_MINUTES,
+        "windows": windows,
+        "series": {
+            "granularity": series,
+            "buckets": [{"start": row.bucket_start.isoformat(), **_summarize([row])} for row in reversed(series_rows)],
+        },
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the sleep rollup tables.")
+    parser.add_argument("command", choices=("rebuild",))
+    parser.parse_args(argv)
+
+    async def run() -> None:
+        try:
+            entry_count = await rebuild_rollups()
+            print(f"Rebuilt sleep rollups from {entry_count} entries.")
+        finally:
+            await async_engine.dispose()
+
+    asyncio.run(run())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
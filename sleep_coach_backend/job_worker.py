@@ -0,0 +1,277 @@
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Coroutine, Dict, List, Optional, Set
+
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from db.database import AsyncSessionLocal
+from models.db_models import SleepOrm, JobOrm
+from models.sleep_entry import SleepEntry
+from agents.pipeline import PipelineAgents, run_analysis_pipeline
+from ollama_scheduler import OllamaOverloadedError
+from settings import JobSettings, get_settings
+from tracing import trace, annotate
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+UNFINISHED_JOB_STATUSES = (JOB_PENDING, JOB_RUNNING)
+
+def _utcnow() -> datetime:
+    """Naive UTC, set by the worker itself so lease checks don't depend on the database clock."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class JobWorkerPool:
+    """
+    Bounded in-process worker pool for async submissions.
+    Job state lives in the analysis_jobs table, the in-memory queue only holds job ids,
+    so unfinished jobs can be picked up again after a restart (see recover_unfinished_jobs).
+    Jobs are claimed with a compare-and-set on their status, and a running job holds a lease
+    (updated_at, refreshed by a heartbeat) so other processes only take it over once it expired.
+    Every claim writes its own lease_owner token; heartbeats and results only touch the row while
+    that token is still on it, so a worker whose lease was taken over can't overwrite the new run.
+    No DB connection is held while a job waits on Ollama.
+    """
+
+    def __init__(
+        self,
+        agents: PipelineAgents,
+        session_factory: async_sessionmaker[AsyncSession] = AsyncSessionLocal,
+        workers: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        settings: Optional[JobSettings] = None,
+    ):
+        settings = settings or get_settings().jobs
+        self.agents = agents # Created with priority="batch", so interactive submissions are served first
+        self.session_factory = session_factory
+        self.worker_count = workers or settings.workers
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queue or settings.queue_size)
+        self._workers: List[asyncio.Task] = []
+        self._background: Set[asyncio.Task] = set()
+        # Seconds without a heartbeat after which a "running" job is considered abandoned
+        self.lease_seconds = settings.lease_seconds
+        self._finished_events: Dict[str, asyncio.Event] = {} # Only for jobs someone is waiting on
+        self._waiters: Dict[str, int] = {}
+        self._running: Dict[str, str] = {} # job id -> lease_owner token of our claim
+
+    async def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker(index)) for index in range(self.worker_count)]
+        # Re-enqueueing may have to wait for queue space, so don't block startup on it
+        self._spawn(self.recover_unfinished_jobs())
+        print(f"JobWorkerPool started with {self.worker_count} workers (queue size {self.queue.maxsize}).")
+
+    async def stop(self) -> None:
+        tasks = self._workers + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Hand the jobs this process was running back right away instead of waiting for their lease
+        if self._running:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    for job_id, lease_owner in self._running.items():
+                        await session.execute(
+                            update(JobOrm)
+                            .where(*self._owned(job_id, lease_owner))
+                            .values(status=JOB_PENDING, lease_owner=None)
+                        )
+            self._running.clear()
+        print("JobWorkerPool stopped.")
+
+    def has_capacity(self) -> bool:
+        return not self.queue.full()
+
+    def submit(self, job_id: str) -> None:
+        """Enqueues a stored job. If the queue filled up in the meantime, waits for space in the background."""
+        try:
+            self.queue.put_nowait(job_id)
+        except asyncio.QueueFull:
+            self._spawn(self.queue.put(job_id))
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, Any]) -> None:
+        """Runs a helper coroutine in the background, cancelled together with the workers on stop()."""
+        task = asyncio.create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _claimable(self, now: datetime) -> Any:
+        """Pending jobs, and running jobs whose worker stopped renewing the lease."""
+        return or_(
+            JobOrm.status == JOB_PENDING,
+            and_(JobOrm.status == JOB_RUNNING, JobOrm.updated_at < now - timedelta(seconds=self.lease_seconds)),
+        )
+
+    async def recover_unfinished_jobs(self) -> int:
+        """
+        Re-enqueues pending jobs and running jobs with an expired lease, oldest first. Jobs that a
+        live worker in another process is running keep their lease and are left alone; a pending
+        job queued by another process as well is only run once (see _claim).
+        """
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(JobOrm.id)
+                .where(self._claimable(_utcnow()))
+                .order_by(JobOrm.created_at)
+            )
+            job_ids = list(result.scalars())
+        for job_id in job_ids:
+            await self.queue.put(job_id)
+        if job_ids:
+            print(f"JobWorkerPool: re-enqueued {len(job_ids)} unfinished job(s).")
+        return len(job_ids)
+
+    async def get_job(self, job_id: str) -> Optional[JobOrm]:
+        async with self.session_factory() as session:
+            return await session.get(JobOrm, job_id)
+
+    async def wait_for(self, job_id: str, timeout: float) -> None:
+        """Long-poll helper: returns when the job finishes in this process or the timeout expires."""
+        event = self._finished_events.setdefault(job_id, asyncio.Event())
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            # Checked after registering, so a job finishing in between still sets the event
+            job = await self.get_job(job_id)
+            if job is not None and job.status in UNFINISHED_JOB_STATUSES:
+                await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters[job_id] -= 1
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+                if self._finished_events.get(job_id) is event:
+                    del self._finished_events[job_id]
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self.queue.get()
+            try:
+                with trace("job", job_id=job_id):
+                    await self._run_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"JobWorkerPool worker {index}: job {job_id} crashed: {e}")
+            finally:
+                self.queue.task_done()
+
+    @staticmethod
+    def _owned(job_id: str, lease_owner: str) -> List[Any]:
+        """The job is still running under our claim."""
+        return [JobOrm.id == job_id, JobOrm.status == JOB_RUNNING, JobOrm.lease_owner == lease_owner]
+
+    async def _claim(self, job_id: str) -> Optional[str]:
+        """
+        Compare-and-set pending (or lease-expired running) -> running. Returns the claim's
+        lease_owner token, or None if another worker has the job.
+        """
+        lease_owner = os.urandom(8).hex()
+        async with self.session_factory() as session:
+            async with session.begin():
+                now = _utcnow()
+                result = await session.execute(
+                    update(JobOrm)
+                    .where(JobOrm.id == job_id, self._claimable(now))
+                    .values(status=JOB_RUNNING, attempts=JobOrm.attempts + 1, updated_at=now, lease_owner=lease_owner)
+                )
+        return lease_owner if result.rowcount == 1 else None
+
+    async def _heartbeat(self, job_id: str, lease_owner: str) -> None:
+        """
+        Renews the lease of a running job until cancelled. A failed renewal is logged and retried
+        at the next beat; it stops once the lease is gone (taken over, or the job was handed back).
+        """
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                async with self.session_factory() as session:
+                    async with session.begin():
+                        result = await session.execute(
+                            update(JobOrm)
+                            .where(*self._owned(job_id, lease_owner))
+                            .values(updated_at=_utcnow())
+                        )
+            except Exception as e:
+                print(f"JobWorkerPool: could not renew the lease of job {job_id}, retrying: {e}")
+                continue
+            if result.rowcount != 1:
+                print(f"JobWorkerPool: job {job_id} lost its lease, its result will be discarded.")
+                return
+
+    async def _run_job(self, job_id: str) -> None:
+        # 1. Claim the job and load its entry (short transactions)
+        lease_owner = await self._claim(job_id)
+        if lease_owner is None:
+            job = await self.get_job(job_id)
+            if job is None or job.status not in UNFINISHED_JOB_STATUSES:
+                self._mark_finished(job_id)
+            return # Otherwise another worker is running it
+        self._running[job_id] = lease_owner
+        async with self.session_factory() as session:
+            job = await session.get(JobOrm, job_id)
+            sleep_orm = await session.get(SleepOrm, job.sleep_entry_id)
+            if sleep_orm is not None:
+                sleep_entry = SleepEntry.model_validate(sleep_orm, from_attributes=True)
+                sleep_entry_id = sleep_orm.id
+        if sleep_orm is None:
+            await self._finish(job_id, lease_owner, JOB_FAILED, error="Sleep entry no longer exists.")
+            return
+
+        # 2. Run the LLM pipeline without holding any DB resources, renewing the lease meanwhile
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, lease_owner))
+        try:
+            analysis_issues, coaching_suggestions = await run_analysis_pipeline(sleep_entry, self.agents, sleep_entry_id=sleep_entry_id)
+        except OllamaOverloadedError as e:
+            # Not a job failure: put it back and retry once Ollama has capacity again
+            if await self._finish(job_id, lease_owner, JOB_PENDING, notify=False):
+                self._spawn(self._requeue_later(job_id, e.retry_after))
+            return
+        except Exception as e:
+            await self._finish(job_id, lease_owner, JOB_FAILED, error=f"Job failed: {str(e)}")
+            return
+        finally:
+            heartbeat.cancel()
+
+        # 3. Persist the results (short transaction)
+        await self._finish(job_id, lease_owner, JOB_DONE, analysis=analysis_issues, suggestions=coaching_suggestions)
+
+    async def _requeue_later(self, job_id: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self.queue.put(job_id)
+
+    async def _finish(
+        self,
+        job_id: str,
+        lease_owner: str,
+        status: str,
+        analysis: Optional[List[str]] = None,
+        suggestions: Optional[List[str]] = None,
+        error: Optional[str] = None,
+        notify: bool = True,
+    ) -> bool:
+        """Stores the outcome if our claim still holds the job; False (outcome dropped) if it lost the lease."""
+        async with self.session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    update(JobOrm)
+                    .where(*self._owned(job_id, lease_owner))
+                    .values(status=status, analysis=analysis, suggestions=suggestions, error=error, lease_owner=None)
+                )
+        self._running.pop(job_id, None) # A job cancelled by stop() stays in _running and is handed back there
+        if result.rowcount != 1:
+            print(f"JobWorkerPool: job {job_id} was taken over by another worker, discarding status {status}.")
+            annotate(status="lease_lost")
+            return False
+        annotate(status=status)
+        if notify:
+            print(f"JobWorkerPool: job {job_id} finished with status {status}.")
+            self._mark_finished(job_id)
+        return True
+
+    def _mark_finished(self, job_id: str) -> None:
+        event = self._finished_events.pop(job_id, None)
+        if event is not None:
+            event.set()
@@ -0,0 +1,150 @@
+import json
+from typing import Any, List, Optional
+
+_WHITESPACE = " \t\r\n"
+
+class JsonArrayStreamParser:
+    """
+    Incremental parser for a JSON array that arrives in arbitrary text fragments
+    (LLM tokens, file chunks). feed() returns the array elements completed by the new text,
+    so callers can act on each element long before the closing bracket arrives.
+
+    The first '[' in the stream starts the array, which also covers the common LLM habit of
+    wrapping the array in an object such as {"tips": [...]}. Anything after the closing ']'
+    is ignored.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self.started = False
+        self.finished = False
+        self.element_count = 0
+
+    def feed(self, text: str) -> List[Any]:
+        if self.finished or not text:
+            return []
+        self._buffer += text
+
+        if not self.started:
+            array_start = self._buffer.find("[")
+            if array_start == -1:
+                return []
+            self.started = True
+            self._position = array_start + 1
+
+        elements: List[Any] = []
+        while True:
+            position = self._skip(self._position)
+            if position >= len(self._buffer):
+                break
+            if self._buffer[position] == "]":
+                self.finished = True
+                self._position = position + 1
+                break
+            try:
+                element, end = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                break # Element still incomplete, wait for more text
+            # A scalar at the very end of the buffer may still grow ("12" -> "123"),
+            # so only accept an element once the following delimiter has arrived.
+            delimiter = self._skip(end, skip_commas=False)
+            if delimiter >= len(self._buffer):
+                break
+            if self._buffer[delimiter] not in ",]":
+                raise ValueError(f"Unexpected character {self._buffer[delimiter]!r} after array element at offset {delimiter}.")
+            elements.append(element)
+            self.element_count += 1
+            self._position = delimiter
+
+        # Drop consumed text so long streams don't keep growing the buffer
+        if self._position > 65536:
+            self._buffer = self._buffer[self._position:]
+            self._position = 0
+        return elements
+
+    def _skip(self, position: int, skip_commas: bool = True) -> int:
+        skipped = _WHITESPACE + "," if skip_commas else _WHITESPACE
+        buffer = self._buffer
+        while position < len(buffer) and buffer[position] in skipped:
+            position += 1
+        return position
+
+    def remainder(self) -> Optional[str]:
+        """Unparsed text left in the buffer, useful for error messages once the stream ends."""
+        rest = self._buffer[self._position:].strip()
+        return rest or None
+
+
+class JsonValueScanner:
+    """
+    Detects the end of the first complete top-level JSON value in streamed text without
+    re-parsing: each character is looked at once, tracking nesting depth and string state.
+    Used to stop an LLM generation as soon as the JSON it was asked for is complete.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.end: Optional[int] = None # Offset just past the value once it is complete
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, text: str) -> bool:
+        """Adds text, returns True once the first top-level value is complete."""
+        if self.end is not None:
+            return True
+        offset = len(self.text)
+        self.text += text
+        for index in range(offset, len(self.text)):
+            char = self.text[index]
+            if self._start is None:
+                if char in _WHITESPACE:
+                    continue
+                self._start = index
+                if char in "{[":
+                    self._depth = 1
+                elif char == '"':
+                    self._in_string = True
+                # Other scalars (numbers, true/false/null) end at the next delimiter
+                continue
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 0: # A top-level string just closed
+                        self.end = index + 1
+                        return True
+                continue
+
+            if self._depth == 0:
+                if char in _WHITESPACE + ",]}":
+                    self.end = index
+                    return True
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = index + 1
+                    return True
+        return False
+
+    def value_text(self) -> str:
+        """The text of the completed value (or everything seen so far if incomplete)."""
+        if self.end is None:
+            return self.text.strip()
+        return self.text[self._start:self.end]
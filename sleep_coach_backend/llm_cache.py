@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple, Union
+
+from settings import CacheSettings
+
+class LLMResponseCache:
+    """
+    Two-tier cache for Ollama responses, keyed by a hash of (model, prompt, format, options).
+    Tier one is an in-memory LRU with a TTL. Tier two is an optional SQLite file that survives
+    restarts; disk hits are promoted back into memory.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600.0,
+        disk_path: Optional[str] = None,
+        disk_ttl_seconds: float = 7 * 24 * 3600.0,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.disk_ttl_seconds = disk_ttl_seconds
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "bypasses": 0,
+        }
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_lock = threading.Lock()
+        if disk_path:
+            self._open_disk(disk_path)
+
+    @classmethod
+    def from_settings(cls, settings: CacheSettings) -> "LLMResponseCache":
+        return cls(
+            max_entries=settings.max_entries,
+            ttl_seconds=settings.ttl_seconds,
+            disk_path=settings.disk_path,
+            disk_ttl_seconds=settings.disk_ttl_seconds,
+        )
+
+    @staticmethod
+    def make_key(
+        model_name: str,
+        prompt: str,
+        output_format: Optional[Union[str, Dict[str, Any]]] = None,
+        options: Optional[Dict[str, Any]] = None,
+        system: Optional[str] = None,
+    ) -> str:
+        """Content address of a generation request. Stable across processes."""
+        request: Dict[str, Any] = {"model": model_name, "prompt": prompt, "format": output_format, "options": options or {}}
+        if system:
+            request["system"] = system # Only when set, so keys of requests without one are unchanged
+        material = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return value
+            del self._memory[key]
+            self._counters["expirations"] += 1
+
+        if self._disk is not None:
+            value = await asyncio.to_thread(self._disk_get, key)
+            if value is not None:
+                self._counters["disk_hits"] += 1
+                self._memory_set(key, value)
+                return value
+
+        self._counters["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        self._memory_set(key, value)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk_set, key, value)
+
+    def record_bypass(self) -> None:
+        self._counters["bypasses"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+        lookups = hits + self._counters["misses"]
+        return {
+            **self._counters,
+            "hits": hits,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "disk_enabled": self._disk is not None,
+        }
+
+    def close(self) -> None:
+        if self._disk is not None:
+            with self._disk_lock:
+                self._disk.close()
+            self._disk = None
+
+    def _memory_set(self, key: str, value: Dict[str, Any]) -> None:
+        self._memory[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _open_disk(self, disk_path: str) -> None:
+        directory = os.path.dirname(os.path.abspath(disk_path))
+        os.makedirs(directory, exist_ok=True)
+        self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+        with self._disk_lock:
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # Drop anything that expired while the process was down
+            self._disk.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+            self._disk.commit()
+        print(f"LLMResponseCache: disk tier enabled at {disk_path}")
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._disk_lock:
+            row = self._disk.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time(): # Wall clock, the disk tier outlives the process
+                self._disk.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._disk.commit()
+                self._counters["expirations"] += 1
+                return None
+        return json.loads(row[0])
+
+    def _disk_set(self, key: str, value: Dict[str, Any]) -> None:
+        with self._disk_lock:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + self.disk_ttl_seconds),
+            )
+            self._disk.commit()
@@ -1,68 +1,153 @@
+import json
 import httpx
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Query, Body, Header, Response
+from pydantic import ValidationError
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from sqlalchemy.exc import SQLAlchemyError # For database errors
-from typing import Dict, Any, Annotated, List
+from typing import Dict, Any, Annotated, List, Literal, Optional, Union, AsyncIterator
+from datetime import date
 
-from models.sleep_entry import SleepEntry
-from agents.sleep_collector import SleepCollectorAgent
-from agents.sleep_analyzer import SleepAnalyzerAgent
-from agents.coach_agent import CoachAgent
-from db.database import get_db
+from settings import get_settings
+from models.sleep_entry import SleepEntry, DEFAULT_USER_ID
+from models.job import JobResponse
+from models.sleep_entry import SleepHistoryPage
+from agents.rule_engine import RuleEngine
+from agents.pipeline import PipelineAgents, run_analysis_pipeline, load_coach_history, pipeline_models
 from ollama_client import OllamaClient
+from ollama_scheduler import OllamaOverloadedError
+from ollama_backends import BREAKER_CLOSED
+from job_worker import JobWorkerPool, UNFINISHED_JOB_STATUSES
+from db.database import AsyncReadSessionLocal, database_engines, dispose_engines, warm_up_pool
+from db.export import stream_sleep_export, EXPORT_MEDIA_TYPES
+from db.rollups import fetch_sleep_stats
+from db.history import fetch_history_page, history_version, make_etag, etag_matches, InvalidCursorError
+import metrics
+import tracing
+from tracing import stage
 
-app = FastAPI(title="Sleep Coach Backend")
-
-# Manage httpx.AsyncClient and OllamaClient lifecycle with lifespan events
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Creates everything that lives as long as the app: the settings, HTTP and Ollama clients, the
+    compiled rules and the agents that requests get injected (get_agents), plus the job workers.
+    """
+    app.state.settings = settings = get_settings()
+    # Open a few database connections up front so the first requests don't wait on handshakes
+    for name, engine in database_engines().items():
+        try:
+            print(f"Database pool warm-up ({name}): {await warm_up_pool(engine)} connections opened.")
+        except Exception as e:
+            print(f"Database pool warm-up ({name}) failed, connections will be opened on demand: {e}")
     # Create a single httpx.AsyncClient for the app lifetime
     app.state.http_client = httpx.AsyncClient()
     # Create an OllamaClient instance using the http_client
-    app.state.ollama_client = OllamaClient(client=app.state.http_client)
+    app.state.ollama_client = OllamaClient(client=app.state.http_client, settings=settings)
+    # Periodic health probes of the Ollama backends (circuit breaker recovery, loaded models)
+    app.state.ollama_client.backends.start(app.state.http_client)
+    # Compile the analysis rules once, they are shared by every request
+    app.state.rule_engine = RuleEngine.from_config(settings.analysis_rules_path)
+    # The agents only hold configuration: one set for requests, one at batch priority for
+    # background work (async jobs, batch coaching) so interactive submissions are served first
+    app.state.agents = PipelineAgents.create(app.state.ollama_client, app.state.rule_engine, settings)
+    app.state.batch_agents = PipelineAgents.create(app.state.ollama_client, app.state.rule_engine, settings, priority="batch")
+    # Preload the pipeline's models in the background; GET /ready reports 503 until they are resident
+    if settings.warmup_enabled:
+        app.state.ollama_client.start_residency(pipeline_models(app.state.agents))
+    else:
+        app.state.ollama_client.warmed_up = True
+    # Start the background workers for async submissions (also resumes unfinished jobs)
+    app.state.job_pool = JobWorkerPool(agents=app.state.batch_agents, settings=settings.jobs)
+    await app.state.job_pool.start()
+    _install_pool_gauges(app.state.ollama_client, app.state.job_pool)
     print("FastAPI app started, HTTP client and Ollama client initialized.")
 
-@app.on_event("shutdown")
-async def shutdown_event():
+    yield
+
+    await app.state.job_pool.stop()
+    await app.state.ollama_client.stop_residency()
+    await app.state.ollama_client.backends.stop()
+    app.state.ollama_client.close()
     await app.state.http_client.aclose()
+    await dispose_engines()
+    tracing.shutdown() # Flush the traces still queued for the trace file
     print("FastAPI app shutting down, HTTP client closed.")
 
+app = FastAPI(title="Sleep Coach Backend", lifespan=lifespan)
+if metrics.METRICS_ENABLED:
+    app.add_middleware(metrics.RequestMetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware) # Sampled + slow request traces (TRACE_* settings)
+
+def _install_pool_gauges(ollama_client: OllamaClient, job_pool: JobWorkerPool) -> None:
+    """Pool usage for GET /metrics, read from the live objects at scrape time."""
+    def db_pools(read_value) -> Dict[tuple, float]:
+        # SQLite's pools don't all track usage, those engines are left out
+        return {
+            (name,): read_value(engine.pool)
+            for name, engine in database_engines().items()
+            if hasattr(engine.pool, "checkedout")
+        }
+
+    def scheduler_lanes(field: str) -> Dict[tuple, float]:
+        return {(model_name,): lane[field] for model_name, lane in ollama_client.scheduler.stats().items()}
+
+    metrics.DB_POOL_CHECKED_OUT.set_function(lambda: db_pools(lambda pool: pool.checkedout()))
+    metrics.DB_POOL_SIZE.set_function(lambda: db_pools(lambda pool: pool.size()))
+    metrics.OLLAMA_SLOTS_IN_USE.set_function(lambda: scheduler_lanes("active"))
+    metrics.OLLAMA_SLOTS.set_function(lambda: scheduler_lanes("concurrency"))
+    metrics.OLLAMA_QUEUE_DEPTH.set_function(lambda: scheduler_lanes("queue_depth"))
+    metrics.OLLAMA_BACKEND_OUTSTANDING.set_function(lambda: {
+        (backend.generate_url,): backend.outstanding for backend in ollama_client.backends.backends
+    })
+    metrics.OLLAMA_BACKEND_UP.set_function(lambda: {
+        (backend.generate_url,): int(backend.state == BREAKER_CLOSED) for backend in ollama_client.backends.backends
+    })
+    metrics.JOB_QUEUE_DEPTH.set_function(lambda: {(): job_pool.queue.qsize()})
+
 # Dependency to get OllamaClient
 def get_ollama_client() -> OllamaClient:
     return app.state.ollama_client
 
-@app.post("/submit-sleep")
+# Dependency to get the background job pool
+def get_job_pool() -> JobWorkerPool:
+    return app.state.job_pool
+
+# Dependencies to get the app-scoped agents (interactive, and batch priority)
+def get_agents() -> PipelineAgents:
+    return app.state.agents
+
+def get_batch_agents() -> PipelineAgents:
+    return app.state.batch_agents
+
+@app.post("/submit-sleep", response_model=None)
 async def submit_sleep_data_endpoint(
     sleep_entry_pydantic: SleepEntry, 
-    db: Annotated[AsyncSession, Depends(get_db)],
-    ollama_client: Annotated[OllamaClient, Depends(get_ollama_client)]
-) -> Dict[str, Any]:
+    agents: Annotated[PipelineAgents, Depends(get_agents)],
+    job_pool: Annotated[JobWorkerPool, Depends(get_job_pool)],
+    mode: Literal["sync", "async"] = "sync",
+) -> Union[Dict[str, Any], JSONResponse]:
     """
     Receives sleep data, stores it, analyzes it, and generates coaching suggestions.
+    The entry is committed (and its DB connection released) before any LLM call starts,
+    so no pooled connection is held while waiting on Ollama.
+
+    With mode=async the entry is stored together with a pending job and a 202 is returned
+    immediately; poll GET /jobs/{job_id} for the analysis and suggestions.
     """
     analysis_issues: List[str] = []
     coaching_suggestions: List[str] = []
 
+    if mode == "async":
+        return await _submit_sleep_data_async(sleep_entry_pydantic, agents, job_pool)
+
     try:
-        # 1. Store sleep data
-        collector_agent = SleepCollectorAgent(db_session=db)
-        await collector_agent.store_sleep_data(sleep_entry_pydantic)
+        # 1. Store sleep data (commits and releases the connection before returning)
+        entry_id, _ = await agents.collector.store_sleep_data(sleep_entry_pydantic)
         
-        # 2. Analyze sleep data
-        analyzer_agent = SleepAnalyzerAgent(ollama_client=ollama_client)
-        analysis_issues = await analyzer_agent.analyze_sleep_data_with_llm(sleep_entry_pydantic)
-        # Check if analysis itself failed and returned an error message in the list
-        if analysis_issues and analysis_issues[0].startswith("Error:") or analysis_issues[0].startswith("Sleep analysis by LLM failed:"):
-            # Allow processing to continue, but the error will be in the response.
-            # We could also choose to raise an HTTPException here if critical.
-            pass # Error is already captured in analysis_issues
-
-        # 3. Generate coaching suggestions
-        coach_agent = CoachAgent(ollama_client=ollama_client)
-        coaching_suggestions = await coach_agent.generate_coaching_tips(sleep_entry_pydantic, analysis_issues)
-        if coaching_suggestions and coaching_suggestions[0].startswith("Error:") or coaching_suggestions[0].startswith("Coaching tip generation failed:"):
-            # Allow processing to continue, error captured in coaching_suggestions
-            pass
+        # 2. Analyze sleep data and 3. generate coaching suggestions.
+        # Agent failures come back as error strings in the lists and are returned as-is.
+        # A resubmitted night with unchanged data gets its stored result without calling Ollama.
+        analysis_issues, coaching_suggestions = await run_analysis_pipeline(sleep_entry_pydantic, agents, sleep_entry_id=entry_id)
         
         return {
             "message": "Sleep data submitted, analyzed, and suggestions generated.",
@@ -70,6 +155,10 @@ async def submit_sleep_data_endpoint(
             "analysis": analysis_issues,
             "suggestions": coaching_suggestions
         }
+    except OllamaOverloadedError as e:
+        # Admission control rejected the LLM call, tell the client when to come back
+        print(f"Ollama overloaded: {e}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except httpx.RequestError as e:
         # Network error communicating with Ollama
         print(f"Ollama connection error: {e}")
@@ -88,12 +177,283 @@ async def submit_sleep_data_endpoint(
     except SQLAlchemyError as e:
         # Database related error
         print(f"Database error: {e}")
-        # Potentially rollback session, though get_db might handle this with a context manager approach in a real app
-        # For now, just report a generic server error for DB issues
+        # The collector's transaction has already been rolled back and no LLM work was started
         raise HTTPException(status_code=500, detail=f"A database error occurred: {str(e)}")
     except Exception as e:
         # Catch-all for any other unexpected errors
         print(f"An unexpected error occurred: {e}")
         raise HTTPException(status_code=500, detail=f"An unexpected server error occurred: {str(e)}")
 
+@app.post("/submit-sleep/stream")
+async def submit_sleep_data_stream_endpoint(
+    sleep_entry_pydantic: SleepEntry,
+    agents: Annotated[PipelineAgents, Depends(get_agents)],
+) -> StreamingResponse:
+    """
+    Same pipeline as /submit-sleep, delivered as Server-Sent Events:
+    an "entry" event once stored, an "analysis" event with the issues, one "tip" event per
+    coaching tip as soon as it is decoded from Ollama's token stream, then "done".
+    Failures after the stream has started are reported as an "error" event.
+    """
+    # Store before the stream starts so DB errors still produce a normal error response
+    try:
+        await agents.collector.store_sleep_data(sleep_entry_pydantic)
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=500, detail=f"A database error occurred: {str(e)}")
+
+    return StreamingResponse(
+        _stream_sleep_coaching(sleep_entry_pydantic, agents),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def _stream_sleep_coaching(sleep_entry_pydantic: SleepEntry, agents: PipelineAgents) -> AsyncIterator[str]:
+    yield _sse_event("entry", sleep_entry_pydantic.model_dump(mode="json"))
+    try:
+        with stage("analyzer"):
+            analysis_issues = await agents.analyzer.analyze_sleep_data(sleep_entry_pydantic)
+        yield _sse_event("analysis", analysis_issues)
+
+        history_summary = await load_coach_history(sleep_entry_pydantic, agents.settings.coach_history_days)
+        tip_count = 0
+        with stage("coach"):
+            async for tip in agents.coach.stream_coaching_tips(sleep_entry_pydantic, analysis_issues, history_summary):
+                yield _sse_event("tip", {"index": tip_count, "tip": tip})
+                tip_count += 1
+        yield _sse_event("done", {"tips": tip_count})
+    except OllamaOverloadedError as e:
+        print(f"Ollama overloaded: {e}")
+        yield _sse_event("error", {"detail": str(e), "retry_after": e.retry_after})
+    except Exception as e:
+        print(f"Streaming pipeline failed: {e}")
+        yield _sse_event("error", {"detail": f"Coaching tip generation failed: {str(e)}"})
+
+@app.post("/submit-sleep/batch")
+async def submit_sleep_batch_endpoint(
+    raw_entries: Annotated[List[Any], Body(description="A JSON array of sleep entries.")],
+    agents: Annotated[PipelineAgents, Depends(get_batch_agents)],
+    user_id: Annotated[str, Query(min_length=1, max_length=64, description="Owner of the entries.")] = DEFAULT_USER_ID,
+) -> Dict[str, Any]:
+    """
+    Receives many nights of one user at once (e.g. a device syncing after being offline).
+    Items without a user_id belong to the batch's user_id; items for another user are rejected.
+    Each item is validated on its own, invalid items are reported under "errors" without
+    failing the rest. Valid entries are stored with one bulk insert, analyzed with the rule
+    engine in one vectorized pass, and a single coaching generation covers the whole period.
+    """
+    # Upper bound (SUBMIT_BATCH_MAX_ENTRIES), roughly a year of nights by default
+    max_entries = agents.settings.submit_batch_max_entries
+    if len(raw_entries) > max_entries:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(raw_entries)} entries, at most {max_entries} allowed.")
+
+    valid_entries: List[SleepEntry] = []
+    valid_indexes: List[int] = []
+    errors: List[Dict[str, Any]] = []
+    for index, raw_entry in enumerate(raw_entries):
+        if isinstance(raw_entry, dict):
+            raw_entry = {"user_id": user_id, **raw_entry}
+        try:
+            sleep_entry = SleepEntry.model_validate(raw_entry)
+        except ValidationError as e:
+            errors.append({"index": index, "errors": json.loads(e.json(include_url=False, include_input=False))})
+            continue
+        if sleep_entry.user_id != user_id:
+            # One period coaching covers the batch, so it can't mix users
+            errors.append({"index": index, "errors": [{
+                "type": "user_mismatch",
+                "loc": ["user_id"],
+                "msg": f"Entry belongs to {sleep_entry.user_id!r}, the batch to {user_id!r}.",
+            }]})
+            continue
+        valid_entries.append(sleep_entry)
+        valid_indexes.append(index)
+
+    if not valid_entries:
+        return {
+            "message": "No valid sleep entries in the batch.",
+            "stored": 0,
+            "results": [],
+            "errors": errors,
+            "suggestions": [],
+        }
+
+    # 1. Store all valid entries in one bulk statement (commits before any LLM work starts)
+    try:
+        entry_ids = await agents.collector.store_many(valid_entries)
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=500, detail=f"A database error occurred: {str(e)}")
+
+    # 2. Vectorized rule analysis of the whole batch
+    with stage("analyzer"):
+        analysis_per_entry = agents.analyzer.analyze_many(valid_entries)
+
+    # 3. One coaching generation for the period (at batch priority). The entries are already
+    # stored, so an overloaded model is reported in the suggestions rather than failing the request.
+    try:
+        with stage("coach"):
+            coaching_suggestions = await agents.coach.generate_period_coaching_tips(valid_entries, analysis_per_entry)
+    except OllamaOverloadedError as e:
+        print(f"Ollama overloaded: {e}")
+        coaching_suggestions = [f"Coaching tip generation failed: {str(e)}"]
+
+    return {
+        "message": f"{len(valid_entries)} of {len(raw_entries)} sleep entries submitted and analyzed, suggestions generated for the period.",
+        "stored": len(valid_entries),
+        "results": [
+            {"index": index, "id": entry_id, "date": entry.date.isoformat(), "analysis": analysis}
+            for index, entry_id, entry, analysis in zip(valid_indexes, entry_ids, valid_entries, analysis_per_entry)
+        ],
+        "errors": errors,
+        "suggestions": coaching_suggestions,
+    }
+
+@app.get("/sleep", response_model=SleepHistoryPage)
+async def list_sleep_endpoint(
+    response: Response,
+    limit: Annotated[int, Query(ge=1, le=200)] = 30,
+    cursor: Annotated[Optional[str], Query(description="next_cursor from the previous page.")] = None,
+    order: Literal["desc", "asc"] = "desc",
+    start: Annotated[Optional[date], Query(description="First date to include (inclusive).")] = None,
+    end: Annotated[Optional[date], Query(description="Last date to include (inclusive).")] = None,
+    user_id: Annotated[str, Query(min_length=1, max_length=64, description="Whose nights to list.")] = DEFAULT_USER_ID,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+) -> Union[SleepHistoryPage, Response]:
+    """
+    Lists a user's stored nights, newest first by default, with keyset pagination on (date, id).
+    Every page carries an ETag derived from the user's latest write; a request with a matching
+    If-None-Match gets 304 Not Modified without any rows being fetched or serialized.
+    """
+    params = {"user_id": user_id, "limit": limit, "cursor": cursor, "order": order, "start": start, "end": end}
+    async with AsyncReadSessionLocal() as session:
+        etag = make_etag(await history_version(session, user_id), params)
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=cache_headers)
+        try:
+            page = await fetch_history_page(session, limit, cursor=cursor, order=order, start=start, end=end, user_id=user_id)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    response.headers.update(cache_headers)
+    return page
+
+@app.get("/sleep/stats")
+async def sleep_stats_endpoint(
+    as_of: Annotated[Optional[date], Query(description="Last night included in the windows, defaults to the most recent night.")] = None,
+    series: Literal["week", "month"] = "week",
+    periods: Annotated[int, Query(ge=1, le=120)] = 12,
+    user_id: Annotated[str, Query(min_length=1, max_length=64, description="Whose nights to summarize.")] = DEFAULT_USER_ID,
+) -> Dict[str, Any]:
+    """
+    Rolling 7/30/90-day averages (duration, REM, deep, core), sleep debt against the nightly
+    target and bedtime consistency, plus a weekly or monthly trend series.
+    Served from the rollup tables, so the cost depends on the number of buckets, not nights.
+    """
+    async with AsyncReadSessionLocal() as session:
+        return await fetch_sleep_stats(session, as_of=as_of, series=series, periods=periods, user_id=user_id)
+
+@app.get("/sleep/export")
+async def export_sleep_endpoint(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    start: Annotated[Optional[date], Query(description="First date to include (inclusive).")] = None,
+    end: Annotated[Optional[date], Query(description="Last date to include (inclusive).")] = None,
+    compress: Annotated[bool, Query(alias="gzip", description="gzip the response body (Content-Encoding: gzip).")] = False,
+    user_id: Annotated[str, Query(min_length=1, max_length=64, description="Whose nights to export.")] = DEFAULT_USER_ID,
+) -> StreamingResponse:
+    """
+    Streams a user's stored sleep history, ordered by date, as NDJSON or CSV.
+    Rows are read through a server-side cursor and written out partition by partition,
+    so memory use doesn't grow with the table.
+    """
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end.")
+
+    filename = f"sleep_export.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        stream_sleep_export(format, start=start, end=end, compress=compress, user_id=user_id, session_factory=AsyncReadSessionLocal),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers,
+    )
+
+@app.get("/ready")
+async def readiness_endpoint() -> JSONResponse:
+    """
+    Readiness probe: 503 until the startup warm-up has loaded every model the pipeline uses,
+    so a rolling deploy doesn't route traffic to an instance that would pay the model load.
+    """
+    ollama_client = app.state.ollama_client
+    ready = ollama_client.warmed_up
+    return JSONResponse(
+        {"status": "ready" if ready else "warming_up", "models": ollama_client.residency()},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint() -> PlainTextResponse:
+    """
+    Prometheus scrape target: request latency per route, pipeline stage timings, Ollama's token
+    counts and durations, pool usage and LLM parse fallbacks (see metrics.py).
+    """
+    if not metrics.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (METRICS_ENABLED=false).")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/ollama/stats")
+async def ollama_stats_endpoint(
+    ollama_client: Annotated[OllamaClient, Depends(get_ollama_client)]
+) -> Dict[str, Any]:
+    """Counters for the Ollama client (response cache hits, misses, evictions, ...)."""
+    return ollama_client.stats()
+
+async def _submit_sleep_data_async(sleep_entry_pydantic: SleepEntry, agents: PipelineAgents, job_pool: JobWorkerPool) -> JSONResponse:
+    """Stores the entry plus a pending job and hands the job to the worker pool."""
+    if not job_pool.has_capacity():
+        raise HTTPException(
+            status_code=503,
+            detail="Analysis queue is full, please retry later.",
+            headers={"Retry-After": "5"},
+        )
+    try:
+        _, job = await agents.collector.store_sleep_data_with_job(sleep_entry_pydantic)
+    except SQLAlchemyError as e:
+        print(f"Database error: {e}")
+        raise HTTPException(status_code=500, detail=f"A database error occurred: {str(e)}")
+
+    job_pool.submit(job.id)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Sleep data submitted, analysis and suggestions will be generated in the background.",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/jobs/{job.id}",
+        },
+        headers={"Location": f"/jobs/{job.id}"},
+    )
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job_endpoint(
+    job_id: str,
+    job_pool: Annotated[JobWorkerPool, Depends(get_job_pool)],
+    wait: Annotated[float, Query(ge=0, le=30, description="Long-poll: seconds to wait for the job to finish.")] = 0,
+) -> JobResponse:
+    """
+    Returns the state of an async analysis job. With wait > 0 the request is held (without a DB
+    connection) until the job finishes or the wait expires.
+    """
+    job = await job_pool.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    if wait > 0 and job.status in UNFINISHED_JOB_STATUSES:
+        await job_pool.wait_for(job_id, timeout=wait)
+        job = await job_pool.get_job(job_id)
+    return JobResponse.model_validate(job)
+
 # Final response structure is now complete as per system overview. 
\ No newline at end of file
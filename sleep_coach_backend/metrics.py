@@ -0,0 +1,305 @@
+import time
+import bisect
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from settings import get_settings
+
+# Prometheus text exposition format served by GET /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_ENABLED = get_settings().metrics_enabled
+
+# Seconds; LLM generations on CPU can take a minute or more
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKENS_PER_SECOND_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 35.0, 50.0, 75.0, 100.0, 200.0)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    """
+    A metric family with fixed label names. Updates are plain dict/list operations without locks:
+    they only happen on the event loop, so a scrape never sees a half-applied update.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in self._values.items()]
+
+class Gauge(_Metric):
+    """A value set directly, or read from a callback at scrape time (set_function)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], Dict[LabelValues, float]]] = None
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function: Callable[[], Dict[LabelValues, float]]) -> None:
+        """`function` returns {label values tuple: value}; it replaces any values set directly."""
+        self._function = function
+
+    def samples(self) -> List[str]:
+        values = self._values
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:
+                print(f"Metrics: Could not read gauge {self.name}: {e}")
+                values = {}
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket (non-cumulative, last one is +Inf), sum, count]
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, **labels: Any) -> "Timer":
+        return Timer(self, labels)
+
+    def count(self, **labels: Any) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (bucket_counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class Timer:
+    """Context manager observing the elapsed wall time of its block; works around awaits too."""
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, Any]):
+        self.histogram = histogram
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics.values())
+
+REGISTRY = MetricsRegistry()
+
+def _register(metric):
+    return REGISTRY.register(metric)
+
+# Requests and pipeline stages
+HTTP_REQUEST_SECONDS = _register(Histogram(
+    "sleep_coach_http_request_duration_seconds",
+    "HTTP request latency until the last body chunk is sent, by route template.",
+    ("method", "route", "status"),
+))
+STAGE_SECONDS = _register(Histogram(
+    "sleep_coach_stage_duration_seconds",
+    "Duration of one pipeline stage (db_store, history_summary, analyzer, coach, insight).",
+    ("stage",),
+))
+LLM_PARSE_FAILURES = _register(Counter(
+    "sleep_coach_llm_parse_failures_total",
+    "LLM outputs that needed a fallback parsing branch, by agent and branch.",
+    ("agent", "branch"),
+))
+
+# Ollama's own timings from the final response/chunk (durations are reported in nanoseconds)
+OLLAMA_PROMPT_TOKENS = _register(Counter(
+    "sleep_coach_ollama_prompt_tokens_total", "Prompt tokens evaluated by Ollama (prompt_eval_count).", ("model",),
+))
+OLLAMA_EVAL_TOKENS = _register(Counter(
+    "sleep_coach_ollama_eval_tokens_total", "Tokens generated by Ollama (eval_count).", ("model",),
+))
+OLLAMA_PROMPT_EVAL_SECONDS = _register(Histogram(
+    "sleep_coach_ollama_prompt_eval_duration_seconds", "Ollama prompt evaluation time (prompt_eval_duration).", ("model",),
+))
+OLLAMA_EVAL_SECONDS = _register(Histogram(
+    "sleep_coach_ollama_eval_duration_seconds", "Ollama generation time (eval_duration).", ("model",),
+))
+OLLAMA_LOAD_SECONDS = _register(Histogram(
+    "sleep_coach_ollama_load_duration_seconds", "Ollama model load time (load_duration), near zero when the model is resident.", ("model",),
+))
+OLLAMA_TOKENS_PER_SECOND = _register(Histogram(
+    "sleep_coach_ollama_eval_tokens_per_second", "Generation speed, eval_count / eval_duration.", ("model",),
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+))
+
+# Streams closed before Ollama's final chunk (early stop) carry no Ollama timings; what the client
+# measured is kept apart so the families above only ever hold Ollama's own numbers
+OLLAMA_EARLY_STOP_FIRST_CHUNK_SECONDS = _register(Histogram(
+    "sleep_coach_ollama_early_stop_first_chunk_seconds",
+    "Early-stopped streams: time from sending the request to the first chunk, measured by the client (includes queueing, model load and network).",
+    ("model",),
+))
+OLLAMA_EARLY_STOP_STREAM_SECONDS = _register(Histogram(
+    "sleep_coach_ollama_early_stop_stream_duration_seconds",
+    "Early-stopped streams: time from the first chunk until the stream was closed, measured by the client.",
+    ("model",),
+))
+OLLAMA_EARLY_STOP_CHUNKS = _register(Counter(
+    "sleep_coach_ollama_early_stop_chunks_total", "Early-stopped streams: chunks received before the stream was closed.", ("model",),
+))
+
+# Pool usage, read at scrape time (callbacks are installed at startup)
+DB_POOL_CHECKED_OUT = _register(Gauge(
+    "sleep_coach_db_pool_checked_out", "Database connections currently in use.", ("engine",),
+))
+DB_POOL_SIZE = _register(Gauge(
+    "sleep_coach_db_pool_size", "Database connections kept open by the pool (excluding overflow).", ("engine",),
+))
+OLLAMA_SLOTS_IN_USE = _register(Gauge(
+    "sleep_coach_ollama_slots_in_use", "Scheduler slots held by running generations.", ("model",),
+))
+OLLAMA_SLOTS = _register(Gauge(
+    "sleep_coach_ollama_slots", "Scheduler concurrency limit.", ("model",),
+))
+OLLAMA_QUEUE_DEPTH = _register(Gauge(
+    "sleep_coach_ollama_queue_depth", "Requests waiting for a scheduler slot.", ("model",),
+))
+OLLAMA_BACKEND_OUTSTANDING = _register(Gauge(
+    "sleep_coach_ollama_backend_outstanding", "Requests in flight per Ollama server.", ("backend",),
+))
+OLLAMA_BACKEND_UP = _register(Gauge(
+    "sleep_coach_ollama_backend_up", "1 while the server's circuit breaker is closed.", ("backend",),
+))
+JOB_QUEUE_DEPTH = _register(Gauge(
+    "sleep_coach_job_queue_depth", "Async analysis jobs waiting for a worker.",
+))
+
+def observe_generation(model_name: str, response_data: Dict[str, Any]) -> None:
+    """Records the timing fields of a finished Ollama response; missing fields are skipped."""
+    prompt_eval_count = response_data.get("prompt_eval_count")
+    eval_count = response_data.get("eval_count")
+    eval_duration = response_data.get("eval_duration")
+    if prompt_eval_count:
+        OLLAMA_PROMPT_TOKENS.inc(prompt_eval_count, model=model_name)
+    if eval_count:
+        OLLAMA_EVAL_TOKENS.inc(eval_count, model=model_name)
+    if response_data.get("prompt_eval_duration") is not None:
+        OLLAMA_PROMPT_EVAL_SECONDS.observe(response_data["prompt_eval_duration"] / 1e9, model=model_name)
+    if eval_duration is not None:
+        OLLAMA_EVAL_SECONDS.observe(eval_duration / 1e9, model=model_name)
+    if response_data.get("load_duration") is not None:
+        OLLAMA_LOAD_SECONDS.observe(response_data["load_duration"] / 1e9, model=model_name)
+    if eval_count and eval_duration:
+        OLLAMA_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model=model_name)
+
+def observe_early_stopped_stream(model_name: str, first_chunk_seconds: float, stream_seconds: float, chunks: int) -> None:
+    """Records a stream closed before Ollama's final chunk, with the client's own measurements."""
+    OLLAMA_EARLY_STOP_FIRST_CHUNK_SECONDS.observe(first_chunk_seconds, model=model_name)
+    OLLAMA_EARLY_STOP_STREAM_SECONDS.observe(stream_seconds, model=model_name)
+    if chunks:
+        OLLAMA_EARLY_STOP_CHUNKS.inc(chunks, model=model_name)
+
+def render() -> str:
+    return REGISTRY.render()
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware recording sleep_coach_http_request_duration_seconds. Requests are labelled
+    with the matched route template ("/jobs/{job_id}"), so ids don't blow up the label count, and
+    streamed responses are timed until their last chunk.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status_code = 500 # Unless a response is started, the request failed
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=scope["method"], route=route, status=status_code)
@@ -1,10 +1,20 @@
-from sqlalchemy import Column, Integer, DateTime, Date
+from sqlalchemy import Column, Integer, BigInteger, DateTime, Date, String, Text, JSON, UniqueConstraint, func
 from db.database import Base # Adjusted import path assuming db_models.py is in models/
 
 class SleepOrm(Base):
     __tablename__ = "sleep_entries"
+    # On PostgreSQL the table is range-partitioned by month on date (migration f3a81c6d2e57,
+    # partitions managed with python -m db.partitions). A partitioned table's unique constraints
+    # must contain the partition key, so there the physical primary key is (id, date); ids still
+    # come from one sequence and stay unique, which is what the ORM identity relies on.
+    __table_args__ = (
+        # One entry per user and night: resubmissions update the existing row (ON CONFLICT upsert).
+        # Its index also serves every per-user read (history pages, date ranges, exports).
+        UniqueConstraint("user_id", "date", name="uq_sleep_entries_user_date"),
+    )
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String(64), nullable=False)
     date = Column(Date, nullable=False)
     bedtime = Column(DateTime, nullable=False)
     waketime = Column(DateTime, nullable=False)
@@ -12,6 +22,85 @@ class SleepOrm(Base):
     rem_minutes = Column(Integer, nullable=False)
     deep_minutes = Column(Integer, nullable=False)
     core_minutes = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True)
 
     def __repr__(self):
-        return f"<SleepOrm(id={self.id}, date='{self.date}')>" 
\ No newline at end of file
+        return f"<SleepOrm(id={self.id}, user_id='{self.user_id}', date='{self.date}')>"
+
+class JobOrm(Base):
+    """Background analysis + coaching job created by POST /submit-sleep?mode=async."""
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String(32), primary_key=True)
+    # No foreign key: a partitioned sleep_entries has no unique constraint on id alone
+    sleep_entry_id = Column(Integer, nullable=False)
+    status = Column(String(16), nullable=False, index=True) # pending, running, done, failed
+    analysis = Column(JSON, nullable=True)
+    suggestions = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    lease_owner = Column(String(32), nullable=True) # Token of the claim that is running the job
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<JobOrm(id={self.id}, status='{self.status}')>"
+
+class AnalysisResultOrm(Base):
+    """
+    Latest analysis + coaching for an entry, with the fingerprint of everything that produced it
+    (entry fields, analysis settings, coach history) and the models used, by name and digest.
+    A resubmission with the same fingerprint and models is answered from here without calling Ollama.
+    """
+    __tablename__ = "analysis_results"
+
+    sleep_entry_id = Column(Integer, primary_key=True) # sleep_entries.id, unenforced like JobOrm's
+    fingerprint = Column(String(64), nullable=False)
+    analyzer_model = Column(String(128), nullable=True) # None when the analysis didn't use an LLM
+    coach_model = Column(String(128), nullable=False)
+    analyzer_model_digest = Column(String(255), nullable=True) # Ollama's digest of the model build, see OllamaClient.model_digest
+    coach_model_digest = Column(String(255), nullable=True)
+    analysis = Column(JSON, nullable=False)
+    suggestions = Column(JSON, nullable=False)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<AnalysisResultOrm(sleep_entry_id={self.sleep_entry_id}, fingerprint='{self.fingerprint[:12]}')>"
+
+class SleepHistoryVersionOrm(Base):
+    """
+    Per-user write counter behind the GET /sleep ETag. Every transaction that changes a user's
+    entries increments it (db.history.bump_history_versions), so the version only moves for
+    that user and can't be missed by a write that commits late.
+    """
+    __tablename__ = "sleep_history_versions"
+
+    user_id = Column(String(64), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+class _SleepRollupColumns:
+    """
+    Additive aggregates of the nights in one bucket (see db/rollups.py). Only sums are stored,
+    so a new night is folded in with an upsert and averages/deviations are derived at read time.
+    """
+    user_id = Column(String(64), primary_key=True)
+    bucket_start = Column(Date, primary_key=True) # The day, the Monday of the week, or the 1st of the month
+    nights = Column(Integer, nullable=False, default=0)
+    duration_minutes_sum = Column(Integer, nullable=False, default=0)
+    rem_minutes_sum = Column(Integer, nullable=False, default=0)
+    deep_minutes_sum = Column(Integer, nullable=False, default=0)
+    core_minutes_sum = Column(Integer, nullable=False, default=0)
+    sleep_debt_minutes_sum = Column(Integer, nullable=False, default=0) # Shortfall against the nightly target
+    bedtime_minutes_sum = Column(BigInteger, nullable=False, default=0) # Bedtime as minutes after noon
+    bedtime_minutes_sq_sum = Column(BigInteger, nullable=False, default=0) # For the bedtime standard deviation
+
+class DailySleepRollupOrm(_SleepRollupColumns, Base):
+    __tablename__ = "sleep_rollups_daily"
+
+class WeeklySleepRollupOrm(_SleepRollupColumns, Base):
+    __tablename__ = "sleep_rollups_weekly"
+
+class MonthlySleepRollupOrm(_SleepRollupColumns, Base):
+    __tablename__ = "sleep_rollups_monthly"
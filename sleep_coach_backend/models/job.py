@@ -0,0 +1,16 @@
+from pydantic import BaseModel, ConfigDict
+from datetime import datetime
+from typing import List, Optional
+
+class JobResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: str
+    status: str
+    sleep_entry_id: int
+    analysis: Optional[List[str]] = None
+    suggestions: Optional[List[str]] = None
+    error: Optional[str] = None
+    attempts: int
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
@@ -1,5 +1,9 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime, date
+from typing import List, Optional
+
+# Owner of entries submitted without a user_id (single-user setups, older clients)
+DEFAULT_USER_ID = "default"
 
 class SleepEntry(BaseModel):
     date: date
@@ -8,4 +12,15 @@ class SleepEntry(BaseModel):
     duration_minutes: int
     rem_minutes: int
     deep_minutes: int
-    core_minutes: int 
\ No newline at end of file
+    core_minutes: int 
+    user_id: str = Field(DEFAULT_USER_ID, min_length=1, max_length=64)
+
+class StoredSleepEntry(SleepEntry):
+    """A sleep entry as read back from the database."""
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+
+class SleepHistoryPage(BaseModel):
+    items: List[StoredSleepEntry]
+    next_cursor: Optional[str] = None # Pass as ?cursor= to get the next page, None on the last page
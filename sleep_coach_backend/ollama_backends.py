@@ -0,0 +1,227 @@
+import time
+import asyncio
+import itertools
+from typing import Optional, Dict, Any, List, Set
+
+import httpx
+
+from settings import OllamaSettings, normalize_model_name
+
+# Circuit breaker states of a backend
+BREAKER_CLOSED = "closed"       # healthy, receives traffic
+BREAKER_OPEN = "open"           # ejected after consecutive failures, no traffic until the cooldown ends
+BREAKER_HALF_OPEN = "half_open" # cooldown over, one trial request (or probe) decides
+
+# Upstream answers that mean the node is in trouble, as opposed to a bad request
+FAILURE_STATUS_CODES = (500, 502, 503, 504)
+
+class OllamaUnavailableError(httpx.RequestError):
+    """No Ollama backend can take the request: all are ejected by the circuit breaker."""
+
+class OllamaBackend:
+    """One Ollama server: its URLs, in-flight requests, loaded models and circuit breaker."""
+
+    def __init__(self, generate_url: str):
+        self.generate_url = generate_url.rstrip("/")
+        base_url = self.generate_url.removesuffix("/api/generate")
+        self.ps_url = f"{base_url}/api/ps"
+        self.tags_url = f"{base_url}/api/tags"
+        self.outstanding = 0
+        self.loaded_models: Set[str] = set()
+        self.state = BREAKER_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.last_error: Optional[str] = None
+        self.last_probe_seconds: Optional[float] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "loaded_models": sorted(self.loaded_models),
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "ejections": self.ejections,
+            "last_error": self.last_error,
+            "last_probe_seconds": round(self.last_probe_seconds, 4) if self.last_probe_seconds is not None else None,
+        }
+
+class OllamaBackendPool:
+    """
+    Routes generations across several Ollama servers. A request goes to the available backend
+    with the fewest outstanding requests, preferring (when route_by_loaded_model is on) backends
+    that already have the model in memory so nobody waits on a model load. A backend that fails
+    `failure_threshold` times in a row (connection errors, 5xx) is ejected for `cooldown_seconds`;
+    after that a single trial request or health probe decides whether it rejoins.
+    Health probes (GET /api/ps) run every `health_interval_seconds` and also refresh which
+    models each backend has loaded.
+    """
+
+    def __init__(
+        self,
+        generate_urls: List[str],
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0,
+        health_interval_seconds: float = 10.0,
+        probe_timeout_seconds: float = 2.0,
+        route_by_loaded_model: bool = True,
+    ):
+        if not generate_urls:
+            raise ValueError("At least one Ollama backend URL is required.")
+        self.backends = [OllamaBackend(url) for url in generate_urls]
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.health_interval_seconds = health_interval_seconds
+        self.probe_timeout_seconds = probe_timeout_seconds
+        self.route_by_loaded_model = route_by_loaded_model
+        self._tie_breaker = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_settings(cls, settings: OllamaSettings) -> "OllamaBackendPool":
+        """
+        OLLAMA_API_URLS is a comma-separated list of generate URLs; OLLAMA_API_URL (one backend)
+        is used when it is not set. OLLAMA_BREAKER_FAILURES, OLLAMA_BREAKER_COOLDOWN_SECONDS,
+        OLLAMA_HEALTH_INTERVAL_SECONDS and OLLAMA_ROUTE_BY_LOADED_MODEL tune the routing.
+        """
+        if not settings.api_urls:
+            raise ValueError("OLLAMA_API_URL not found in environment variables.")
+        return cls(
+            settings.api_urls,
+            failure_threshold=settings.breaker_failures,
+            cooldown_seconds=settings.breaker_cooldown_seconds,
+            health_interval_seconds=settings.health_interval_seconds,
+            route_by_loaded_model=settings.route_by_loaded_model,
+        )
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    def _is_available(self, backend: OllamaBackend) -> bool:
+        if backend.state == BREAKER_OPEN and time.monotonic() - backend.opened_at >= self.cooldown_seconds:
+            backend.state = BREAKER_HALF_OPEN
+        if backend.state == BREAKER_HALF_OPEN:
+            return not backend.trial_in_flight
+        return backend.state == BREAKER_CLOSED
+
+    def available_backends(self) -> List[OllamaBackend]:
+        return [backend for backend in self.backends if self._is_available(backend)]
+
+    def acquire(self, model_name: str, exclude: Optional[Set[OllamaBackend]] = None) -> OllamaBackend:
+        """
+        Picks a backend for one request and counts it as outstanding; pair with release().
+        Raises OllamaUnavailableError when every backend (outside `exclude`) is ejected.
+        """
+        candidates = [backend for backend in self.backends if backend not in (exclude or ()) and self._is_available(backend)]
+        if not candidates:
+            raise OllamaUnavailableError(f"No healthy Ollama backend available for model {model_name}.")
+        if self.route_by_loaded_model:
+            model_key = normalize_model_name(model_name)
+            warm = [backend for backend in candidates if model_key in backend.loaded_models]
+            candidates = warm or candidates
+        # Least outstanding requests; the rotating offset spreads ties instead of always picking the first
+        offset = next(self._tie_breaker)
+        backend = min(
+            candidates,
+            key=lambda candidate: (candidate.outstanding, (self.backends.index(candidate) - offset) % len(self.backends)),
+        )
+        if backend.state == BREAKER_HALF_OPEN:
+            backend.trial_in_flight = True
+        backend.outstanding += 1
+        backend.requests += 1
+        return backend
+
+    def release(self, backend: OllamaBackend, model_name: str, error: Optional[BaseException] = None) -> None:
+        """Ends a request from acquire(); `error` is what it failed with, if anything."""
+        backend.outstanding -= 1
+        backend.trial_in_flight = False
+        if error is None:
+            backend.loaded_models.add(normalize_model_name(model_name)) # Ollama keeps it loaded for a while
+            self._record_success(backend)
+        elif is_backend_failure(error):
+            self._record_failure(backend, error)
+        elif backend.state == BREAKER_HALF_OPEN:
+            self._record_success(backend) # The node answered; the request itself was the problem
+
+    def _record_success(self, backend: OllamaBackend) -> None:
+        if backend.state != BREAKER_CLOSED:
+            print(f"OllamaBackendPool: {backend.generate_url} is healthy again, back in rotation.")
+        backend.state = BREAKER_CLOSED
+        backend.consecutive_failures = 0
+
+    def _record_failure(self, backend: OllamaBackend, error: BaseException) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = f"{type(error).__name__}: {str(error).splitlines()[0] if str(error) else ''}"
+        if backend.state == BREAKER_HALF_OPEN or (backend.state == BREAKER_CLOSED and backend.consecutive_failures >= self.failure_threshold):
+            backend.state = BREAKER_OPEN
+            backend.opened_at = time.monotonic()
+            backend.ejections += 1
+            backend.loaded_models.clear()
+            print(f"OllamaBackendPool: Ejected {backend.generate_url} for {self.cooldown_seconds:.0f}s after {backend.consecutive_failures} failures ({backend.last_error}).")
+
+    async def probe(self, http_client: httpx.AsyncClient, backend: OllamaBackend) -> bool:
+        """Health-checks one backend with GET /api/ps and refreshes its loaded models."""
+        started = time.monotonic()
+        if backend.state == BREAKER_HALF_OPEN:
+            backend.trial_in_flight = True
+        try:
+            response = await http_client.get(backend.ps_url, timeout=self.probe_timeout_seconds)
+            response.raise_for_status()
+            models = response.json().get("models") or []
+        except (httpx.HTTPError, ValueError) as e:
+            backend.trial_in_flight = False
+            self._record_failure(backend, e)
+            return False
+        backend.trial_in_flight = False
+        backend.last_probe_seconds = time.monotonic() - started
+        backend.loaded_models = {normalize_model_name(model.get("name") or model.get("model", "")) for model in models}
+        self._record_success(backend)
+        return True
+
+    async def probe_all(self, http_client: httpx.AsyncClient) -> None:
+        # Ejected backends are left alone until their cooldown is over
+        due = [backend for backend in self.backends if backend.state != BREAKER_OPEN or self._is_available(backend)]
+        await asyncio.gather(*(self.probe(http_client, backend) for backend in due))
+
+    async def _health_loop(self, http_client: httpx.AsyncClient) -> None:
+        while True:
+            try:
+                await self.probe_all(http_client)
+            except Exception as e:
+                print(f"OllamaBackendPool: Health check round failed: {e}")
+            await asyncio.sleep(self.health_interval_seconds)
+
+    def start(self, http_client: httpx.AsyncClient) -> None:
+        """Starts the periodic health probes (no-op without an interval)."""
+        if self._health_task is None and self.health_interval_seconds > 0:
+            self._health_task = asyncio.create_task(self._health_loop(http_client))
+
+    async def stop(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {backend.generate_url: backend.stats() for backend in self.backends}
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Errors that count against a backend's circuit breaker."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in FAILURE_STATUS_CODES
+    return isinstance(error, httpx.TransportError)
+
+def is_retryable(error: BaseException) -> bool:
+    """Failures where the generation never started, so another backend can safely take over."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in (502, 503)
+    return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout))
@@ -1,35 +1,258 @@
-import os
 import httpx
 import json
-from dotenv import load_dotenv
-from typing import Optional, Dict, Any
+import time
+import asyncio
+from typing import Optional, Dict, Any, Union, AsyncIterator, List, Set, Tuple
 
-# Load .env file. Assuming it's at the project root.
-# For a file in sleep_coach_backend/, ../.env should point to the root .env
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+from settings import GenerationBudget, Settings, get_settings
+from llm_cache import LLMResponseCache
+from ollama_scheduler import OllamaScheduler
+from ollama_backends import OllamaBackend, OllamaBackendPool, OllamaUnavailableError, is_retryable, normalize_model_name
+from json_stream import JsonValueScanner
+from metrics import observe_generation, observe_early_stopped_stream
+from tracing import annotate, debug_log, start_detached_span, traced
+
+def parse_keep_alive(value: str) -> Optional[Union[str, int]]:
+    """Ollama keep_alive: a duration ("30m") or seconds (-1 keeps the model loaded); "" leaves Ollama's default."""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _timing_attributes(response_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Ollama's token counts and durations (ns) from a final response, as trace attributes in ms."""
+    attributes: Dict[str, Any] = {}
+    for field in ("prompt_eval_count", "eval_count"):
+        if response_data.get(field) is not None:
+            attributes[field] = response_data[field]
+    for field in ("load_duration", "prompt_eval_duration", "eval_duration"):
+        if response_data.get(field) is not None:
+            attributes[f"{field}_ms"] = round(response_data[field] / 1e6, 3)
+    return attributes
+
+class OllamaStreamError(Exception):
+    """Ollama reported an error inside a streamed (NDJSON) response."""
+
+class _Flight:
+    """An upstream generate call shared by every identical request waiting on it."""
+    __slots__ = ("task", "waiters", "abandoned")
+
+    def __init__(self, task: "asyncio.Task[Dict[str, Any]]"):
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False # Cancelled by its last waiter; the task only finishes on a later loop iteration
+
+    def joinable(self) -> bool:
+        return not self.abandoned and not self.task.done()
 
 class OllamaClient:
-    def __init__(self, client: httpx.AsyncClient):
-        self.api_url = os.getenv("OLLAMA_API_URL")
-        if not self.api_url:
-            raise ValueError("OLLAMA_API_URL not found in environment variables.")
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        cache: Optional[LLMResponseCache] = None,
+        scheduler: Optional[OllamaScheduler] = None,
+        backends: Optional[OllamaBackendPool] = None,
+        settings: Optional[Settings] = None,
+    ):
+        settings = settings or get_settings()
+        ollama_settings = settings.ollama
+        # One or more Ollama servers (OLLAMA_API_URLS, or OLLAMA_API_URL), load balanced with health checks
+        self.backends = backends or OllamaBackendPool.from_settings(ollama_settings)
         self.http_client = client
+        # Response cache, enabled by default (OLLAMA_CACHE_ENABLED=false turns it off)
+        if cache is None and settings.cache.enabled:
+            cache = LLMResponseCache.from_settings(settings.cache)
+        self.cache = cache
+        # Single-flight coalescing of identical in-flight requests (OLLAMA_COALESCE_ENABLED=false turns it off)
+        self.coalesce = ollama_settings.coalesce_enabled
+        # Agent instructions go in Ollama's system field, ahead of the per-request data, so every
+        # request to a model starts with the same tokens and Ollama reuses them from its KV cache.
+        # OLLAMA_SYSTEM_PROMPTS=false inlines them at the start of the prompt instead (for model
+        # templates without a system slot); the prefix stays identical either way.
+        self.system_prompts = ollama_settings.system_prompts
+        self._inflight: Dict[str, _Flight] = {}
+        self._coalesce_counters = {"upstream_calls": 0, "coalesced": 0, "abandoned": 0}
+        self._early_stops = 0
+        # Per-model admission control in front of Ollama
+        self.scheduler = scheduler or OllamaScheduler.from_settings(ollama_settings, backend_count=len(self.backends))
+        # How long Ollama keeps each model in memory after a request (sent as keep_alive).
+        # OLLAMA_MODEL_KEEP_ALIVE overrides OLLAMA_KEEP_ALIVE per model: "llama3=-1,tinyllama=10m"
+        self.default_keep_alive = parse_keep_alive(ollama_settings.keep_alive)
+        self.model_keep_alive: Dict[str, Optional[Union[str, int]]] = {
+            model_name: parse_keep_alive(keep_alive) for model_name, keep_alive in ollama_settings.model_keep_alive.items()
+        }
+        # Residency: models preloaded at startup and optionally re-pinged so they stay loaded
+        self.keep_warm_interval = ollama_settings.keep_warm_interval_seconds
+        self.warmup_timeout = ollama_settings.warmup_timeout_seconds
+        self.resident_models: List[str] = []
+        self.warmed_up = False
+        self._residency_task: Optional[asyncio.Task] = None
+        # {model: (expires at, digest)} from GET /api/tags, see model_digest()
+        self.model_digest_ttl = 60.0
+        self._model_digests: Dict[str, Tuple[float, str]] = {}
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for the client's optimizations, exposed via GET /ollama/stats."""
+        return {
+            "cache": self.cache.stats() if self.cache else None,
+            "coalescing": {**self._coalesce_counters, "in_flight": len(self._inflight)},
+            "scheduler": self.scheduler.stats(),
+            "backends": self.backends.stats(),
+            "early_stops": self._early_stops,
+        }
+
+    def keep_alive_for(self, model_name: str) -> Optional[Union[str, int]]:
+        return self.model_keep_alive.get(normalize_model_name(model_name), self.default_keep_alive)
+
+    def residency(self) -> Dict[str, List[str]]:
+        """{model: backends that have it loaded} for the resident models."""
+        return {
+            model_name: [backend.generate_url for backend in self.backends.backends if normalize_model_name(model_name) in backend.loaded_models]
+            for model_name in self.resident_models
+        }
+
+    async def preload(self, backend: OllamaBackend, model_name: str) -> bool:
+        """
+        Loads a model into one backend's memory (a generate request without a prompt) and
+        refreshes its keep_alive timer. Used for the startup warm-up and keep-warm pings.
+        """
+        payload: Dict[str, Any] = {"model": model_name, "stream": False}
+        keep_alive = self.keep_alive_for(model_name)
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        try:
+            response = await self.http_client.post(backend.generate_url, json=payload, timeout=self.warmup_timeout)
+            response.raise_for_status()
+            observe_generation(model_name, response.json()) # load_duration of the warm-up
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"OllamaClient: Could not load model {model_name} on {backend.generate_url}: {type(e).__name__} {e}")
+            return False
+        backend.loaded_models.add(normalize_model_name(model_name))
+        return True
+
+    async def model_digest(self, model_name: str) -> Optional[str]:
+        """
+        Digest of the model as installed on the available backends (GET /api/tags), cached for
+        model_digest_ttl seconds. Pulling a new build under the same name changes it. Backends
+        holding different builds give a combined identity; None when no backend reports the model.
+        """
+        model_key = normalize_model_name(model_name)
+        cached = self._model_digests.get(model_key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        digests: Set[str] = set()
+        for backend in self.backends.available_backends():
+            try:
+                response = await self.http_client.get(backend.tags_url, timeout=self.backends.probe_timeout_seconds)
+                response.raise_for_status()
+                models = response.json().get("models") or []
+            except (httpx.HTTPError, ValueError) as e:
+                debug_log(f"OllamaClient: Could not list the models of {backend.generate_url}: {type(e).__name__} {e}")
+                continue
+            digests.update(
+                model["digest"] for model in models
+                if model.get("digest") and normalize_model_name(model.get("name") or model.get("model", "")) == model_key
+            )
+        if not digests:
+            return None
+        digest = ",".join(sorted(digests))
+        self._model_digests[model_key] = (time.monotonic() + self.model_digest_ttl, digest)
+        return digest
+
+    async def warm_up(self, model_names: List[str], only_missing: bool = False) -> bool:
+        """
+        Preloads the models on every available backend (all at once) and returns whether each
+        model is now resident on at least one of them. only_missing skips models already loaded.
+        """
+        started = time.monotonic()
+        loads = [
+            (backend, model_name)
+            for backend in self.backends.available_backends()
+            for model_name in model_names
+            if not (only_missing and normalize_model_name(model_name) in backend.loaded_models)
+        ]
+        await asyncio.gather(*(self.preload(backend, model_name) for backend, model_name in loads))
+        resident = all(self.residency().get(model_name) for model_name in model_names)
+        if loads:
+            print(f"OllamaClient: Loaded {len(loads)} model/backend pairs in {time.monotonic() - started:.1f}s, all models resident: {resident}.")
+        return resident
+
+    def start_residency(self, model_names: List[str], retry_seconds: float = 10.0) -> None:
+        """
+        Warms the models up in the background; `warmed_up` (GET /ready) turns true once every
+        model is resident. Failed loads are retried every retry_seconds. Afterwards, with
+        OLLAMA_KEEP_WARM_INTERVAL_SECONDS > 0, the models are pinged so they never expire.
+        """
+        self.resident_models = list(dict.fromkeys(model_names))
+        if not self.resident_models:
+            self.warmed_up = True
+            return
+
+        async def keep_resident() -> None:
+            while True:
+                try:
+                    resident = await self.warm_up(self.resident_models, only_missing=not self.warmed_up)
+                except Exception as e:
+                    print(f"OllamaClient: Model warm-up failed: {e}")
+                    resident = False
+                if resident and not self.warmed_up:
+                    self.warmed_up = True
+                    print(f"OllamaClient: Models resident, ready for traffic: {', '.join(self.resident_models)}.")
+                if self.warmed_up and self.keep_warm_interval <= 0:
+                    return
+                await asyncio.sleep(self.keep_warm_interval if self.warmed_up else retry_seconds)
+
+        self._residency_task = asyncio.create_task(keep_resident())
+
+    async def stop_residency(self) -> None:
+        if self._residency_task is not None:
+            self._residency_task.cancel()
+            try:
+                await self._residency_task
+            except asyncio.CancelledError:
+                pass
+            self._residency_task = None
 
+    def close(self) -> None:
+        if self.cache:
+            self.cache.close()
+
+    @traced("ollama.generate")
     async def generate(
         self, 
         model_name: str, 
         prompt: str, 
         stream: bool = False,
-        output_format: Optional[str] = None # e.g., "json"
+        system: Optional[str] = None,
+        output_format: Optional[Union[str, Dict[str, Any]]] = None, # "json" or a JSON schema
+        options: Optional[Dict[str, Any]] = None,
+        use_cache: bool = True,
+        priority: str = "interactive",
+        budget: Optional[GenerationBudget] = None,
+        early_stop: bool = False,
     ) -> Dict[str, Any]:
         """
         Sends a prompt to the specified Ollama model and returns the response.
+        Non-streaming responses are served from / stored in the response cache when enabled.
         
         Args:
             model_name: The name of the Ollama model to use.
             prompt: The prompt string to send to the model.
-            stream: Whether to stream the response (default: False).
-            output_format: The desired output format (e.g., "json").
+            system: Static instructions sent as Ollama's system prompt, evaluated ahead of the
+                prompt. Keep per-request data out of it so the evaluated prefix can be reused.
+            stream: Whether to stream the response (default: False). The streamed chunks are
+                joined into one response dict; use stream_generate() to consume them incrementally.
+            output_format: The desired output format: "json", or a JSON schema dict for
+                Ollama structured outputs.
+            options: Ollama model options (e.g., {"temperature": 0}), part of the cache key.
+            use_cache: Set to False to bypass the response cache for this call.
+            priority: Scheduler priority class, "interactive" or "batch".
+            budget: Generation limits (max tokens, stop sequences, temperature) merged into options.
+            early_stop: Stream the generation internally and stop it as soon as a complete JSON
+                value has been received; the returned "response" holds just that value.
 
         Returns:
             A dictionary containing the parsed JSON response from Ollama.
@@ -38,24 +261,257 @@ class OllamaClient:
             HTTPStatusError: If the API request returns an error status code.
             RequestError: For other request-related issues (e.g., network).
             JSONDecodeError: If the response cannot be parsed as JSON.
+            OllamaOverloadedError: If the model's queue is full (answer 503 with Retry-After).
+        """
+        if budget is not None:
+            options = budget.apply(options)
+        annotate(model=model_name, priority=priority)
+
+        if stream:
+            # Aggregate the NDJSON stream into a single response dict (never cached or coalesced)
+            return await self._collect_stream(model_name, prompt, output_format, options, priority, system=system)
+
+        payload = self._build_payload(model_name, prompt, False, output_format, options, self.keep_alive_for(model_name), system)
+
+        cache_key: Optional[str] = None
+        if self.cache:
+            if use_cache:
+                cache_key = LLMResponseCache.make_key(model_name, prompt, output_format, options, system)
+                cached_response = await self.cache.get(cache_key)
+                if cached_response is not None:
+                    debug_log(f"OllamaClient: Cache hit for model {model_name}.")
+                    annotate(cache="hit")
+                    return dict(cached_response)
+            else:
+                self.cache.record_bypass()
+
+        if not self.coalesce:
+            return await self._post_generate(payload, cache_key, priority, early_stop)
+
+        # Single-flight: identical requests already in flight share one upstream call
+        request_key = cache_key or LLMResponseCache.make_key(model_name, prompt, output_format, options, system)
+        flight = self._inflight.get(request_key)
+        if flight is not None and not flight.joinable():
+            # Cancelled by its last waiter (or just finished) but not removed yet: start a new one
+            flight = None
+        if flight is None:
+            flight = _Flight(asyncio.create_task(self._post_generate(payload, cache_key, priority, early_stop)))
+            self._inflight[request_key] = flight
+            flight.task.add_done_callback(lambda task: self._end_flight(request_key, flight))
+            self._coalesce_counters["upstream_calls"] += 1
+        else:
+            self._coalesce_counters["coalesced"] += 1
+            debug_log(f"OllamaClient: Coalesced identical in-flight request for model {model_name}.")
+            annotate(coalesced=True)
+
+        flight.waiters += 1
+        try:
+            # shield() keeps a cancelled waiter (e.g. a disconnected client) from cancelling
+            # the shared call for everyone else
+            response_data = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to receive the result
+                flight.abandoned = True
+                flight.task.cancel()
+                self._coalesce_counters["abandoned"] += 1
+            raise
+        flight.waiters -= 1
+        return dict(response_data)
+
+    async def stream_generate(
+        self,
+        model_name: str,
+        prompt: str,
+        output_format: Optional[Union[str, Dict[str, Any]]] = None,
+        options: Optional[Dict[str, Any]] = None,
+        priority: str = "interactive",
+        system: Optional[str] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streams a generation, yielding each NDJSON chunk from Ollama as soon as it arrives:
+        {"response": "<text>", "done": false}, ..., then a final chunk with "done": true and timings.
+        Closing the iterator early closes the HTTP stream, which makes Ollama stop generating; Ollama's
+        timings never arrive then, so the client's own measurements go to the early-stop metrics.
+        The scheduler slot is held until the stream ends.
+
+        Raises:
+            HTTPStatusError / RequestError: As for generate().
+            OllamaStreamError: If Ollama reports an error in the middle of the stream.
+            OllamaOverloadedError: If the model's queue is full.
         """
-        payload = {
+        payload = self._build_payload(model_name, prompt, True, output_format, options, self.keep_alive_for(model_name), system)
+
+        # Not made current: the consumer may resume this generator from another context
+        stream_span = start_detached_span("ollama.stream", model=model_name, priority=priority)
+        async with self.scheduler.slot(model_name, priority):
+            sent_at = time.perf_counter()
+            backend, response = await self._send(payload, stream=True)
+            debug_log(f"OllamaClient: Streaming from model {model_name} at {backend.generate_url}.")
+            error: Optional[BaseException] = None
+            chunks = 0
+            first_chunk_at: Optional[float] = None
+            finished = False
+            try:
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
+                    chunk = json.loads(line)
+                    if "error" in chunk:
+                        raise OllamaStreamError(f"Ollama stream failed: {chunk['error']}")
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                    if chunk.get("done"):
+                        finished = True
+                        observe_generation(model_name, chunk) # The final chunk carries Ollama's timings
+                        if stream_span is not None:
+                            stream_span.attributes.update(_timing_attributes(chunk))
+                    else:
+                        chunks += 1
+                    yield chunk
+                    if chunk.get("done"):
+                        break
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                if not finished and error is None and first_chunk_at is not None:
+                    # Closed before Ollama's final chunk (early stop): record what was measured here
+                    first_chunk_seconds, stream_seconds = first_chunk_at - sent_at, time.perf_counter() - first_chunk_at
+                    observe_early_stopped_stream(model_name, first_chunk_seconds, stream_seconds, chunks)
+                    if stream_span is not None:
+                        stream_span.attributes.update(
+                            early_stop_chunks=chunks,
+                            first_chunk_ms=round(first_chunk_seconds * 1000, 3),
+                            early_stop_stream_ms=round(stream_seconds * 1000, 3),
+                        )
+                await response.aclose()
+                self.backends.release(backend, model_name, error)
+                if stream_span is not None:
+                    stream_span.attributes["backend"] = backend.generate_url
+                    stream_span.end()
+
+    async def _send(self, payload: Dict[str, Any], stream: bool) -> Tuple[OllamaBackend, httpx.Response]:
+        """
+        Posts to the backend picked by the pool. Failures where the generation never started
+        (connection refused, 502/503) move on to the next backend. The returned backend is still
+        counted as outstanding: streamed responses release it once the stream ends.
+        """
+        model_name = payload["model"]
+        tried: Set[OllamaBackend] = set()
+        last_error: Optional[httpx.HTTPError] = None
+        while True:
+            try:
+                backend = self.backends.acquire(model_name, exclude=tried)
+            except OllamaUnavailableError:
+                if last_error is not None:
+                    raise last_error
+                raise
+            try:
+                request = self.http_client.build_request("POST", backend.generate_url, json=payload, timeout=60.0) # Increased timeout
+                response = await self.http_client.send(request, stream=stream)
+                if response.is_error:
+                    if stream:
+                        await response.aread() # Make the error body available to the HTTPStatusError handlers
+                        await response.aclose()
+                    response.raise_for_status()
+            except httpx.HTTPError as e:
+                self.backends.release(backend, model_name, e)
+                if not is_retryable(e):
+                    raise
+                print(f"OllamaClient: {backend.generate_url} failed for model {model_name} ({type(e).__name__}), trying another backend.")
+                tried.add(backend)
+                last_error = e
+                continue
+            if not stream:
+                self.backends.release(backend, model_name)
+            return backend, response
+
+    async def _collect_stream(
+        self,
+        model_name: str,
+        prompt: str,
+        output_format: Optional[Union[str, Dict[str, Any]]],
+        options: Optional[Dict[str, Any]],
+        priority: str,
+        stop_at_json: bool = False,
+        system: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        parts = []
+        final_chunk: Dict[str, Any] = {}
+        scanner = JsonValueScanner() if stop_at_json else None
+        stream = self.stream_generate(model_name, prompt, output_format, options, priority, system)
+        try:
+            async for chunk in stream:
+                text = chunk.get("response", "")
+                parts.append(text)
+                final_chunk = chunk
+                if scanner is not None and scanner.feed(text) and not chunk.get("done"):
+                    # The JSON value is complete; closing the stream makes Ollama stop generating
+                    self._early_stops += 1
+                    debug_log(f"OllamaClient: Stopped generation early for model {model_name} after {len(parts)} chunks.")
+                    annotate(early_stop=True)
+                    return {**final_chunk, "response": scanner.value_text(), "done": True, "done_reason": "early_stop"}
+        finally:
+            await stream.aclose()
+        return {**final_chunk, "response": "".join(parts)}
+
+    def _build_payload(
+        self,
+        model_name: str,
+        prompt: str,
+        stream: bool,
+        output_format: Optional[Union[str, Dict[str, Any]]],
+        options: Optional[Dict[str, Any]],
+        keep_alive: Optional[Union[str, int]] = None,
+        system: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        if system and not self.system_prompts:
+            prompt = f"{system}\n\n{prompt}"
+            system = None
+        payload: Dict[str, Any] = {
             "model": model_name,
             "prompt": prompt,
             "stream": stream,
         }
+        if system:
+            payload["system"] = system
         if output_format:
             payload["format"] = output_format
-            
-        print(f"OllamaClient: Sending prompt to model {model_name} at {self.api_url}. Format: {output_format or 'text'}")
+        if options:
+            payload["options"] = options
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        return payload
+
+    def _end_flight(self, request_key: str, flight: "_Flight") -> None:
+        if self._inflight.get(request_key) is flight:
+            del self._inflight[request_key]
+        if not flight.task.cancelled():
+            flight.task.exception() # Mark as retrieved even if every waiter went away
+
+    async def _post_generate(self, payload: Dict[str, Any], cache_key: Optional[str], priority: str, early_stop: bool = False) -> Dict[str, Any]:
+        model_name = payload["model"]
+        output_format = payload.get("format")
+        debug_log(f"OllamaClient: Sending prompt to model {model_name}. Format: {'json-schema' if isinstance(output_format, dict) else output_format or 'text'}")
 
         try:
-            response = await self.http_client.post(self.api_url, json=payload, timeout=60.0) # Increased timeout
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            
-            response_data = response.json()
+            if early_stop:
+                response_data = await self._collect_stream(
+                    model_name, payload["prompt"], output_format, payload.get("options"), priority, stop_at_json=True,
+                    system=payload.get("system"),
+                )
+            else:
+                async with self.scheduler.slot(model_name, priority):
+                    backend, response = await self._send(payload, stream=False) # Raises for HTTP errors
+                response_data = response.json()
+                observe_generation(model_name, response_data)
+                annotate(backend=backend.generate_url, **_timing_attributes(response_data))
             # Log the full response for debugging if needed, then extract relevant part
             # print(f"Full Ollama Response Data: {response_data}") 
+            if cache_key and response_data.get("done", True) and response_data.get("response"):
+                await self.cache.set(cache_key, response_data)
             return response_data
             
         except httpx.HTTPStatusError as e:
@@ -0,0 +1,170 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+
+from settings import OllamaSettings, normalize_model_name
+
+# Priority classes, lower value is served first
+PRIORITIES: Dict[str, int] = {
+    "interactive": 0, # a user is waiting on the HTTP response
+    "batch": 1,       # background jobs, batch submissions, re-analysis
+}
+
+class OllamaOverloadedError(Exception):
+    """Raised when a model's queue is full. Callers should answer 503 with Retry-After."""
+
+    def __init__(self, model_name: str, retry_after: int):
+        super().__init__(f"Ollama model {model_name} is at capacity, retry after {retry_after}s.")
+        self.model_name = model_name
+        self.retry_after = retry_after
+
+class _ModelLane:
+    """Admission state for a single model: a concurrency limit and a bounded priority queue."""
+
+    def __init__(self, concurrency: int, max_queue: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        self.heap: List[Tuple[int, int, asyncio.Future]] = []
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.service_seconds_avg = 0.0 # Exponentially weighted, used for Retry-After
+
+    def queued_by_priority(self) -> Dict[str, int]:
+        names = {value: name for name, value in PRIORITIES.items()}
+        counts = {name: 0 for name in PRIORITIES}
+        for priority, _, waiter in self.heap:
+            if not waiter.done():
+                counts[names[priority]] += 1
+        return counts
+
+class OllamaScheduler:
+    """
+    Admission control in front of Ollama. Each model gets its own concurrency limit and a
+    bounded queue ordered by priority class (FIFO within a class). When the queue is full the
+    request is rejected immediately with OllamaOverloadedError instead of piling up inside Ollama.
+    """
+
+    def __init__(
+        self,
+        default_concurrency: int = 2,
+        default_max_queue: int = 32,
+        model_limits: Optional[Dict[str, Tuple[int, int]]] = None,
+    ):
+        self.default_concurrency = default_concurrency
+        self.default_max_queue = default_max_queue
+        # Keyed like the lanes, so "llama3" and "llama3:latest" configure and share one lane
+        self.model_limits = {normalize_model_name(model_name): limits for model_name, limits in (model_limits or {}).items()}
+        self._lanes: Dict[str, _ModelLane] = {}
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_settings(cls, settings: OllamaSettings, backend_count: int = 1) -> "OllamaScheduler":
+        """
+        OLLAMA_MAX_CONCURRENCY / OLLAMA_MAX_QUEUE set the per-model defaults.
+        OLLAMA_MODEL_LIMITS overrides them per model: "llama3:latest=1/8,tinyllama:latest=4/32".
+        Concurrency is per Ollama backend, so it is multiplied by backend_count; queues are shared.
+        """
+        model_limits = {
+            model_name: (concurrency * backend_count, settings.max_queue if max_queue is None else max_queue)
+            for model_name, (concurrency, max_queue) in settings.model_limits.items()
+        }
+        return cls(settings.max_concurrency * backend_count, settings.max_queue, model_limits)
+
+    def _lane(self, model_name: str) -> _ModelLane:
+        model_name = normalize_model_name(model_name)
+        lane = self._lanes.get(model_name)
+        if lane is None:
+            concurrency, max_queue = self.model_limits.get(
+                model_name, (self.default_concurrency, self.default_max_queue)
+            )
+            lane = self._lanes[model_name] = _ModelLane(concurrency, max_queue)
+        return lane
+
+    def retry_after(self, model_name: str) -> int:
+        """Rough estimate of how long until a queued request would be admitted, in whole seconds."""
+        lane = self._lane(model_name)
+        per_slot = lane.service_seconds_avg or 1.0
+        return max(1, math.ceil(per_slot * (lane.queued + 1) / lane.concurrency))
+
+    @asynccontextmanager
+    async def slot(self, model_name: str, priority: str = "interactive") -> AsyncIterator[None]:
+        """Holds one of the model's concurrency slots for the duration of the block."""
+        lane = self._lane(model_name)
+        await self._acquire(lane, model_name, PRIORITIES.get(priority, PRIORITIES["batch"]))
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            lane.service_seconds_avg = elapsed if not lane.service_seconds_avg else 0.8 * lane.service_seconds_avg + 0.2 * elapsed
+            self._release(lane)
+
+    async def _acquire(self, lane: _ModelLane, model_name: str, priority: int) -> None:
+        if lane.active < lane.concurrency and lane.queued == 0:
+            lane.active += 1
+            lane.admitted += 1
+            self._record_wait(lane, 0.0)
+            return
+        if lane.queued >= lane.max_queue:
+            lane.rejected += 1
+            raise OllamaOverloadedError(model_name, self.retry_after(model_name))
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.heap, (priority, next(self._sequence), waiter))
+        lane.queued += 1
+        enqueued = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled, pass it on
+                self._release(lane)
+            else:
+                waiter.cancel()
+                lane.queued -= 1
+            raise
+        lane.admitted += 1
+        self._record_wait(lane, time.monotonic() - enqueued)
+
+    def _release(self, lane: _ModelLane) -> None:
+        # Hand the slot directly to the next live waiter so nobody can jump the queue
+        while lane.heap:
+            _, _, waiter = heapq.heappop(lane.heap)
+            if waiter.done(): # Cancelled while queued
+                continue
+            lane.queued -= 1
+            waiter.set_result(None)
+            return
+        lane.active -= 1
+
+    @staticmethod
+    def _record_wait(lane: _ModelLane, waited: float) -> None:
+        lane.wait_count += 1
+        lane.wait_seconds_total += waited
+        lane.wait_seconds_max = max(lane.wait_seconds_max, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            model_name: {
+                "concurrency": lane.concurrency,
+                "max_queue": lane.max_queue,
+                "active": lane.active,
+                "queue_depth": lane.queued,
+                "queued_by_priority": lane.queued_by_priority(),
+                "admitted": lane.admitted,
+                "rejected": lane.rejected,
+                "avg_wait_seconds": round(lane.wait_seconds_total / lane.wait_count, 4) if lane.wait_count else 0.0,
+                "max_wait_seconds": round(lane.wait_seconds_max, 4),
+                "avg_service_seconds": round(lane.service_seconds_avg, 4),
+            }
+            for model_name, lane in self._lanes.items()
+        }
@@ -0,0 +1,35 @@
+import os
+import sys
+import asyncio
+import tempfile
+
+# The app reads its configuration at import time: point it at throwaway local resources first
+_TEST_DIR = tempfile.mkdtemp(prefix="sleep_coach_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(_TEST_DIR, 'app.db')}")
+os.environ.setdefault("DATABASE_READ_URL", "")
+os.environ.setdefault("OLLAMA_API_URL", "http://127.0.0.1:9/api/generate")
+os.environ.setdefault("OLLAMA_WARMUP_ENABLED", "false")
+os.environ.setdefault("OLLAMA_CACHE_ENABLED", "false") # Tests that need the cache create their own
+os.environ.setdefault("TRACE_FILE", os.path.join(_TEST_DIR, "traces.jsonl"))
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import pytest
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from db.database import Base
+import models.db_models  # noqa: F401  (registers the tables)
+
+@pytest.fixture
+def session_factory(tmp_path):
+    """Sessions on a fresh SQLite database with every table created. No pooling: each test runs its own event loop."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+
+    async def create() -> None:
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create())
+    yield async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    asyncio.run(engine.dispose())
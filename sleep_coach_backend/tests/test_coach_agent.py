@@ -0,0 +1,51 @@
+import asyncio
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Dict, List
+
+from agents.coach_agent import CoachAgent
+from metrics import LLM_PARSE_FAILURES
+from models.sleep_entry import SleepEntry
+
+ENTRY = SleepEntry(
+    date=date(2025, 5, 1), bedtime=datetime(2025, 5, 1, 23), waketime=datetime(2025, 5, 2, 5),
+    duration_minutes=360, rem_minutes=70, deep_minutes=40, core_minutes=250,
+)
+
+class StreamingClient:
+    """Stands in for OllamaClient.stream_generate, yielding fixed chunks and counting what was consumed."""
+
+    def __init__(self, chunks: List[str]):
+        self.chunks = chunks
+        self.consumed = 0
+        self.closed = False
+
+    async def stream_generate(self, **kwargs: Any) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            for text in self.chunks:
+                self.consumed += 1
+                yield {"response": text, "done": False}
+            yield {"response": "", "done": True}
+        finally:
+            self.closed = True
+
+def _stream_tips(client: StreamingClient) -> List[str]:
+    async def collect() -> List[str]:
+        return [tip async for tip in CoachAgent(client).stream_coaching_tips(ENTRY, ["Short total sleep"])]
+    return asyncio.run(collect())
+
+def test_streamed_tips_are_yielded_as_they_complete():
+    client = StreamingClient(['["Go to', ' bed earlier", "Skip', ' late coffee", "Dim the lights"]'])
+    assert _stream_tips(client) == ["Go to bed earlier", "Skip late coffee", "Dim the lights"]
+
+def test_a_broken_stream_is_counted_once_and_parsed_once():
+    before = LLM_PARSE_FAILURES.value(agent="coach", branch="stream_not_array")
+    client = StreamingClient(['[1 ', '2', ', 3', ']'] + [" "] * 20)
+    tips = _stream_tips(client)
+    assert LLM_PARSE_FAILURES.value(agent="coach", branch="stream_not_array") == before + 1
+    assert len(tips) == 1 and tips[0].startswith("Error: Could not parse Coach LLM JSON output")
+    assert client.consumed == len(client.chunks) # The full output was collected for the fallback
+
+def test_a_stream_breaking_after_a_tip_stops_the_generation():
+    client = StreamingClient(['["Go to bed earlier", "Skip coffee" ', 'x', ' "more"]'] + [" "] * 20)
+    assert _stream_tips(client) == ["Go to bed earlier"]
+    assert client.consumed == 2 and client.closed # Stopped at the chunk that broke the array
@@ -0,0 +1,38 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from analytics.columnar import linear_trend, period_change, streaks, to_day_number
+
+def _days(*offsets: int) -> np.ndarray:
+    first = to_day_number(date(2025, 5, 1))
+    return np.array([first + offset for offset in offsets], dtype=np.int64)
+
+def test_streaks_are_broken_by_missing_and_failed_nights():
+    days = _days(0, 1, 2, 4, 5, 6, 7, 8)
+    mask = np.array([True, True, True, True, True, False, True, True])
+    # Day 3 is missing, so days 0-2 and 4-5 are separate runs; day 6 misses the target
+    assert streaks(mask, days) == (3, 2)
+
+def test_streaks_without_a_current_run():
+    assert streaks(np.array([True, True, False]), _days(0, 1, 2)) == (2, 0)
+    assert streaks(np.array([False, False]), _days(0, 1)) == (0, 0)
+    assert streaks(np.array([], dtype=bool), _days()) == (0, 0)
+
+def test_period_change_compares_the_last_window_with_the_one_before():
+    days = _days(*range(14))
+    values = np.array([400] * 7 + [440] * 7)
+    assert period_change(values, days, int(days[-1]), 7) == pytest.approx(0.1)
+
+def test_period_change_needs_both_windows_and_a_baseline():
+    days = _days(*range(7))
+    assert period_change(np.full(7, 420), days, int(days[-1]), 7) is None
+    days = _days(*range(14))
+    assert period_change(np.array([0] * 7 + [420] * 7), days, int(days[-1]), 7) is None
+
+def test_linear_trend_is_the_slope_per_calendar_day():
+    days = _days(0, 1, 3, 6)
+    values = 400 + 5 * (days - days[0])
+    assert linear_trend(values, days) == pytest.approx(5.0)
+    assert linear_trend(np.array([420]), _days(0)) is None
@@ -0,0 +1,32 @@
+import asyncio
+from datetime import date, datetime
+
+from agents.sleep_collector import SleepCollectorAgent
+from db.history import history_version
+from models.sleep_entry import SleepEntry
+
+def _night(user_id: str, day: int, duration_minutes: int = 480) -> SleepEntry:
+    return SleepEntry(
+        user_id=user_id, date=date(2025, 5, day), bedtime=datetime(2025, 5, day, 23), waketime=datetime(2025, 5, day + 1, 7),
+        duration_minutes=duration_minutes, rem_minutes=90, deep_minutes=60, core_minutes=330,
+    )
+
+def test_history_version_moves_only_for_the_written_user(session_factory):
+    async def scenario():
+        collector = SleepCollectorAgent(session_factory)
+        async def versions():
+            async with session_factory() as session:
+                return await history_version(session, "alice"), await history_version(session, "bob")
+
+        seen = [await versions()]
+        await collector.store_sleep_data(_night("alice", 1))
+        seen.append(await versions())
+        await collector.store_sleep_data(_night("bob", 1))
+        seen.append(await versions())
+        await collector.store_sleep_data(_night("bob", 1)) # Identical resubmission
+        seen.append(await versions())
+        await collector.store_sleep_data(_night("bob", 1, duration_minutes=420))
+        seen.append(await versions())
+        return seen
+
+    assert asyncio.run(scenario()) == [("0", "0"), ("1", "0"), ("1", "1"), ("1", "1"), ("1", "2")]
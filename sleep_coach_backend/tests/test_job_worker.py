@@ -0,0 +1,132 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import job_worker
+from job_worker import JobWorkerPool, JOB_DONE, JOB_PENDING, JOB_RUNNING
+from models.db_models import JobOrm, SleepOrm
+
+def _pool(session_factory) -> JobWorkerPool:
+    return JobWorkerPool(agents=None, session_factory=session_factory, workers=1, max_queue=10)
+
+async def _add_jobs(session_factory, *jobs: JobOrm) -> None:
+    async with session_factory() as session:
+        async with session.begin():
+            session.add(SleepOrm(
+                id=1, user_id="u", date=date(2025, 5, 1), bedtime=datetime(2025, 5, 1, 23), waketime=datetime(2025, 5, 2, 7),
+                duration_minutes=480, rem_minutes=90, deep_minutes=60, core_minutes=330,
+            ))
+            session.add_all(jobs)
+
+def test_recovery_skips_jobs_with_a_live_lease(session_factory):
+    async def scenario():
+        now = job_worker._utcnow()
+        await _add_jobs(
+            session_factory,
+            JobOrm(id="pending", sleep_entry_id=1, status=JOB_PENDING, attempts=0),
+            JobOrm(id="live", sleep_entry_id=1, status=JOB_RUNNING, attempts=1, updated_at=now),
+            JobOrm(id="abandoned", sleep_entry_id=1, status=JOB_RUNNING, attempts=1, updated_at=now - timedelta(hours=1)),
+        )
+        pool = _pool(session_factory)
+        assert await pool.recover_unfinished_jobs() == 2
+        return sorted(pool.queue.get_nowait() for _ in range(pool.queue.qsize()))
+
+    assert asyncio.run(scenario()) == ["abandoned", "pending"]
+
+def test_a_job_is_claimed_only_once(session_factory):
+    async def scenario():
+        await _add_jobs(session_factory, JobOrm(id="job", sleep_entry_id=1, status=JOB_PENDING, attempts=0))
+        first, second = _pool(session_factory), _pool(session_factory)
+        claims = [await first._claim("job"), await second._claim("job")]
+        job = await first.get_job("job")
+        return claims, job.status, job.attempts, job.lease_owner
+
+    (first_claim, second_claim), status, attempts, lease_owner = asyncio.run(scenario())
+    assert first_claim is not None and second_claim is None
+    assert (status, attempts, lease_owner) == (JOB_RUNNING, 1, first_claim)
+
+def test_a_worker_that_lost_its_lease_cannot_overwrite_the_new_run(session_factory):
+    async def scenario():
+        stale = job_worker._utcnow() - timedelta(hours=1)
+        await _add_jobs(session_factory, JobOrm(id="job", sleep_entry_id=1, status=JOB_PENDING, attempts=0))
+        first, second = _pool(session_factory), _pool(session_factory)
+        first_claim = await first._claim("job")
+        async with session_factory() as session:
+            async with session.begin():
+                (await session.get(JobOrm, "job")).updated_at = stale # The first worker's lease expired
+        second_claim = await second._claim("job")
+        stored = [
+            await first._finish("job", first_claim, JOB_DONE, suggestions=["stale"]),
+            await second._finish("job", second_claim, JOB_DONE, suggestions=["fresh"]),
+        ]
+        job = await first.get_job("job")
+        return stored, job.status, job.suggestions, job.attempts
+
+    assert asyncio.run(scenario()) == ([False, True], JOB_DONE, ["fresh"], 2)
+
+def test_heartbeat_survives_errors_and_stops_when_the_lease_is_gone(session_factory, monkeypatch):
+    async def scenario():
+        await _add_jobs(session_factory, JobOrm(id="job", sleep_entry_id=1, status=JOB_PENDING, attempts=0))
+        pool = _pool(session_factory)
+        pool.lease_seconds = 0.03
+        lease_owner = await pool._claim("job")
+        calls = {"count": 0}
+        def flaky_factory():
+            calls["count"] += 1
+            if calls["count"] == 1:
+                raise ConnectionError("database unavailable")
+            return session_factory()
+
+        monkeypatch.setattr(pool, "session_factory", flaky_factory)
+        heartbeat = asyncio.create_task(pool._heartbeat("job", lease_owner))
+        await asyncio.sleep(0.05) # First beat fails, second renews the lease
+        renewals_alive = not heartbeat.done()
+        await pool._finish("job", lease_owner, JOB_DONE)
+        await asyncio.wait_for(heartbeat, timeout=1) # Ends on its own once the lease is gone
+        return renewals_alive, calls["count"] >= 3
+
+    assert asyncio.run(scenario()) == (True, True)
+
+def test_stop_hands_running_jobs_back(session_factory, monkeypatch):
+    async def scenario():
+        running = asyncio.Event()
+
+        async def slow_pipeline(*args, **kwargs):
+            running.set()
+            await asyncio.sleep(60)
+
+        monkeypatch.setattr(job_worker, "run_analysis_pipeline", slow_pipeline)
+        await _add_jobs(session_factory, JobOrm(id="job", sleep_entry_id=1, status=JOB_PENDING, attempts=0))
+        pool = _pool(session_factory)
+        await pool.start()
+        await asyncio.wait_for(running.wait(), timeout=5)
+        await pool.stop()
+        return (await pool.get_job("job")).status
+
+    assert asyncio.run(scenario()) == JOB_PENDING
+
+def test_wait_for_forgets_the_job_after_a_timeout(session_factory):
+    async def scenario():
+        await _add_jobs(session_factory, JobOrm(id="job", sleep_entry_id=1, status=JOB_PENDING, attempts=0))
+        pool = _pool(session_factory)
+        await asyncio.gather(pool.wait_for("job", timeout=0.05), pool.wait_for("job", timeout=0.1))
+        await pool.wait_for("finished-elsewhere", timeout=0.05) # Unknown or already finished: returns at once
+        return pool._finished_events, pool._waiters
+
+    assert asyncio.run(scenario()) == ({}, {})
+
+def test_finished_job_wakes_up_waiters(session_factory, monkeypatch):
+    async def scenario():
+        async def pipeline(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            return ["Short total sleep"], ["Go to bed earlier"]
+
+        monkeypatch.setattr(job_worker, "run_analysis_pipeline", pipeline)
+        await _add_jobs(session_factory, JobOrm(id="job", sleep_entry_id=1, status=JOB_PENDING, attempts=0))
+        pool = _pool(session_factory)
+        await pool.start() # Recovery enqueues the pending job
+        await pool.wait_for("job", timeout=5)
+        job = await pool.get_job("job")
+        await pool.stop()
+        return job.status, job.suggestions, pool._finished_events
+
+    assert asyncio.run(scenario()) == (JOB_DONE, ["Go to bed earlier"], {})
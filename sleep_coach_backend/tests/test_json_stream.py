@@ -0,0 +1,46 @@
+import pytest
+
+from json_stream import JsonArrayStreamParser, JsonValueScanner
+
+def _feed_all(parser: JsonArrayStreamParser, fragments):
+    return [parser.feed(fragment) for fragment in fragments]
+
+def test_array_elements_are_returned_as_soon_as_they_are_complete():
+    parser = JsonArrayStreamParser()
+    fed = _feed_all(parser, ['{"tips": [', '"Go to', ' bed earlier"', ', {"a"', ': [1, 2]}', ', 12', '3', ']', '} trailing'])
+    assert fed == [[], [], [], ["Go to bed earlier"], [], [{"a": [1, 2]}], [], [123], []]
+    assert parser.finished and parser.element_count == 3
+
+def test_scalar_at_the_end_of_the_buffer_waits_for_its_delimiter():
+    parser = JsonArrayStreamParser()
+    assert parser.feed("[1, 2") == [1]
+    assert parser.feed("0]") == [20]
+
+def test_garbage_after_an_element_raises():
+    parser = JsonArrayStreamParser()
+    with pytest.raises(ValueError):
+        parser.feed('["tip" "other"]')
+
+def test_remainder_holds_the_unparsed_text():
+    parser = JsonArrayStreamParser()
+    parser.feed('["done", "half')
+    assert not parser.finished
+    assert parser.remainder() == ', "half'
+
+@pytest.mark.parametrize("fragments, expected", [
+    (['  ["a", ', '"]"] extra'], '["a", "]"]'),
+    (['{"tips": {"x": "\\"}"', '}} and more'], '{"tips": {"x": "\\"}"}}'),
+    (['"a string', '" after'], '"a string"'),
+    (['42', '0, 1'], '420'),
+])
+def test_scanner_finds_the_end_of_the_first_value(fragments, expected):
+    scanner = JsonValueScanner()
+    completed = [scanner.feed(fragment) for fragment in fragments]
+    assert completed[-1] and not any(completed[:-1])
+    assert scanner.value_text() == expected
+
+def test_scanner_reports_incomplete_text_as_is():
+    scanner = JsonValueScanner()
+    assert not scanner.feed(' [1, {"a": 2')
+    assert not scanner.complete
+    assert scanner.value_text() == '[1, {"a": 2'
@@ -0,0 +1,61 @@
+import asyncio
+
+from llm_cache import LLMResponseCache
+
+RESPONSE = {"model": "llama3:latest", "response": '["tip"]', "done": True}
+
+def test_memory_tier_is_an_lru_with_a_ttl():
+    async def scenario():
+        cache = LLMResponseCache(max_entries=2, ttl_seconds=0.05)
+        await cache.set("a", RESPONSE)
+        await cache.set("b", RESPONSE)
+        assert await cache.get("a") == RESPONSE # "a" is now the most recently used
+        await cache.set("c", RESPONSE)          # Evicts "b"
+        assert await cache.get("b") is None
+        await asyncio.sleep(0.06)
+        assert await cache.get("a") is None     # Expired
+        return cache.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["memory_hits"] == 1 and stats["misses"] == 2
+    assert stats["evictions"] == 1 and stats["expirations"] == 1
+
+def test_disk_tier_survives_a_restart_and_is_promoted(tmp_path):
+    path = str(tmp_path / "cache.db")
+    async def scenario():
+        first = LLMResponseCache(disk_path=path)
+        await first.set("key", RESPONSE)
+        first.close()
+        restarted = LLMResponseCache(disk_path=path)
+        values = [await restarted.get("key"), await restarted.get("key")]
+        restarted.close()
+        return values, restarted.stats()
+
+    values, stats = asyncio.run(scenario())
+    assert values == [RESPONSE, RESPONSE]
+    assert stats["disk_hits"] == 1 and stats["memory_hits"] == 1
+
+def test_expired_disk_entries_are_dropped(tmp_path):
+    async def scenario():
+        cache = LLMResponseCache(ttl_seconds=0.0, disk_path=str(tmp_path / "cache.db"), disk_ttl_seconds=0.0)
+        await cache.set("key", RESPONSE)
+        value = await cache.get("key")
+        cache.close()
+        return value, cache.stats()
+
+    value, stats = asyncio.run(scenario())
+    assert value is None
+    assert stats["expirations"] == 2 and stats["misses"] == 1
+
+def test_keys_cover_every_part_of_the_request():
+    key = LLMResponseCache.make_key("llama3", "prompt", "json", {"temperature": 0})
+    assert key == LLMResponseCache.make_key("llama3", "prompt", "json", {"temperature": 0})
+    assert key == LLMResponseCache.make_key("llama3", "prompt", "json", {"temperature": 0}, system="")
+    assert len({
+        key,
+        LLMResponseCache.make_key("mistral", "prompt", "json", {"temperature": 0}),
+        LLMResponseCache.make_key("llama3", "other prompt", "json", {"temperature": 0}),
+        LLMResponseCache.make_key("llama3", "prompt", None, {"temperature": 0}),
+        LLMResponseCache.make_key("llama3", "prompt", "json", {"temperature": 0.5}),
+        LLMResponseCache.make_key("llama3", "prompt", "json", {"temperature": 0}, system="instructions"),
+    }) == 6
@@ -0,0 +1,121 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+import httpx
+
+from benchmarks.stub_ollama import StubConfig, build_app
+from ollama_backends import OllamaBackendPool, BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN
+from ollama_client import OllamaClient
+from ollama_scheduler import OllamaScheduler
+
+URLS = ["http://ollama-a/api/generate", "http://ollama-b/api/generate"]
+
+class StubBackend(httpx.AsyncBaseTransport):
+    """One stub Ollama (benchmarks/stub_ollama.py) in-process; while `down`, connections are refused."""
+
+    def __init__(self):
+        self.transport = httpx.ASGITransport(app=build_app(StubConfig(latency=0.0, tokens_per_second=0.0)))
+        self.down = False
+        self.generations = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.down:
+            raise httpx.ConnectError("Connection refused", request=request)
+        if request.url.path == "/api/generate":
+            self.generations += 1
+        return await self.transport.handle_async_request(request)
+
+def two_backends(**pool_options) -> Tuple[Dict[str, StubBackend], OllamaBackendPool, OllamaClient]:
+    stubs = {"a": StubBackend(), "b": StubBackend()}
+    http_client = httpx.AsyncClient(mounts={f"all://ollama-{name}": stub for name, stub in stubs.items()})
+    pool = OllamaBackendPool(URLS, health_interval_seconds=0, **pool_options)
+    return stubs, pool, OllamaClient(http_client, scheduler=OllamaScheduler(), backends=pool)
+
+async def _generate(client: OllamaClient, prompts: List[str], model: str = "llama3") -> None:
+    for prompt in prompts:
+        response = await client.generate(model, prompt)
+        assert response["done"]
+
+def test_requests_fail_over_to_the_healthy_backend():
+    async def scenario():
+        stubs, pool, client = two_backends(failure_threshold=10)
+        stubs["a"].down = True
+        await _generate(client, [f"night {index}" for index in range(4)])
+        return stubs, pool.stats()
+
+    stubs, stats = asyncio.run(scenario())
+    assert stubs["b"].generations == 4
+    assert stats[URLS[0]]["failures"] >= 1 and stats[URLS[0]]["state"] == BREAKER_CLOSED
+
+def test_breaker_opens_half_opens_and_closes():
+    async def scenario():
+        stubs, pool, client = two_backends(failure_threshold=2, cooldown_seconds=0.05)
+        backend_a = pool.backends[0]
+        stubs["a"].down = True
+        states = []
+        for _ in range(2):
+            await pool.probe(client.http_client, backend_a)
+        states.append(backend_a.state)
+        await _generate(client, ["while ejected 1", "while ejected 2"]) # Nothing is sent to the ejected backend
+        generations_while_open = stubs["a"].generations
+
+        await asyncio.sleep(0.06)
+        assert backend_a in pool.available_backends() # Cooldown over
+        states.append(backend_a.state)
+        await pool.probe(client.http_client, backend_a) # The trial fails: ejected again
+        states.append(backend_a.state)
+
+        await asyncio.sleep(0.06)
+        stubs["a"].down = False
+        await pool.probe(client.http_client, backend_a) # The trial succeeds: back in rotation
+        states.append(backend_a.state)
+        return states, generations_while_open, backend_a.ejections
+
+    states, generations_while_open, ejections = asyncio.run(scenario())
+    assert states == [BREAKER_OPEN, BREAKER_HALF_OPEN, BREAKER_OPEN, BREAKER_CLOSED]
+    assert generations_while_open == 0
+    assert ejections == 2
+
+def test_half_open_backend_gets_a_single_trial_request():
+    async def scenario():
+        stubs, pool, client = two_backends(failure_threshold=1, cooldown_seconds=0.05)
+        backend_a = pool.backends[0]
+        stubs["a"].down = True
+        await pool.probe(client.http_client, backend_a)
+        await asyncio.sleep(0.06)
+        trial = pool.acquire("llama3", exclude={pool.backends[1]})
+        available_during_trial = backend_a in pool.available_backends()
+        pool.release(trial, "llama3")
+        return trial is backend_a, available_during_trial, backend_a.state
+
+    assert asyncio.run(scenario()) == (True, False, BREAKER_CLOSED)
+
+def test_requests_go_to_the_backend_that_has_the_model_loaded():
+    async def scenario(route_by_loaded_model: bool):
+        stubs, pool, client = two_backends(route_by_loaded_model=route_by_loaded_model)
+        # Load the model on backend b only, behind the pool's back, and let the health probe find it
+        await client.http_client.post(URLS[1], json={"model": "llama3:latest"})
+        await pool.probe_all(client.http_client)
+        loaded = {url: stats["loaded_models"] for url, stats in pool.stats().items()}
+        stubs["b"].generations = 0
+        await _generate(client, [f"night {index}" for index in range(6)])
+        return loaded, stubs["a"].generations, stubs["b"].generations
+
+    loaded, on_a, on_b = asyncio.run(scenario(True))
+    assert loaded == {URLS[0]: [], URLS[1]: ["llama3:latest"]}
+    assert (on_a, on_b) == (0, 6)
+
+    _, on_a, on_b = asyncio.run(scenario(False))
+    assert on_a > 0 and on_b > 0
+
+def test_model_digest_comes_from_the_installed_models():
+    async def scenario():
+        stubs, pool, client = two_backends()
+        unknown = await client.model_digest("llama3")
+        await _generate(client, ["night 1"])
+        client._model_digests.clear()
+        return unknown, await client.model_digest("llama3"), await client.model_digest("llama3:latest")
+
+    unknown, digest, tagged_digest = asyncio.run(scenario())
+    assert unknown is None
+    assert digest and digest == tagged_digest
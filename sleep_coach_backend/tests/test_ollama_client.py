@@ -0,0 +1,100 @@
+import json
+import asyncio
+from typing import Any, Callable, Dict, List
+
+import httpx
+
+import metrics
+from ollama_client import OllamaClient
+from ollama_backends import OllamaBackendPool
+from ollama_scheduler import OllamaScheduler
+
+GENERATE_URL = "http://ollama.test/api/generate"
+
+class FakeOllama:
+    """httpx transport answering /api/generate after `delay` seconds; records every payload."""
+
+    def __init__(self, delay: float = 0.0, respond: Callable[[Dict[str, Any]], Dict[str, Any]] = None):
+        self.delay = delay
+        self.respond = respond or (lambda payload: {"model": payload["model"], "response": '["tip"]', "done": True})
+        self.payloads: List[Dict[str, Any]] = []
+        self.started = asyncio.Event()
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content)
+        self.payloads.append(payload)
+        self.started.set()
+        await asyncio.sleep(self.delay)
+        return httpx.Response(200, json=self.respond(payload))
+
+def make_client(fake: FakeOllama) -> OllamaClient:
+    http_client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+    return OllamaClient(http_client, scheduler=OllamaScheduler(), backends=OllamaBackendPool([GENERATE_URL], health_interval_seconds=0))
+
+def test_identical_in_flight_requests_share_one_generation():
+    async def scenario():
+        fake = FakeOllama(delay=0.05)
+        client = make_client(fake)
+        responses = await asyncio.gather(*(client.generate("llama3:latest", "same prompt") for _ in range(5)))
+        return len(fake.payloads), [response["response"] for response in responses], client.stats()["coalescing"]
+
+    upstream, responses, coalescing = asyncio.run(scenario())
+    assert upstream == 1
+    assert responses == ['["tip"]'] * 5
+    assert coalescing["upstream_calls"] == 1 and coalescing["coalesced"] == 4
+
+def test_only_identical_requests_are_coalesced_and_each_caller_gets_its_own_copy():
+    async def scenario():
+        fake = FakeOllama(delay=0.05)
+        client = make_client(fake)
+        responses = await asyncio.gather(
+            client.generate("llama3:latest", "same prompt"),
+            client.generate("llama3:latest", "same prompt"),
+            client.generate("llama3:latest", "other prompt"),
+            client.generate("llama3:latest", "same prompt", options={"temperature": 0}),
+        )
+        responses[0]["response"] = "changed by the first caller"
+        return len(fake.payloads), responses[1]["response"], client.stats()["coalescing"]
+
+    upstream, second_response, coalescing = asyncio.run(scenario())
+    assert upstream == 3
+    assert second_response == '["tip"]'
+    assert coalescing["coalesced"] == 1
+
+def test_request_after_the_last_waiter_left_starts_a_new_generation():
+    async def scenario():
+        fake = FakeOllama(delay=0.2)
+        client = make_client(fake)
+        abandoned = asyncio.create_task(client.generate("llama3:latest", "same prompt"))
+        await fake.started.wait()
+        abandoned.cancel()
+        await asyncio.sleep(0) # The waiter cancels the shared call; the call itself has not stopped yet
+        response = await client.generate("llama3:latest", "same prompt")
+        return response, len(fake.payloads), client.stats()["coalescing"]
+
+    response, upstream, coalescing = asyncio.run(scenario())
+    assert response["response"] == '["tip"]'
+    assert upstream == 2
+    assert coalescing["abandoned"] == 1 and coalescing["coalesced"] == 0
+
+def test_early_stopped_generation_records_client_timings_apart_from_ollamas():
+    chunks = ['["get', ' light"', ']', ' and then some', '']
+    async def handler(request: httpx.Request) -> httpx.Response:
+        lines = [{"response": text, "done": False} for text in chunks[:-1]]
+        lines.append({"response": chunks[-1], "done": True, "eval_count": 4, "eval_duration": 10**9, "prompt_eval_duration": 10**8})
+        return httpx.Response(200, content="\n".join(json.dumps(line) for line in lines).encode("utf-8"))
+
+    async def scenario():
+        http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client = OllamaClient(http_client, scheduler=OllamaScheduler(), backends=OllamaBackendPool([GENERATE_URL], health_interval_seconds=0))
+        return await client.generate("early-stop-model", "prompt", output_format="json", early_stop=True), client.stats()
+
+    response, stats = asyncio.run(scenario())
+    assert response["done_reason"] == "early_stop" and response["response"] == '["get light"]'
+    assert stats["early_stops"] == 1
+    assert metrics.OLLAMA_EARLY_STOP_CHUNKS.value(model="early-stop-model") == 3 # Chunks streamed before the stop
+    assert metrics.OLLAMA_EARLY_STOP_FIRST_CHUNK_SECONDS.count(model="early-stop-model") == 1
+    assert metrics.OLLAMA_EARLY_STOP_STREAM_SECONDS.count(model="early-stop-model") == 1
+    # Ollama's timing families only get Ollama's numbers, which never arrived
+    assert metrics.OLLAMA_EVAL_TOKENS.value(model="early-stop-model") == 0
+    assert metrics.OLLAMA_PROMPT_EVAL_SECONDS.count(model="early-stop-model") == 0
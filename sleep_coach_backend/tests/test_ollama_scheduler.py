@@ -0,0 +1,117 @@
+import asyncio
+from datetime import date, datetime
+
+import httpx
+import pytest
+
+import main
+from ollama_scheduler import OllamaScheduler, OllamaOverloadedError
+from settings import OllamaSettings
+
+def test_full_queue_is_rejected_with_a_retry_after():
+    async def scenario():
+        scheduler = OllamaScheduler(default_concurrency=1, default_max_queue=1)
+        release = asyncio.Event()
+        async def hold():
+            async with scheduler.slot("llama3"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(OllamaOverloadedError) as rejected:
+            async with scheduler.slot("llama3"):
+                pass
+        release.set()
+        await asyncio.gather(holder, queued)
+        return rejected.value, scheduler.stats()["llama3:latest"]
+
+    error, stats = asyncio.run(scenario())
+    assert error.model_name == "llama3" and error.retry_after >= 1
+    assert stats["admitted"] == 2 and stats["rejected"] == 1
+
+def test_interactive_requests_are_admitted_before_queued_batch_ones():
+    async def scenario():
+        scheduler = OllamaScheduler(default_concurrency=1, default_max_queue=8)
+        order = []
+        release = asyncio.Event()
+        async def request(name: str, priority: str, wait: bool = False):
+            async with scheduler.slot("llama3", priority):
+                order.append(name)
+                if wait:
+                    await release.wait()
+
+        holder = asyncio.create_task(request("holder", "batch", wait=True))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(request(name, priority)) for name, priority in (("batch 1", "batch"), ("batch 2", "batch"), ("interactive", "interactive"))]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, *waiting)
+        return order
+
+    assert asyncio.run(scenario()) == ["holder", "interactive", "batch 1", "batch 2"]
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def scenario():
+        scheduler = OllamaScheduler(default_concurrency=1, default_max_queue=1)
+        release = asyncio.Event()
+        async def hold():
+            async with scheduler.slot("llama3"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        replacement = asyncio.create_task(hold()) # Would be rejected if the cancelled waiter still counted
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(holder, replacement)
+        return scheduler.stats()["llama3:latest"]
+
+    stats = asyncio.run(scenario())
+    assert stats["rejected"] == 0 and stats["active"] == 0
+
+def test_model_limits_apply_with_or_without_the_tag(monkeypatch):
+    monkeypatch.setenv("OLLAMA_MODEL_LIMITS", "llama3=1/8,mistral:7b=3/4")
+    scheduler = OllamaScheduler.from_settings(OllamaSettings.from_env(), backend_count=2)
+    for model_name in ("llama3", "llama3:latest", "mistral:7b"):
+        scheduler._lane(model_name)
+    stats = scheduler.stats()
+    assert sorted(stats) == ["llama3:latest", "mistral:7b"]
+    assert (stats["llama3:latest"]["concurrency"], stats["llama3:latest"]["max_queue"]) == (2, 8)
+    assert (stats["mistral:7b"]["concurrency"], stats["mistral:7b"]["max_queue"]) == (6, 4)
+
+class _Collector:
+    async def store_sleep_data(self, sleep_entry):
+        return 1, "inserted"
+
+class _Agents:
+    collector = _Collector()
+
+def test_overloaded_model_answers_503_with_retry_after(monkeypatch):
+    async def overloaded_pipeline(*args, **kwargs):
+        raise OllamaOverloadedError("llama3:latest", 7)
+
+    monkeypatch.setattr(main, "run_analysis_pipeline", overloaded_pipeline)
+    main.app.dependency_overrides[main.get_agents] = lambda: _Agents()
+    main.app.dependency_overrides[main.get_job_pool] = lambda: None
+    night = {
+        "date": date(2025, 5, 1).isoformat(), "bedtime": datetime(2025, 5, 1, 23).isoformat(), "waketime": datetime(2025, 5, 2, 7).isoformat(),
+        "duration_minutes": 480, "rem_minutes": 90, "deep_minutes": 60, "core_minutes": 330,
+    }
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            return await client.post("/submit-sleep", json=night)
+
+    try:
+        response = asyncio.run(scenario())
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
@@ -0,0 +1,32 @@
+import asyncio
+from datetime import date, datetime
+
+from agents.pipeline import pipeline_fingerprint
+from agents.rule_engine import RuleEngine
+from db.results import load_stored_result, save_result
+from models.sleep_entry import SleepEntry
+
+NIGHT = SleepEntry(
+    user_id="alice", date=date(2025, 5, 1), bedtime=datetime(2025, 5, 1, 23), waketime=datetime(2025, 5, 2, 7),
+    duration_minutes=480, rem_minutes=90, deep_minutes=60, core_minutes=330,
+)
+
+def test_fingerprint_follows_the_coach_history():
+    rule_engine = RuleEngine.from_config()
+    def fingerprint(history_summary):
+        return pipeline_fingerprint(NIGHT, rule_engine, "separate", "rules", history_summary)
+
+    assert fingerprint("Last 7 nights: 6.5h average") == fingerprint("Last 7 nights: 6.5h average")
+    assert fingerprint("Last 7 nights: 6.5h average") != fingerprint("Last 7 nights: 7.0h average")
+    assert fingerprint(None) != fingerprint("Last 7 nights: 6.5h average")
+
+def test_stored_result_is_reused_only_for_the_same_model_builds(session_factory):
+    async def scenario():
+        await save_result(1, "fp", None, "llama3", None, "sha-1", ["issue"], ["tip"], session_factory=session_factory)
+        async def lookup(coach_model_digest):
+            return await load_stored_result(1, "fp", None, "llama3", None, coach_model_digest, session_factory=session_factory)
+        return await lookup("sha-1"), await lookup("sha-2"), await lookup(None)
+
+    same_build, new_build, unknown_build = asyncio.run(scenario())
+    assert same_build == (["issue"], ["tip"])
+    assert new_build is None and unknown_build is None
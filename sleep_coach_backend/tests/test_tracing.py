@@ -0,0 +1,26 @@
+import asyncio
+
+import httpx
+import pytest
+
+import tracing
+from tracing import TracingMiddleware
+
+async def _debug_flag() -> bool:
+    seen = []
+    async def app(scope, receive, send):
+        seen.append(tracing._current_trace.get().debug)
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    transport = httpx.ASGITransport(app=TracingMiddleware(app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+        response = await client.get("/", headers={"X-Debug-Prompts": "true"})
+    assert response.headers["x-trace-id"]
+    return seen[0]
+
+@pytest.mark.parametrize("allowed", [False, True])
+def test_debug_header_is_honored_only_when_allowed(monkeypatch, allowed):
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing, "TRACE_ALLOW_DEBUG_PROMPTS", allowed)
+    assert asyncio.run(_debug_flag()) is allowed
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import logging.handlers
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from metrics import STAGE_SECONDS
+from settings import get_settings
+
+_tracing = get_settings().tracing
+TRACING_ENABLED = _tracing.enabled
+TRACE_SAMPLE_RATE = _tracing.sample_rate # Fraction of traces written regardless of latency
+TRACE_SLOW_MS = _tracing.slow_ms # Traces at least this slow are always written
+TRACE_FILE = _tracing.file
+TRACE_FILE_MAX_BYTES = _tracing.file_max_bytes
+TRACE_FILE_BACKUPS = _tracing.file_backups
+# Print prompts and raw LLM output for every request (the old behaviour); otherwise only for debug requests
+LOG_PROMPTS = _tracing.log_prompts
+# Request header that turns on prompt logging for one request and always keeps its trace. Prompts carry
+# user data and kept traces cost disk, so it is ignored unless the deployment opts in.
+DEBUG_HEADER = "x-debug-prompts"
+TRACE_ALLOW_DEBUG_PROMPTS = _tracing.allow_debug_prompts
+TRACE_ID_HEADER = "x-trace-id"
+
+class Span:
+    """One timed operation inside a trace; `parent_id` links it to the enclosing span."""
+    __slots__ = ("span_id", "parent_id", "name", "started", "duration", "attributes", "events")
+
+    def __init__(self, span_id: int, parent_id: Optional[int], name: str, attributes: Dict[str, Any]):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration: Optional[float] = None
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+
+    def end(self) -> float:
+        self.duration = time.perf_counter() - self.started
+        return self.duration
+
+class Trace:
+    """
+    The spans of one request or background job. Spans are always recorded (a few perf_counter
+    calls); whether the trace is written is decided when it ends, so slow requests are kept
+    even when they were not sampled.
+    """
+
+    def __init__(self, name: str, sampled: bool, debug: bool = False, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.sampled = sampled
+        self.debug = debug
+        self.started_at = datetime.now(timezone.utc)
+        self.error: Optional[str] = None
+        self.spans: List[Span] = []
+        self.root = self.start_span(name, None, attributes or {})
+
+    def start_span(self, name: str, parent: Optional[Span], attributes: Dict[str, Any]) -> Span:
+        span = Span(len(self.spans), parent.span_id if parent is not None else None, name, attributes)
+        self.spans.append(span)
+        return span
+
+    def to_dict(self) -> Dict[str, Any]:
+        origin = self.root.started
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.started_at.isoformat(),
+            "duration_ms": _milliseconds(self.root.duration),
+            "sampled": self.sampled,
+            "debug": self.debug,
+            "error": self.error,
+            "spans": [
+                {
+                    "id": span.span_id,
+                    "parent": span.parent_id,
+                    "name": span.name,
+                    "offset_ms": _milliseconds(span.started - origin),
+                    "duration_ms": _milliseconds(span.duration),
+                    **({"attributes": span.attributes} if span.attributes else {}),
+                    **({"events": span.events} if span.events else {}),
+                }
+                for span in self.spans
+            ],
+        }
+
+def _milliseconds(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("sleep_coach_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("sleep_coach_span", default=None)
+
+class TraceWriter:
+    """
+    Appends kept traces as JSON lines to a size-rotated file. The file is written by a
+    background thread (QueueListener), so the event loop only pays for json.dumps.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._listener: Optional[logging.handlers.QueueListener] = None
+        self._logger = logging.getLogger("sleep_coach.traces")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+
+    def _start(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backups, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        records: "queue.Queue[logging.LogRecord]" = queue.Queue()
+        self._logger.addHandler(logging.handlers.QueueHandler(records))
+        self._listener = logging.handlers.QueueListener(records, file_handler)
+        self._listener.start()
+        print(f"Tracing: Writing kept traces to {os.path.abspath(self.path)}.")
+
+    def write(self, trace: Trace) -> None:
+        if self._listener is None:
+            self._start()
+        self._logger.info(json.dumps(trace.to_dict(), default=str))
+
+    def close(self) -> None:
+        """Flushes queued traces; called at shutdown."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+            for handler in list(self._logger.handlers):
+                self._logger.removeHandler(handler)
+
+writer = TraceWriter(TRACE_FILE, TRACE_FILE_MAX_BYTES, TRACE_FILE_BACKUPS)
+
+def _should_keep(trace: Trace) -> bool:
+    return trace.sampled or trace.debug or trace.error is not None or (trace.root.duration or 0) * 1000 >= TRACE_SLOW_MS
+
+@contextmanager
+def trace(name: str, debug: bool = False, **attributes: Any) -> Iterator[Optional[Trace]]:
+    """
+    Runs the block as a new trace (one request or job). Written to TRACE_FILE when sampled,
+    slower than TRACE_SLOW_MS, failed, or requested with debug.
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Trace(name, sampled=random.random() < TRACE_SAMPLE_RATE, debug=debug, attributes=attributes)
+    trace_token = _current_trace.set(current)
+    span_token = _current_span.set(current.root)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+        current.root.end()
+        if _should_keep(current):
+            try:
+                writer.write(current)
+            except Exception as e:
+                print(f"Tracing: Could not write trace {current.trace_id}: {e}")
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Times the block as a child of the current span; a no-op outside a trace."""
+    current = _current_trace.get()
+    if current is None:
+        yield None
+        return
+    child = current.start_span(name, _current_span.get(), attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+@contextmanager
+def stage(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """A pipeline stage: a span that is also recorded in sleep_coach_stage_duration_seconds."""
+    started = time.perf_counter()
+    try:
+        with span(name, **attributes) as stage_span:
+            yield stage_span
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+def start_detached_span(name: str, **attributes: Any) -> Optional[Span]:
+    """
+    A span that is not made current, for async generators (which may be resumed from another
+    context); end it with span.end(). None outside a trace.
+    """
+    current = _current_trace.get()
+    if current is None:
+        return None
+    return current.start_span(name, _current_span.get(), attributes)
+
+def traced(name: str) -> Callable:
+    """Decorator running a coroutine function inside span(name)."""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return await function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(**attributes: Any) -> None:
+    """Adds attributes to the current span (model, cache outcome, token counts, ...)."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def current_trace_id() -> Optional[str]:
+    current = _current_trace.get()
+    return current.trace_id if current is not None else None
+
+def debug_enabled() -> bool:
+    if LOG_PROMPTS:
+        return True
+    current = _current_trace.get()
+    return current is not None and current.debug
+
+def debug_log(message: str) -> None:
+    """
+    Verbose output (prompts, raw LLM output): printed with LOG_PROMPTS=true or for a debug request,
+    and kept as an event of the current span when the request asked for debugging.
+    """
+    if not debug_enabled():
+        return
+    print(message)
+    current_span = _current_span.get()
+    current = _current_trace.get()
+    if current is not None and current.debug and current_span is not None:
+        current_span.events.append({"offset_ms": _milliseconds(time.perf_counter() - current.root.started), "message": message})
+
+def shutdown() -> None:
+    writer.close()
+
+class TracingMiddleware:
+    """
+    ASGI middleware that runs every HTTP request as a trace named "<method> <route template>"
+    and returns its id in X-Trace-Id. With TRACE_ALLOW_DEBUG_PROMPTS=true, `X-Debug-Prompts: true`
+    logs that request's prompts and raw LLM output and always keeps its trace.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        debug = TRACE_ALLOW_DEBUG_PROMPTS and headers.get(DEBUG_HEADER.encode("latin-1"), b"").decode("latin-1").lower() in ("1", "true", "yes")
+
+        with trace(f"{scope['method']} {scope['path']}", debug=debug) as request_trace:
+            async def send_with_trace_id(message: Dict[str, Any]) -> None:
+                if message["type"] == "http.response.start":
+                    request_trace.root.attributes["status"] = message["status"]
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(TRACE_ID_HEADER.encode("latin-1"), request_trace.trace_id.encode("latin-1"))]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                # Name the trace after the route template so traces of one endpoint group together
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    request_trace.name = request_trace.root.name = f"{scope['method']} {route}"
+                request_trace.root.attributes["path"] = scope["path"]